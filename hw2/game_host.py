@@ -0,0 +1,282 @@
+# game_host.py
+# Usage: python game_host.py [controlPort] [shards]
+# Runs many Tetris matches per process instead of one game_server.py per room.
+# The lobby sends CREATE_MATCH to controlPort; each match goes to the least
+# loaded of `shards` worker processes (default: CPU count). A worker runs all
+# of its matches on one asyncio loop with one shared tick, and every match
+# listens on its own port, so clients connect exactly as to game_server.py.
+import asyncio, json, multiprocessing, os, socket, sys, threading, time
+from utils import recv_msg, send_msg, encode_msg, _MAX, _HDR
+from tetris_engine import Match, TICK_MS, SNAPSHOT_INTERVAL, LOBBY_ADDR
+
+HOST='0.0.0.0'            # matches listen on all interfaces, like game_server.py
+CONTROL_HOST='127.0.0.1'  # only the lobby talks to the control port
+CONTROL_PORT=13100
+MATCH_LINGER=5            # seconds a finished match stays open (clients leave on GAME_OVER)
+IDLE_TIMEOUT=300          # close a match that has had no players this long
+MAX_BACKLOG=1<<20         # unsent bytes before a slow client is dropped
+
+async def read_msg(reader):
+    hdr=await reader.readexactly(_HDR.size)
+    (length,)=_HDR.unpack(hdr)
+    if length<=0 or length>_MAX:
+        raise ValueError("invalid length")
+    return json.loads(await reader.readexactly(length))
+
+async def report_to_lobby(report):
+    # 回報 Lobby
+    try:
+        _, writer=await asyncio.open_connection(*LOBBY_ADDR)
+        writer.write(encode_msg(report))
+        await writer.drain()
+        writer.close()
+    except Exception:
+        pass
+
+# ---------- One match ----------
+class HostedMatch:
+    """A Match with its listening server and connected clients.
+    Lives on its shard's event loop; nothing here blocks."""
+    def __init__(self, match, port):
+        self.match=match; self.port=port
+        self.server=None
+        self.players={}     # writer -> pid
+        self.spectators={}  # writer -> spectator_info (userId, name)
+        self.idle_since=time.time()  # no players connected since
+        self.ended_at=None
+
+    def send(self, writer, frame):
+        transport=writer.transport
+        if transport.is_closing(): return
+        if transport.get_write_buffer_size() > MAX_BACKLOG:
+            transport.abort(); return  # too far behind; its handler cleans up
+        writer.write(frame)
+
+    def broadcast(self, obj, players_only=False, exclude=None):
+        frame=encode_msg(obj)  # encode once for every receiver
+        receivers=list(self.players) if players_only else list(self.players)+list(self.spectators)
+        for w in receivers:
+            if w is not exclude: self.send(w, frame)
+
+    async def serve(self, reader, writer):
+        try:
+            hello=await read_msg(reader)
+        except Exception:
+            writer.close(); return
+        if hello.get('type')!='HELLO':
+            self.send(writer, encode_msg({'type':'ERR','error':'expected HELLO'})); writer.close(); return
+        m=self.match
+
+        if hello.get('spectator', False):
+            self.spectators[writer]={'userId': hello.get('userId'), 'name': hello.get('userName', 'Spectator')}
+            self.send(writer, encode_msg(m.spectator_welcome()))
+            print(f"[Game] Spectator connected: room={m.room_id} userId={hello.get('userId')}")
+            # send them current state immediately
+            for snap in m.snapshots(): self.send(writer, encode_msg(snap))
+            try:
+                while True:
+                    await read_msg(reader)  # Ignore any messages from spectators
+            except Exception:
+                pass
+            finally:
+                self.spectators.pop(writer, None)
+                writer.close()
+            return
+
+        pid=m.add_player(hello)
+        if pid is None:
+            self.send(writer, encode_msg({'type':'ERR','error':'room full'})); writer.close(); return
+        self.players[writer]=pid; self.idle_since=None
+        self.send(writer, encode_msg(m.welcome(pid)))
+        print(f"[Game] Sent WELCOME to room={m.room_id} pid={pid} role=P{pid+1}")
+        # tell the players already seated about the new one
+        if len(m.states) > 1:
+            self.broadcast({'type':'PLAYER_UPDATE','players':m.players_info()}, players_only=True, exclude=writer)
+        try:
+            while True:
+                msg=await read_msg(reader)
+                if msg.get('type')=='INPUT': m.queue_input(pid,msg)
+        except Exception:
+            pass
+        finally:
+            if self.players.pop(writer, None) is not None:
+                m.remove_player(pid)
+            if not self.players: self.idle_since=time.time()
+            writer.close()
+
+    def tick(self, snap_due):
+        """Returns a lobby report when the match ended on this tick"""
+        report=None
+        if self.match.step():
+            game_over, report=self.match.finish()
+            self.broadcast(game_over)
+            self.ended_at=time.time()
+        if snap_due:
+            for snap in self.match.snapshots(): self.broadcast(snap)
+        return report
+
+    def expired(self, now):
+        if self.ended_at is not None:
+            return now-self.ended_at >= MATCH_LINGER
+        return self.idle_since is not None and now-self.idle_since >= IDLE_TIMEOUT
+
+    def close(self):
+        self.server.close()
+        for w in list(self.players)+list(self.spectators):
+            w.transport.abort()
+
+# ---------- One worker process ----------
+class Shard:
+    """All matches of one worker process, driven by a single tick"""
+    def __init__(self, index, conn, loads):
+        self.index=index
+        self.conn=conn      # Pipe to the parent: one request, one reply
+        self.loads=loads    # shared Array: live matches per shard
+        self.matches={}     # roomId -> HostedMatch
+        self.tasks=set()
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        loop=asyncio.get_running_loop()
+        self.done=loop.create_future()
+        loop.add_reader(self.conn.fileno(), self.on_control)
+        ticker=loop.create_task(self.tick_loop())
+        await self.done
+        ticker.cancel()
+        for hosted in self.matches.values(): hosted.close()
+
+    def spawn(self, coro):
+        task=asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task); task.add_done_callback(self.tasks.discard)
+
+    def on_control(self):
+        try:
+            req=self.conn.recv()
+        except (EOFError, OSError):
+            # parent is gone
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            if not self.done.done(): self.done.set_result(None)
+            return
+        self.spawn(self.handle(req))
+
+    async def handle(self, req):
+        d=req.get('data', {})
+        try:
+            if req.get('type')=='CREATE_MATCH':
+                port=await self.create(int(d['roomId']), d.get('mode','timed'), int(d.get('durationSec', 60)))
+                resp={'ok':True,'port':port}
+            else:
+                resp={'ok':False,'error':'unknown type'}
+        except Exception as e:
+            resp={'ok':False,'error':str(e)}
+        self.conn.send(resp)
+
+    async def create(self, room_id, mode, duration):
+        old=self.matches.pop(room_id, None)
+        if old: old.close()
+        s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        try:
+            s.bind((HOST,0)); s.listen(16)
+            hosted=HostedMatch(Match(room_id, mode, duration), s.getsockname()[1])
+            hosted.server=await asyncio.start_server(hosted.serve, sock=s)
+        except Exception:
+            s.close(); raise
+        self.matches[room_id]=hosted
+        self.loads[self.index]=len(self.matches)
+        print(f"[Host{self.index}] room={room_id} on port {hosted.port} mode={mode} dur={duration}s ({len(self.matches)} matches)")
+        return hosted.port
+
+    async def tick_loop(self):
+        # one timer for every match: TICK_MS steps, snapshots every SNAPSHOT_INTERVAL
+        loop=asyncio.get_running_loop()
+        tick=TICK_MS/1000.0
+        next_tick=loop.time(); next_snap=next_tick
+        while True:
+            snap_due=loop.time() >= next_snap
+            if snap_due: next_snap+=SNAPSHOT_INTERVAL
+            for room_id, hosted in list(self.matches.items()):
+                try:
+                    report=hosted.tick(snap_due)
+                except Exception as e:
+                    print(f"[Host{self.index}] room={room_id} failed: {e}")
+                    self.remove(room_id); continue
+                if report: self.spawn(report_to_lobby(report))
+            now=time.time()
+            for room_id, hosted in list(self.matches.items()):
+                if hosted.expired(now): self.remove(room_id)
+
+            next_tick+=tick
+            delay=next_tick-loop.time()
+            if delay < 0:
+                # fell behind; don't burst ticks to catch up
+                next_tick=loop.time(); next_snap=max(next_snap, next_tick); delay=0
+            await asyncio.sleep(delay)
+
+    def remove(self, room_id):
+        hosted=self.matches.pop(room_id, None)
+        if hosted: hosted.close()
+        self.loads[self.index]=len(self.matches)
+
+def _run_shard(index, conn, loads):
+    Shard(index, conn, loads).run()
+
+# ---------- Parent: control port ----------
+class GameHost:
+    def __init__(self, shards):
+        self.loads=multiprocessing.Array('i', shards)
+        self.workers=[]  # (process, pipe, lock)
+        for i in range(shards):
+            parent_conn, child_conn=multiprocessing.Pipe()
+            p=multiprocessing.Process(target=_run_shard, args=(i, child_conn, self.loads), daemon=True)
+            p.start(); child_conn.close()
+            self.workers.append((p, parent_conn, threading.Lock()))
+
+    def create_match(self, data):
+        # least loaded shard first; skip a shard whose process died
+        order=sorted(range(len(self.workers)), key=lambda i: self.loads[i])
+        for i in order:
+            p, pipe, lock=self.workers[i]
+            if not p.is_alive(): continue
+            try:
+                with lock:
+                    pipe.send({'type':'CREATE_MATCH','data':data})
+                    return pipe.recv()
+            except (EOFError, OSError):
+                continue
+        return {'ok':False,'error':'no game host shard available'}
+
+    def handle_control(self, conn):
+        try:
+            while True:
+                req=recv_msg(conn)
+                t=req.get('type')
+                if t=='CREATE_MATCH':
+                    send_msg(conn, {'type':'CREATE_MATCH_RESP','data':self.create_match(req.get('data', {}))})
+                elif t=='STATS':
+                    send_msg(conn, {'type':'STATS_RESP','data':{'ok':True,'matches':list(self.loads)}})
+                else:
+                    send_msg(conn, {'type':'ERR','error':'unknown type'})
+        except Exception:
+            pass
+        finally:
+            conn.close()
+
+def main():
+    port=int(sys.argv[1]) if len(sys.argv) > 1 else CONTROL_PORT
+    shards=int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    host=GameHost(shards)  # start workers before any thread exists
+    s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((CONTROL_HOST,port)); s.listen(16)
+    print(f"Game host on {CONTROL_HOST}:{port} shards={shards}")
+    try:
+        while True:
+            c,a=s.accept()
+            threading.Thread(target=host.handle_control, args=(c,), daemon=True).start()
+    finally:
+        s.close()
+
+if __name__=='__main__':
+    main()
@@ -1,11 +1,13 @@
 # lobby_server.py
-import socket, threading, json, time, random, subprocess, os
+import socket, threading, json, time, subprocess, os
 from utils import send_msg, recv_msg
 
 DB_HOST = "127.0.0.1"
 DB_PORT = 12000
 LOBBY_HOST = "0.0.0.0"  # Listen on all interfaces for remote connections
 LOBBY_PORT = 13000
+GAME_HOST = "127.0.0.1"
+GAME_HOST_PORT = 13100  # game_host.py control port (optional)
 
 # Get the public hostname for Game Server connections
 # Can be overridden with environment variable PUBLIC_HOST
@@ -48,22 +50,43 @@ def _broadcast_room(room, payload):
             try: send_msg(clients[uid][0], payload)
             except: pass
 
-def _spawn_game_server(rid, mode, durationSec):
-    port = random.randint(10000, 20000)
-    # game_server.py expects positional args: <port> <roomId> <mode> <durationSec>
-    cmd = ["python3", "game_server.py", str(port), str(rid), mode, str(int(durationSec))]
-    # 啟動後等待連得上再回
-    subprocess.Popen(cmd)
-    for _ in range(40):  # 最多約12秒
+def _host_match(rid, mode, durationSec, timeout=5.0):
+    """Ask game_host.py for a match; returns its port, or None if no host is running."""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        s.connect((GAME_HOST, GAME_HOST_PORT))
         try:
-            t = socket.socket()
-            t.settimeout(0.3)
-            t.connect(("127.0.0.1", port))
-            t.close()
-            return port
-        except:
-            time.sleep(0.3)
-    raise RuntimeError("game server not ready")
+            send_msg(s, {'type':'CREATE_MATCH','data':{'roomId':rid,'mode':mode,'durationSec':int(durationSec)}})
+            data = recv_msg(s).get('data', {})
+        finally:
+            s.close()
+    except OSError:
+        return None
+    if not data.get('ok'):
+        print(f"[Lobby] Game host refused room {rid}: {data.get('error')}")
+        return None
+    return data['port']
+
+def _spawn_game_server(rid, mode, durationSec):
+    # Many matches share a game_host.py process when one is running
+    port = _host_match(rid, mode, durationSec)
+    if port:
+        return port
+    # Otherwise one game_server.py per room.
+    # Bind and listen here, then hand the socket to the child by inheritance:
+    # the kernel picks a free port (no probing, no collisions) and clients can
+    # connect right away -- the backlog holds them until the child accepts
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((LOBBY_HOST, 0)); s.listen(4)
+        port = s.getsockname()[1]
+        # game_server.py expects positional args: <port> <roomId> <mode> <durationSec> [listenFd]
+        cmd = ["python3", "game_server.py", str(port), str(rid), mode, str(int(durationSec)), str(s.fileno())]
+        subprocess.Popen(cmd, pass_fds=(s.fileno(),))
+    finally:
+        s.close()  # the child keeps its own copy
+    return port
 
 # --------------------- per-client thread -------------
 def handle_client(conn, addr):
@@ -0,0 +1,261 @@
+# tetris_engine.py
+# Tetris rules and per-match state, shared by game_server.py (one match per
+# process, threads) and game_host.py (many matches per process, event loop).
+# Nothing here touches sockets.
+import time, random
+
+BOARD_W, BOARD_H = 10, 20
+TICK_MS=50
+SNAPSHOT_INTERVAL=0.10
+GRAVITY_MS=1000
+LOCK_DELAY_MS=500
+BAG = ['I','O','T','J','L','S','Z']
+SCORES = {0:0,1:100,2:300,3:500,4:800}
+LOBBY_ADDR = ('127.0.0.1', 13000)  # GAME_OVER_REPORT goes here
+
+TET = {
+ 'I':[[(0,1),(1,1),(2,1),(3,1)],[(2,0),(2,1),(2,2),(2,3)],[(0,2),(1,2),(2,2),(3,2)],[(1,0),(1,1),(1,2),(1,3)]],
+ 'O':[[(1,0),(2,0),(1,1),(2,1)]]*4,
+ 'T':[[(1,0),(0,1),(1,1),(2,1)],[(1,0),(1,1),(2,1),(1,2)],[(0,1),(1,1),(2,1),(1,2)],[(1,0),(0,1),(1,1),(1,2)]],
+ 'J':[[(0,0),(0,1),(1,1),(2,1)],[(1,0),(2,0),(1,1),(1,2)],[(0,1),(1,1),(2,1),(2,2)],[(1,0),(1,1),(0,2),(1,2)]],
+ 'L':[[(2,0),(0,1),(1,1),(2,1)],[(1,0),(1,1),(1,2),(2,2)],[(0,1),(1,1),(2,1),(0,2)],[(0,0),(1,0),(1,1),(1,2)]],
+ 'S':[[(1,0),(2,0),(0,1),(1,1)],[(1,0),(1,1),(2,1),(2,2)],[(1,1),(2,1),(0,2),(1,2)],[(0,0),(0,1),(1,1),(1,2)]],
+ 'Z':[[(0,0),(1,0),(1,1),(2,1)],[(2,0),(1,1),(2,1),(1,2)],[(0,1),(1,1),(1,2),(2,2)],[(1,0),(0,1),(1,1),(0,2)]],
+}
+
+def empty_board(): return [['.' for _ in range(BOARD_W)] for __ in range(BOARD_H)]
+def cells(shape, rot, x, y): return [(x+cx, y+cy) for (cx,cy) in TET[shape][rot%len(TET[shape])]]
+def inb(x,y): return 0<=x<BOARD_W and 0<=y<BOARD_H
+def collide(board, shape, rot, x, y):
+    for (xx,yy) in cells(shape,rot,x,y):
+        if yy < 0: continue
+        if not inb(xx,yy) or board[yy][xx] != '.': return True
+    return False
+def line_clear(board):
+    cleared=0; nb=[]
+    for row in board:
+        if all(c!='.' for c in row): cleared+=1
+        else: nb.append(row)
+    for _ in range(cleared): nb.insert(0,['.' for _ in range(BOARD_W)])
+    return nb, cleared
+def lock_piece(board, shape, rot, x, y):
+    for (xx,yy) in cells(shape,rot,x,y):
+        if 0<=yy<BOARD_H and 0<=xx<BOARD_W: board[yy][xx]=shape
+    new_board, cleared = line_clear(board)
+    # detect top-out: if any cell in the top row is filled after locking, caller
+    # should mark the player as dead in survival mode. We return the board and
+    # cleared count; callers will check the top row and set 'alive'=False when needed.
+    return new_board, cleared
+
+def refill_bag(bag):
+    """Refill a match's shared bag with a shuffled set of all 7 pieces (Fisher-Yates)"""
+    if not bag:
+        b = BAG[:]
+        random.shuffle(b)  # Fisher-Yates shuffle
+        bag.extend(b)
+        print(f"[Game] Refilled shared bag: {bag}")
+
+def spawn(state, bag, check_topout=True):
+    refill_bag(bag)
+    state['shape'] = bag.pop(0)  # Take from shared bag
+    state['rot']=0; state['x']=3; state['y']=-1
+    if state['next']: state['next'].pop(0)
+    while len(state['next'])<5:
+        refill_bag(bag)
+        state['next'].append(bag[0])
+    # Top-out detection: check if any part of the new piece that would be in bounds
+    # overlaps with existing blocks, indicating the playfield is full
+    # Skip this check during initial spawn (board is empty)
+    if check_topout:
+        for (cx, cy) in cells(state['shape'], state['rot'], state['x'], state['y']):
+            # Only check cells that are within the visible board
+            if 0 <= cy < BOARD_H and 0 <= cx < BOARD_W:
+                if state['board'][cy][cx] != '.':
+                    state['alive'] = False
+                    return
+
+def rotate_kick(board,state):
+    new=(state['rot']+1)%4
+    for dx in [0,-1,1,-2,2]:
+        if not collide(board,state['shape'],new,state['x']+dx,state['y']):
+            state['rot']=new; state['x']+=dx; return
+
+def hard_drop(state, bag):
+    y=state['y']
+    while not collide(state['board'],state['shape'],state['rot'],state['x'],y+1):
+        y+=1
+    state['y']=y
+    state['board'],cleared=lock_piece(state['board'],state['shape'],state['rot'],state['x'],state['y'])
+    state['score']+=SCORES.get(cleared,0); state['lines']+=cleared
+    # top-out detection: if any block occupies the top 2 rows after locking, mark dead
+    # Standard Tetris: game over if blocks reach the spawn zone (top rows)
+    try:
+        if any(c != '.' for c in state['board'][0]) or any(c != '.' for c in state['board'][1]):
+            state['alive'] = False
+    except Exception:
+        pass
+    state['lock_until']=None; spawn(state, bag)
+
+def soft_one(state):
+    if not collide(state['board'],state['shape'],state['rot'],state['x'],state['y']+1):
+        state['y']+=1; state['score']+=1
+
+def move_x(state,dx):
+    nx=state['x']+dx
+    if not collide(state['board'],state['shape'],state['rot'],nx,state['y']): state['x']=nx
+
+def try_lock(state, now_ms, bag):
+    if collide(state['board'],state['shape'],state['rot'],state['x'],state['y']+1):
+        if state['lock_until'] is None: state['lock_until']=now_ms+LOCK_DELAY_MS
+        elif now_ms>=state['lock_until']:
+            state['board'],cleared=lock_piece(state['board'],state['shape'],state['rot'],state['x'],state['y'])
+            state['score']+=SCORES.get(cleared,0); state['lines']+=cleared
+            # top-out detection after locking
+            try:
+                if any(c != '.' for c in state['board'][0]) or any(c != '.' for c in state['board'][1]):
+                    state['alive'] = False
+            except Exception:
+                pass
+            state['lock_until']=None; spawn(state, bag)
+    else:
+        state['lock_until']=None
+
+# ---------- Match ----------
+class Match:
+    """One room's game: player states, queued inputs and the shared bag.
+    Not thread-safe -- game_server.py guards it with its lock, game_host.py
+    only touches it from its event loop."""
+    def __init__(self, room_id, mode, duration):
+        self.room_id=room_id; self.mode=mode; self.duration=duration
+        self.states={}    # pid -> state
+        self.inputs=[]    # (pid,msg)
+        self.bag=[]       # shared by all players (7-bag + Fisher-Yates)
+        self.start_ms=int(time.time()*1000)
+        self.ended=False
+
+    def init_player(self, pid):
+        st={'id':pid,'board':empty_board(),'next':[],'shape':None,'rot':0,'x':3,'y':-1,
+            'score':0,'lines':0,'level':1,'alive':True,'last_drop':int(time.time()*1000),
+            'drop_ms':GRAVITY_MS,'lock_until':None}
+        # Fill next preview from shared bag
+        for _ in range(5):
+            refill_bag(self.bag)
+            st['next'].append(self.bag[0])
+        spawn(st, self.bag, check_topout=False); return st  # Don't check topout on initial spawn (board is empty)
+
+    def add_player(self, hello):
+        """Seat a player from its HELLO; returns the pid, or None if the room is full"""
+        if len(self.states)>=2: return None
+        pid=0
+        while pid in self.states: pid+=1
+        st=self.states[pid]=self.init_player(pid)
+        # record client's real user id and name if provided in HELLO
+        real_uid=hello.get('userId'); user_name=hello.get('userName')
+        if real_uid is not None:
+            st['userId']=real_uid
+            if user_name: st['userName']=user_name
+            print(f"[Game] Recorded real userId={real_uid} name={user_name} for pid={pid}")
+        else:
+            print(f"[Game] WARNING: No userId in HELLO for pid={pid}")
+        return pid
+
+    def remove_player(self, pid):
+        self.states.pop(pid, None)
+
+    def queue_input(self, pid, msg):
+        self.inputs.append((pid,msg))
+
+    def players_info(self):
+        return {p: {'userId': st.get('userId', p), 'userName': st.get('userName', f'Player{p+1}')}
+                for p, st in self.states.items()}
+
+    def welcome(self, pid):
+        return {'type':'WELCOME','role':f'P{pid+1}','seed':random.randint(1,10**9),
+                'bagRule':'7bag','gravityPlan':{'mode':'fixed','dropMs':GRAVITY_MS},
+                'mode':self.mode,'durationSec':self.duration,'players':self.players_info()}
+
+    def spectator_welcome(self):
+        return {'type':'WELCOME','role':'SPECTATOR','mode':self.mode,'durationSec':self.duration,
+                'players':self.players_info()}
+
+    def build_snap(self, pid):
+        st=self.states.get(pid)
+        if not st: return None
+        return {'type':'SNAPSHOT','tick':int(time.time()*1000),'userId':pid,'board':st['board'],
+                'active':{'shape':st['shape'],'x':st['x'],'y':st['y'],'rot':st['rot']},
+                'next':st['next'][:3],'score':st['score'],'lines':st['lines'],
+                'alive':st['alive'],'mode':self.mode,'durationSec':self.duration,
+                'at':int(time.time()*1000)}
+
+    def snapshots(self):
+        return [snap for snap in (self.build_snap(pid) for pid in list(self.states)) if snap]
+
+    def step(self):
+        """Advance one tick; True on the tick the match ends"""
+        # apply inputs
+        inputs, self.inputs = self.inputs, []
+        for pid,msg in inputs:
+            if pid in self.states and self.states[pid]['alive']:
+                a=msg.get('action','').upper()
+                st=self.states[pid]
+                if a=='LEFT': move_x(st,-1)
+                elif a=='RIGHT': move_x(st,1)
+                elif a=='ROT': rotate_kick(st['board'],st)
+                elif a=='SOFT': soft_one(st)
+                elif a=='DROP': hard_drop(st, self.bag)
+                st['lock_until']=None
+        # physics
+        ms=int(time.time()*1000)
+        for st in self.states.values():
+            if not st['alive']: continue
+            if ms - st['last_drop'] >= st['drop_ms']:
+                st['last_drop']=ms
+                if not collide(st['board'],st['shape'],st['rot'],st['x'],st['y']+1):
+                    st['y']+=1
+                else:
+                    try_lock(st, ms, self.bag)
+            else:
+                try_lock(st, ms, self.bag)
+        if self.ended: return False
+        # 判斷結束
+        if self.mode=='timed':
+            return (ms - self.start_ms) >= self.duration*1000
+        # survival
+        alive=[st for st in self.states.values() if st['alive']]
+        # Game ends when:
+        # 1. All players are dead (len(alive)==0), OR
+        # 2. Only one survivor remains in a multi-player game (len(states)>=2 and len(alive)==1)
+        if len(self.states) >= 2 and len(alive) <= 1:
+            return True
+        # Single player died
+        return len(self.states) == 1 and len(alive) == 0
+
+    def finish(self):
+        """Mark the match over; returns (GAME_OVER for clients, GAME_OVER_REPORT for the lobby)"""
+        self.ended=True
+        # results: 比 lines（計時賽）；存活制比 alive/lines
+        res=[]
+        for pid,st in self.states.items():
+            res.append({'userId':pid,'score':st['score'],'lines':st['lines']})
+        # prepare a report mapping to real user ids (if client provided via HELLO)
+        report_results = []
+        for pid,st in self.states.items():
+            real_uid = st.get('userId', pid)
+            # In survival mode, include alive status for proper winner determination
+            result_entry = {'userId': real_uid, 'score': st['score'], 'lines': st['lines']}
+            if self.mode == 'survival':
+                result_entry['alive'] = st['alive']
+            report_results.append(result_entry)
+            print(f"[Game] Reporting: pid={pid} -> real_uid={real_uid}, score={st['score']}, lines={st['lines']}, alive={st['alive']}")
+        game_over={'type':'GAME_OVER','data':{'roomId':self.room_id,'mode':self.mode,'durationSec':self.duration,'results':res}}
+        report={'type':'GAME_OVER_REPORT','data':{
+            'matchId': str(int(time.time())),
+            'roomId': self.room_id,
+            'users': [st.get('userId', pid) for pid,st in self.states.items()],
+            'startAt': self.start_ms//1000,
+            'endAt': int(time.time()),
+            'mode': self.mode,
+            'durationSec': self.duration,
+            'results': report_results
+        }}
+        return game_over, report
@@ -1,24 +1,74 @@
 # utils.py
-import struct, json, socket
+import struct, json, socket, weakref
 
 _MAX = 65536  # 64 KiB
 
+_HDR = struct.Struct('!I')
+
+class _FrameReader:
+    """Per-socket receive buffer: one recv_into may carry several frames,
+    and headers are parsed in place instead of concatenating chunks."""
+    def __init__(self):
+        self.buf = bytearray(_MAX + _HDR.size)
+        self.start = 0  # first unread byte
+        self.end = 0    # end of received bytes
+
+    def _fill(self, sock: socket.socket, n: int):
+        # keep the unread tail at the front so n bytes fit
+        if self.start + n > len(self.buf):
+            pending = self.end - self.start
+            self.buf[:pending] = self.buf[self.start:self.end]
+            self.start, self.end = 0, pending
+        view = memoryview(self.buf)
+        while self.end - self.start < n:
+            count = sock.recv_into(view[self.end:])
+            if not count:
+                raise ConnectionError("socket closed")
+            self.end += count
+
+    def read(self, sock: socket.socket, n: int) -> memoryview:
+        if self.end - self.start < n:
+            self._fill(sock, n)
+        view = memoryview(self.buf)[self.start:self.start + n]
+        self.start += n
+        if self.start == self.end:
+            self.start = self.end = 0
+        return view
+
+    def frame(self, sock: socket.socket) -> memoryview:
+        # nothing is consumed until the whole frame is buffered, so a
+        # socket timeout mid-frame leaves the stream in sync
+        self._fill(sock, _HDR.size)
+        (length,) = _HDR.unpack_from(self.buf, self.start)
+        if length <= 0 or length > _MAX:
+            raise ValueError("invalid length")
+        self._fill(sock, _HDR.size + length)
+        self.start += _HDR.size
+        return self.read(sock, length)
+
+_readers = weakref.WeakKeyDictionary()
+
+def _reader(sock: socket.socket) -> _FrameReader:
+    reader = _readers.get(sock)
+    if reader is None:
+        reader = _readers[sock] = _FrameReader()
+    return reader
+
 def _recvall(sock: socket.socket, n: int) -> bytes:
-    buf = b''
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
-            raise ConnectionError("socket closed")
-        buf += chunk
-    return buf
+    return bytes(_reader(sock).read(sock, n))
 
-def send_msg(sock: socket.socket, obj: dict):
+def encode_msg(obj: dict) -> bytes:
+    # one length-prefixed frame; broadcasters encode once and send it to many
     body = json.dumps(obj).encode('utf-8')
     if len(body) > _MAX:
         raise ValueError("message too large")
-    hdr = struct.pack('!I', len(body))
+    return _HDR.pack(len(body)) + body
+
+def send_msg(sock: socket.socket, obj: dict):
+    send_frame(sock, encode_msg(obj))
+
+def send_frame(sock: socket.socket, to_send: bytes):
     # partial write
-    to_send = hdr + body
     sent = 0
     while sent < len(to_send):
         n = sock.send(to_send[sent:])
@@ -27,10 +77,5 @@ def send_msg(sock: socket.socket, obj: dict):
         sent += n
 
 def recv_msg(sock: socket.socket) -> dict:
-    # read length
-    hdr = _recvall(sock, 4)
-    (length,) = struct.unpack('!I', hdr)
-    if length <= 0 or length > _MAX:
-        raise ValueError("invalid length")
-    body = _recvall(sock, length)
-    return json.loads(body.decode('utf-8'))
+    body = _reader(sock).frame(sock)
+    return json.loads(bytes(body))
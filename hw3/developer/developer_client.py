@@ -10,7 +10,7 @@ import zipfile
 import threading
 import time
 import json
-from protocol import Protocol, MessageType, recv_message, send_message, send_file
+from protocol import Protocol, MessageType, recv_message, send_message, send_file, CODECS, set_socket_codec
 
 
 class DeveloperClient:
@@ -28,6 +28,11 @@ class DeveloperClient:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.server_host, self.server_port))
+            if not self._negotiate_codec():
+                # Servers without HELLO drop the connection; reconnect speaking JSON
+                self.socket.close()
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.connect((self.server_host, self.server_port))
             self.connected = True
             # Start connection monitor thread
             self.monitor_thread = threading.Thread(target=self._monitor_connection, daemon=True)
@@ -37,6 +42,21 @@ class DeveloperClient:
             print(f"連線失敗: {e}")
             return False
     
+    def _negotiate_codec(self):
+        """Agree on the wire codec with the server. Returns False if the server does not support it"""
+        try:
+            send_message(self.socket, MessageType.HELLO, {"codecs": CODECS})
+            result = recv_message(self.socket)
+        except Exception:
+            return False
+        
+        if not result:
+            return False
+        msg_type, data = result
+        if msg_type == MessageType.SUCCESS:
+            set_socket_codec(self.socket, data.get('codec', 'json'))
+        return True
+    
     def _monitor_connection(self):
         """Monitor connection status in background"""
         while self.connected:
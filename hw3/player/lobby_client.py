@@ -5,12 +5,17 @@ Menu-driven interface for players
 
 import socket
 import os
+import select
 import sys
 import zipfile
 import subprocess
 import threading
 import time
-from protocol import Protocol, MessageType, recv_message, send_message, recv_file, recv_exact
+from protocol import Protocol, MessageType, recv_message, send_message, recv_file, recv_exact, CODECS, set_socket_codec, get_reader
+
+
+# Room events the lobby pushes without a request
+PUSH_TYPES = (MessageType.ROOM_UPDATE, MessageType.PLAYER_JOINED, MessageType.PLAYER_LEFT, MessageType.GAME_STARTED)
 
 
 class LobbyClient:
@@ -26,15 +31,19 @@ class LobbyClient:
         self.monitor_thread = None
         self.game_server_process = None
         self.game_monitor_thread = None
-        self.socket_lock = threading.Lock()  # Protect socket operations
-        self.room_monitor_thread = None
-        self.room_monitor_active = False
+        self.room_notices = []  # room events to show on the next room menu redraw
+        self.pending_game_start = False  # host started the game; launch our client
     
     def connect(self):
         """Connect to lobby server"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.server_host, self.server_port))
+            if not self._negotiate_codec():
+                # Servers without HELLO drop the connection; reconnect speaking JSON
+                self.socket.close()
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.connect((self.server_host, self.server_port))
             self.connected = True
             # Start connection monitor thread
             self.monitor_thread = threading.Thread(target=self._monitor_connection, daemon=True)
@@ -85,15 +94,33 @@ class LobbyClient:
         """檢查已下載遊戲是否有更新"""
         notifications = []
         
+        if not self.username:
+            return notifications
+        
+        user_downloads_dir = os.path.join(self.downloads_dir, self.username)
+        if not os.path.isdir(user_downloads_dir):
+            return notifications
+        local_ids = [name for name in os.listdir(user_downloads_dir)
+                     if os.path.isdir(os.path.join(user_downloads_dir, name))]
+        if not local_ids:
+            return notifications
+        
         try:
-            # 獲取所有遊戲列表
-            send_message(self.socket, MessageType.PLAYER_LIST_GAMES, {})
-            msg_type, data = recv_message(self.socket)
-            
-            if msg_type == MessageType.SUCCESS:
-                games = data.get('games', [])
+            # 只查詢已下載的遊戲
+            cursor = None
+            while True:
+                send_message(self.socket, MessageType.PLAYER_LIST_GAMES_PAGE, {
+                    'filters': {'game_ids': local_ids},
+                    'sort': 'name',
+                    'cursor': cursor,
+                    'page_size': 100
+                })
+                msg_type, data = self.safe_recv_message(self.socket)
                 
-                for game in games:
+                if msg_type != MessageType.SUCCESS:
+                    break
+                
+                for game in data.get('games', []):
                     game_id = game['game_id']
                     server_version = game['version']
                     local_version = self.get_local_game_version(game_id)
@@ -102,11 +129,45 @@ class LobbyClient:
                         notifications.append(
                             f"{game['name']}: {local_version} → {server_version}"
                         )
+                
+                cursor = data.get('next_cursor')
+                if not cursor:
+                    break
         except:
             pass
         
         return notifications
     
+    def _fetch_games_page(self, cursor=None, page_size=10, sort='name', filters=None):
+        """Request one page of the game list. Returns (games, next_cursor) or raises on error"""
+        send_message(self.socket, MessageType.PLAYER_LIST_GAMES_PAGE, {
+            'cursor': cursor,
+            'page_size': page_size,
+            'sort': sort,
+            'filters': filters or {}
+        })
+        msg_type, data = self.safe_recv_message(self.socket)
+        
+        if msg_type != MessageType.SUCCESS:
+            raise RuntimeError(data['error'])
+        
+        return data['games'], data.get('next_cursor')
+    
+    def _negotiate_codec(self):
+        """Agree on the wire codec with the server. Returns False if the server does not support it"""
+        try:
+            send_message(self.socket, MessageType.HELLO, {"codecs": CODECS})
+            result = recv_message(self.socket)
+        except Exception:
+            return False
+        
+        if not result:
+            return False
+        msg_type, data = result
+        if msg_type == MessageType.SUCCESS:
+            set_socket_codec(self.socket, data.get('codec', 'json'))
+        return True
+    
     def _monitor_connection(self):
         """Monitor connection status in background"""
         while self.connected:
@@ -142,11 +203,70 @@ class LobbyClient:
         os.system('clear' if os.name != 'nt' else 'cls')
     
     def safe_recv_message(self, sock):
-        """Safely receive message and raise exception if connection lost"""
-        result = recv_message(sock)
+        """Safely receive message and raise exception if connection lost
+        
+        Room events pushed ahead of the response are applied on the way.
+        """
+        while True:
+            result = recv_message(sock)
+            if result is None:
+                raise ConnectionResetError("伺服器連線已中斷")
+            if result[0] not in PUSH_TYPES:
+                return result
+            self._handle_push(*result)
+    
+    def _handle_push(self, msg_type, data):
+        """Apply a room event pushed by the server"""
+        room = self.current_room
+        if not room or data.get('room_id') != room['room_id']:
+            return
+        self.current_room = data.get('room_data') or room
+        
+        if msg_type == MessageType.PLAYER_JOINED:
+            self.room_notices.append(f"🔔 {data['username']} 加入了房間！")
+        
+        elif msg_type == MessageType.PLAYER_LEFT:
+            self.room_notices.append(f"🔔 {data['username']} 離開了房間")
+        
+        elif msg_type == MessageType.GAME_STARTED:
+            # Auto-start game client for non-host players
+            if self.username != self.current_room['host']:
+                self.pending_game_start = True
+        
+        elif msg_type == MessageType.ROOM_UPDATE and data.get('event') == 'game_ended':
+            result = data.get('result', '')
+            notification = "\n" + "=" * 50 + "\n"
+            notification += "🎮 遊戲已結束".center(50) + "\n"
+            notification += "=" * 50 + "\n"
+            if result:
+                notification += f"\n遊戲結果:\n{result}\n"
+            else:
+                notification += "\n遊戲已結束\n"
+            notification += "\n房間已重置為等待狀態\n"
+            notification += "=" * 50
+            self.room_notices.append(notification)
+    
+    def _room_input(self, prompt):
+        """input() that also wakes up when the server pushes a room event
+        
+        Returns None after applying pushed events so the caller can redraw.
+        """
+        if os.name == 'nt':
+            # select() cannot wait on the console; events are applied with the next response
+            return input(prompt).strip()
+        
+        print(prompt, end='', flush=True)
+        if not get_reader(self.socket).buffered():
+            readable, _, _ = select.select([sys.stdin, self.socket], [], [])
+            if sys.stdin in readable:
+                return sys.stdin.readline().strip()
+        
+        result = recv_message(self.socket)
         if result is None:
             raise ConnectionResetError("伺服器連線已中斷")
-        return result
+        if result[0] in PUSH_TYPES:
+            self._handle_push(*result)
+        return None
     
     def show_main_menu(self):
         """Show main menu"""
@@ -300,75 +420,6 @@ class LobbyClient:
         print("\n已登出")
         input("按 Enter 繼續...")
     
-    def _refresh_room_status(self):
-        """Refresh current room status and return notification message"""
-        if not self.current_room:
-            return None
-        
-        try:
-            # Get updated room info with socket lock
-            with self.socket_lock:
-                send_message(self.socket, MessageType.PLAYER_LIST_ROOMS, {})
-                msg_type, data = recv_message(self.socket)
-            
-            if msg_type == MessageType.SUCCESS:
-                rooms = data.get('rooms', [])
-                room_id = self.current_room['room_id']
-                
-                # Find current room in the list
-                for room in rooms:
-                    if room['room_id'] == room_id:
-                        old_players = set(self.current_room.get('players', []))
-                        new_players = set(room.get('players', []))
-                        old_status = self.current_room['status']
-                        new_status = room['status']
-                        
-                        notification = None
-                        
-                        # Check for new players
-                        joined_players = new_players - old_players
-                        if joined_players:
-                            notification = f"🔔 {', '.join(joined_players)} 加入了房間！"
-                        
-                        # Check for left players
-                        left_players = old_players - new_players
-                        if left_players:
-                            notification = f"🔔 {', '.join(left_players)} 離開了房間"
-                        
-                        # Check if game started (for non-host players)
-                        if old_status == 'waiting' and new_status == 'playing':
-                            if self.username != room['host']:
-                                # Auto-start game client for non-host players
-                                print("\n🎮 房主已開始遊戲！正在自動啟動遊戲客戶端...")
-                                self.current_room = room
-                                self._auto_start_game_client()
-                                return "🎮 遊戲已自動啟動"
-                        
-                        # Check if game ended (for all players)
-                        if old_status == 'playing' and new_status == 'waiting':
-                            result = room.get('game_result', '')
-                            notification = "\n" + "=" * 50 + "\n"
-                            notification += "🎮 遊戲已結束".center(50) + "\n"
-                            notification += "=" * 50 + "\n"
-                            if result:
-                                notification += f"\n遊戲結果:\n{result}\n"
-                            else:
-                                notification += "\n遊戲已結束\n"
-                            notification += "\n房間已重置為等待狀態\n"
-                            notification += "=" * 50
-                        
-                        # Update room data
-                        self.current_room = room
-                        return notification
-                
-                # Room not found - it was deleted
-                self.current_room = None
-                return "⚠️  房間已被刪除"
-        except:
-            pass
-        
-        return None
-    
     def browse_store_menu(self):
         """Store browsing menu"""
         while True:
@@ -421,161 +472,88 @@ class LobbyClient:
     
     def room_menu(self):
         """Room menu"""
-        # Start room monitor thread for auto-game-start detection
-        def monitor_room_for_game_start():
-            """Background thread to monitor room status and auto-start game"""
-            last_status = self.current_room['status'] if self.current_room else None
+        while True:
+            self.clear_screen()
+            print("=" * 50)
+            print("遊戲房間".center(50))
+            print("=" * 50)
             
-            while self.room_monitor_active and self.current_room:
-                time.sleep(1)  # Check every 1 second
+            # Room events pushed since the last redraw
+            if self.pending_game_start and self.current_room:
+                self.pending_game_start = False
+                print("\n🎮 房主已開始遊戲！正在自動啟動遊戲客戶端...")
+                self._auto_start_game_client()
+                self.room_notices.append("🎮 遊戲已自動啟動")
+            
+            for notification in self.room_notices:
+                print(f"\n{notification}")
+            self.room_notices = []
+            
+            # Display current room status
+            if self.current_room:
+                print(f"\n【當前房間】")
+                print(f"  房間名稱: {self.current_room['room_name']}")
+                print(f"  遊戲: {self.current_room['game_name']}")
                 
-                if not self.current_room or not self.room_monitor_active:
-                    break
+                old_player_count = len(self.current_room.get('players', []))
+                print(f"  人數: {old_player_count}/{self.current_room['max_players']}")
+                print(f"  狀態: {'等待中' if self.current_room['status'] == 'waiting' else '遊戲中'}")
                 
-                try:
-                    # Get updated room info using socket lock
-                    with self.socket_lock:
-                        send_message(self.socket, MessageType.PLAYER_LIST_ROOMS, {})
-                        msg_type, data = recv_message(self.socket)
-                    
-                    if msg_type == MessageType.SUCCESS:
-                        rooms = data.get('rooms', [])
-                        room_id = self.current_room['room_id']
-                        
-                        for room in rooms:
-                            if room['room_id'] == room_id:
-                                new_status = room['status']
-                                
-                                # Check if game just started (waiting -> playing)
-                                if last_status == 'waiting' and new_status == 'playing':
-                                    if self.username != room['host']:
-                                        # Auto-start game client for non-host players
-                                        print("\n\n" + "=" * 50)
-                                        print("🎮 房主已開始遊戲！".center(50))
-                                        print("正在自動啟動遊戲客戶端...".center(50))
-                                        print("=" * 50 + "\n")
-                                        self.current_room = room
-                                        self._auto_start_game_client()
-                                        print("\n✓ 遊戲視窗已自動打開")
-                                        print("請切換到遊戲視窗開始遊玩\n")
-                                
-                                # Check if game ended (playing -> waiting)
-                                elif last_status == 'playing' and new_status == 'waiting':
-                                    result = room.get('game_result', '')
-                                    print("\n\n" + "=" * 50)
-                                    print("🎮 遊戲已結束".center(50))
-                                    print("=" * 50)
-                                    if result:
-                                        print(f"\n遊戲結果:\n{result}\n")
-                                    else:
-                                        print("\n遊戲已結束\n")
-                                    print("房間已重置為等待狀態")
-                                    print("=" * 50 + "\n")
-                                
-                                last_status = new_status
-                                self.current_room = room
-                                break
-                except Exception as e:
-                    # Ignore errors in background thread
-                    pass
-        
-        # Start monitor thread if in a room
-        if self.current_room and self.username != self.current_room.get('host'):
-            self.room_monitor_active = True
-            self.room_monitor_thread = threading.Thread(target=monitor_room_for_game_start, daemon=True)
-            self.room_monitor_thread.start()
-        
-        try:
-            while True:
-                self.clear_screen()
-                print("=" * 50)
-                print("遊戲房間".center(50))
-                print("=" * 50)
-                
-                # Refresh and show notifications AFTER clear screen
-                notification = None
-                if self.current_room:
-                    notification = self._refresh_room_status()
-                
-                # Show notification if any
-                if notification:
-                    print(f"\n{notification}")
-                
-                # Display current room status
-                if self.current_room:
-                    print(f"\n【當前房間】")
-                    print(f"  房間名稱: {self.current_room['room_name']}")
-                    print(f"  遊戲: {self.current_room['game_name']}")
-                    
-                    old_player_count = len(self.current_room.get('players', []))
-                    print(f"  人數: {old_player_count}/{self.current_room['max_players']}")
-                    print(f"  狀態: {'等待中' if self.current_room['status'] == 'waiting' else '遊戲中'}")
-                    
-                    # Show player list
-                    players = self.current_room.get('players', [])
-                    if players:
-                        print(f"  玩家: {', '.join(players)}")
-                    
-                    # Show auto-start status
-                    if self.username != self.current_room.get('host') and self.current_room['status'] == 'waiting':
-                        print("\n💡 提示: 等待房主開始遊戲時，系統會自動啟動遊戲客戶端")
-                
-                print("\n1. 查看所有房間")
-                print("2. 建立房間")
-                print("3. 加入房間")
-                print("4. 離開房間")
-                print("5. 開始遊戲")
-                print("6. 結束遊戲")
-                print("7. 返回主選單")
-                
-                # Show game server status if host and server is running
-                if self.current_room and self.username == self.current_room.get('host'):
-                    if self.game_server_process and self.game_server_process.poll() is None:
-                        print(f"\n💡 遊戲伺服器運行中 (PID: {self.game_server_process.pid})")
-                        print("   遊戲會在伺服器停止後自動結束")
-                    
-                    # Check if game result file exists (game has ended)
-                    if self.current_room.get('status') == 'playing':
-                        game_id = self.current_room.get('game_id')
-                        if game_id:
-                            user_downloads_dir = os.path.join(self.downloads_dir, self.username)
-                            game_dir = os.path.join(user_downloads_dir, game_id)
-                            result_file = os.path.join(game_dir, 'game_result.txt')
-                            if os.path.exists(result_file):
-                                print(f"\n⚠️  檢測到遊戲已結束！請選擇 [6] 結束遊戲並更新房間狀態")
+                # Show player list
+                players = self.current_room.get('players', [])
+                if players:
+                    print(f"  玩家: {', '.join(players)}")
                 
-                print("\n" + "=" * 50)
-                choice = input("請選擇功能: ").strip()
+                # Show auto-start status
+                if self.username != self.current_room.get('host') and self.current_room['status'] == 'waiting':
+                    print("\n💡 提示: 等待房主開始遊戲時，系統會自動啟動遊戲客戶端")
+            
+            print("\n1. 查看所有房間")
+            print("2. 建立房間")
+            print("3. 加入房間")
+            print("4. 離開房間")
+            print("5. 開始遊戲")
+            print("6. 結束遊戲")
+            print("7. 返回主選單")
+            
+            # Show game server status if host and server is running
+            if self.current_room and self.username == self.current_room.get('host'):
+                if self.game_server_process and self.game_server_process.poll() is None:
+                    print(f"\n💡 遊戲伺服器運行中 (PID: {self.game_server_process.pid})")
+                    print("   遊戲會在伺服器停止後自動結束")
                 
-                if choice == '1':
-                    self.list_rooms()
-                elif choice == '2':
-                    self.create_room()
-                elif choice == '3':
-                    self.join_room()
-                    # Restart room monitor if joined a room
-                    if self.current_room and self.username != self.current_room.get('host'):
-                        self.room_monitor_active = True
-                        self.room_monitor_thread = threading.Thread(target=monitor_room_for_game_start, daemon=True)
-                        self.room_monitor_thread.start()
-                elif choice == '4':
-                    self.leave_room()
-                    # Stop room monitor when leaving room
-                    self.room_monitor_active = False
-                elif choice == '5':
-                    self.start_game()
-                elif choice == '6':
-                    self.end_game()
-                elif choice == '7':
-                    break
-                else:
-                    print("無效的選項")
-                    input("按 Enter 繼續...")
-        finally:
-            # Stop room monitor thread when leaving room menu
-            self.room_monitor_active = False
-            if self.room_monitor_thread:
-                self.room_monitor_thread.join(timeout=2)
+                # Check if game result file exists (game has ended)
+                if self.current_room.get('status') == 'playing':
+                    game_id = self.current_room.get('game_id')
+                    if game_id:
+                        user_downloads_dir = os.path.join(self.downloads_dir, self.username)
+                        game_dir = os.path.join(user_downloads_dir, game_id)
+                        result_file = os.path.join(game_dir, 'game_result.txt')
+                        if os.path.exists(result_file):
+                            print(f"\n⚠️  檢測到遊戲已結束！請選擇 [6] 結束遊戲並更新房間狀態")
+            
+            print("\n" + "=" * 50)
+            choice = self._room_input("請選擇功能: ")
+            if choice is None:
+                continue  # the room changed; redraw
+            
+            if choice == '1':
+                self.list_rooms()
+            elif choice == '2':
+                self.create_room()
+            elif choice == '3':
+                self.join_room()
+            elif choice == '4':
+                self.leave_room()
+            elif choice == '5':
+                self.start_game()
+            elif choice == '6':
+                self.end_game()
+            elif choice == '7':
+                break
+            else:
+                print("無效的選項")
+                input("按 Enter 繼續...")
     
     def list_games(self):
         """List all available games"""
@@ -680,6 +658,11 @@ class LobbyClient:
                 print(f"版本: {game_info['version']}")
                 print(f"評分: {'★' * int(game_info['rating'])}{'☆' * (5 - int(game_info['rating']))} ({game_info['rating']}/5.0)")
                 print(f"評論數: {game_info['review_count']}")
+                histogram = game_info.get('rating_histogram')
+                if histogram and game_info['review_count']:
+                    for star in range(5, 0, -1):
+                        count = histogram.get(str(star), 0)
+                        print(f"  {star}★ {'█' * round(count * 20 / game_info['review_count'])} {count}")
                 print(f"\n簡介:\n{game_info['description']}")
                 print(f"\n建立時間: {game_info['created_at']}")
                 print(f"更新時間: {game_info['updated_at']}")
@@ -768,45 +751,71 @@ class LobbyClient:
         print("下載/更新遊戲".center(50))
         print("=" * 50)
         
-        # First list games
+        # First list games, one page at a time
         try:
-            send_message(self.socket, MessageType.PLAYER_LIST_GAMES, {})
-            msg_type, data = self.safe_recv_message(self.socket)
-            
-            if msg_type != MessageType.SUCCESS:
-                print(f"\n✗ {data['error']}")
-                input("按 Enter 繼續...")
-                return
-            
-            games = data['games']
-            
-            if not games:
-                print("\n目前沒有可用的遊戲")
-                input("按 Enter 繼續...")
-                return
-            
-            print("\n選擇要下載的遊戲:\n")
-            for i, game in enumerate(games, 1):
-                # Check if already downloaded
-                user_game_dir = os.path.join(self.downloads_dir, self.username, game['game_id'])
-                status = "已下載" if os.path.exists(user_game_dir) else "未下載"
-                print(f"{i}. {game['name']} - {status} (版本: {game['version']})")
-            
-            choice = input("\n請選擇遊戲編號: ").strip()
-            if not choice.isdigit() or not (1 <= int(choice) <= len(games)):
-                print("無效的選擇")
-                input("按 Enter 繼續...")
-                return
+            cursors = [None]  # cursor of every page visited so far
+            while True:
+                games, next_cursor = self._fetch_games_page(cursors[-1])
+                
+                if not games and len(cursors) == 1:
+                    print("\n目前沒有可用的遊戲")
+                    input("按 Enter 繼續...")
+                    return
+                
+                print(f"\n選擇要下載的遊戲 (第 {len(cursors)} 頁):\n")
+                for i, game in enumerate(games, 1):
+                    # Check if already downloaded
+                    user_game_dir = os.path.join(self.downloads_dir, self.username, game['game_id'])
+                    status = "已下載" if os.path.exists(user_game_dir) else "未下載"
+                    print(f"{i}. {game['name']} - {status} (版本: {game['version']})")
+                
+                hints = []
+                if next_cursor:
+                    hints.append("n=下一頁")
+                if len(cursors) > 1:
+                    hints.append("p=上一頁")
+                hint = f" ({', '.join(hints)})" if hints else ""
+                
+                choice = input(f"\n請選擇遊戲編號{hint}: ").strip().lower()
+                if choice == 'n' and next_cursor:
+                    cursors.append(next_cursor)
+                    continue
+                if choice == 'p' and len(cursors) > 1:
+                    cursors.pop()
+                    continue
+                if not choice.isdigit() or not (1 <= int(choice) <= len(games)):
+                    print("無效的選擇")
+                    input("按 Enter 繼續...")
+                    return
+                break
             
             game = games[int(choice) - 1]
             game_id = game['game_id']
             
+            # An installed older version only needs the files that changed
+            local_version = self.get_local_game_version(game_id)
+            if local_version and local_version != game['version']:
+                if self._update_game_delta(game, local_version):
+                    input("\n按 Enter 繼續...")
+                    return
+                print("改為完整下載...")
+            
             print(f"\n正在下載「{game['name']}」...")
             
+            # Resume a partial download of the same archive if one is left over
+            import json
+            part_path, meta_path = self._partial_paths(game_id)
+            request = {'game_id': game_id}
+            if os.path.exists(part_path) and os.path.exists(meta_path):
+                try:
+                    with open(meta_path, 'r') as f:
+                        request['sha256'] = json.load(f).get('sha256')
+                    request['offset'] = os.path.getsize(part_path)
+                except (OSError, ValueError):
+                    pass
+            
             # Send download request
-            send_message(self.socket, MessageType.PLAYER_DOWNLOAD_GAME, {
-                'game_id': game_id
-            })
+            send_message(self.socket, MessageType.PLAYER_DOWNLOAD_GAME, request)
             
             # Receive game info
             msg_type, data = self.safe_recv_message(self.socket)
@@ -818,26 +827,43 @@ class LobbyClient:
             
             version = data['version']
             start_command = data['start_command']
+            expected_sha256 = data.get('sha256')
+            offset = data.get('offset', 0)
             
-            # Receive game file
-            user_game_dir = os.path.join(self.downloads_dir, self.username, game_id)
-            zip_path = os.path.join(user_game_dir, "game.zip")
+            if offset:
+                print(f"從 {offset} / {data['size']} bytes 處繼續下載...")
+            else:
+                os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+                with open(meta_path, 'w') as f:
+                    json.dump({'sha256': expected_sha256, 'version': version}, f)
             
-            os.makedirs(user_game_dir, exist_ok=True)
+            # Receive game file
+            if not recv_file(self.socket, part_path, append=offset > 0):
+                print("✗ 下載中斷，已保留已下載的部分，再次下載時將從中斷處繼續")
+                input("按 Enter 繼續...")
+                return
             
-            if not recv_file(self.socket, zip_path):
-                print("✗ 下載遊戲檔案失敗")
+            # Verify the whole archive before touching the game directory
+            if expected_sha256 and self._file_sha256(part_path) != expected_sha256:
+                os.remove(part_path)
+                os.remove(meta_path)
+                self.safe_recv_message(self.socket)
+                print("✗ 檔案校驗失敗，請重新下載")
                 input("按 Enter 繼續...")
                 return
             
             # Extract zip file
+            user_game_dir = os.path.join(self.downloads_dir, self.username, game_id)
+            os.makedirs(user_game_dir, exist_ok=True)
+            
             print("正在解壓縮...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            with zipfile.ZipFile(part_path, 'r') as zip_ref:
                 zip_ref.extractall(user_game_dir)
-            os.remove(zip_path)
+            os.remove(part_path)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
             
             # Save game info
-            import json
             game_info = {
                 'game_id': game_id,
                 'name': game['name'],
@@ -862,6 +888,102 @@ class LobbyClient:
         
         input("\n按 Enter 繼續...")
     
+    def _update_game_delta(self, game, local_version):
+        """Update an installed game with only the changed files
+        
+        Returns False when the server cannot provide a delta or the files fail
+        verification, so the caller can fall back to a full download.
+        """
+        import json
+        import shutil
+        game_id = game['game_id']
+        
+        print(f"\n正在更新「{game['name']}」: {local_version} → {game['version']}...")
+        
+        send_message(self.socket, MessageType.PLAYER_DOWNLOAD_DELTA, {
+            'game_id': game_id,
+            'from_version': local_version
+        })
+        msg_type, data = self.safe_recv_message(self.socket)
+        
+        if msg_type != MessageType.SUCCESS:
+            print(f"✗ {data['error']}")
+            return False
+        
+        changed = data['changed']
+        removed = data['removed']
+        user_game_dir = os.path.join(self.downloads_dir, self.username, game_id)
+        staging_dir = os.path.join(self.downloads_dir, ".partial", self.username, f"{game_id}.delta")
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        
+        # Receive every file even after a bad one so the stream stays in sync
+        valid = True
+        for i, entry in enumerate(changed):
+            staged_path = os.path.join(staging_dir, str(i))
+            if not recv_file(self.socket, staged_path):
+                raise ConnectionError("連線中斷")
+            if self._file_sha256(staged_path) != entry['sha256']:
+                valid = False
+        
+        msg_type, result = self.safe_recv_message(self.socket)
+        if not valid or msg_type != MessageType.SUCCESS:
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
+            print("✗ 檔案校驗失敗" if not valid else f"✗ {result['error']}")
+            return False
+        
+        # Never write outside the game directory, whatever the server says
+        root = os.path.realpath(user_game_dir)
+        
+        def target_path(path):
+            target = os.path.realpath(os.path.join(user_game_dir, *path.split('/')))
+            if not target.startswith(root + os.sep):
+                raise ValueError(f"不合法的檔案路徑: {path}")
+            return target
+        
+        targets = [target_path(entry['path']) for entry in changed]
+        removed_targets = [target_path(path) for path in removed]
+        
+        for i, target in enumerate(targets):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(staging_dir, str(i)), target)
+        for target in removed_targets:
+            if os.path.exists(target):
+                os.remove(target)
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        
+        # Record the new version
+        info_path = os.path.join(user_game_dir, 'game_info.json')
+        with open(info_path, 'r') as f:
+            game_info = json.load(f)
+        game_info['version'] = data['version']
+        game_info['start_command'] = data['start_command']
+        with open(info_path, 'w') as f:
+            json.dump(game_info, f, indent=2)
+        
+        print(f"\n✓ {result['message']} (更新 {len(changed)} 個檔案，移除 {len(removed)} 個檔案)")
+        print(f"遊戲已儲存至: {user_game_dir}")
+        return True
+    
+    def _partial_paths(self, game_id):
+        """Paths of an interrupted download and its metadata"""
+        # Kept outside downloads/<user> so a partial file never looks installed
+        partial_dir = os.path.join(self.downloads_dir, ".partial", self.username)
+        return (os.path.join(partial_dir, f"{game_id}.zip.part"),
+                os.path.join(partial_dir, f"{game_id}.json"))
+    
+    @staticmethod
+    def _file_sha256(file_path):
+        """SHA-256 of a file, read in chunks"""
+        import hashlib
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
     def list_downloaded_games(self):
         """List downloaded games"""
         self.clear_screen()
@@ -1328,7 +1450,7 @@ class LobbyClient:
                     'result': result
                 })
                 
-                msg_type, data = recv_message(self.socket)
+                msg_type, data = self.safe_recv_message(self.socket)
                 
                 if msg_type == MessageType.SUCCESS:
                     print(f"✓ 房間已自動重置為等待狀態")
@@ -4,8 +4,19 @@ Defines message types and data structures for client-server communication
 """
 
 import json
+import struct
+import threading
+import weakref
 from enum import Enum
 
+
+# Read/write size for file transfers
+FILE_CHUNK_SIZE = 1024 * 1024
+
+# Initial receive buffer per connection; grows for larger frames
+FRAME_BUFFER_SIZE = 16 * 1024
+
+
 class MessageType(Enum):
     # Developer Messages
     DEV_REGISTER = "dev_register"
@@ -20,8 +31,10 @@ class MessageType(Enum):
     PLAYER_LOGIN = "player_login"
     PLAYER_LOGOUT = "player_logout"
     PLAYER_LIST_GAMES = "player_list_games"
+    PLAYER_LIST_GAMES_PAGE = "player_list_games_page"
     PLAYER_GAME_DETAILS = "player_game_details"
     PLAYER_DOWNLOAD_GAME = "player_download_game"
+    PLAYER_DOWNLOAD_DELTA = "player_download_delta"  # Fetch only files changed since a version
     PLAYER_CREATE_ROOM = "player_create_room"
     PLAYER_JOIN_ROOM = "player_join_room"
     PLAYER_LEAVE_ROOM = "player_leave_room"
@@ -37,6 +50,9 @@ class MessageType(Enum):
     SUCCESS = "success"
     ERROR = "error"
     
+    # Connection
+    HELLO = "hello"  # Negotiate the wire codec
+    
     # Notifications
     ROOM_UPDATE = "room_update"
     PLAYER_JOINED = "player_joined"
@@ -44,28 +60,330 @@ class MessageType(Enum):
     GAME_STARTED = "game_started"
 
 
+# Wire type ids for the binary codec. Shared by every protocol.py copy;
+# append only, never reorder.
+TYPE_CODES = [
+    "dev_register", "dev_login", "dev_logout", "dev_upload_game",
+    "dev_update_game", "dev_delete_game", "dev_list_my_games",
+    "player_register", "player_login", "player_logout", "player_list_games",
+    "player_game_details", "player_download_game", "player_create_room",
+    "player_join_room", "player_leave_room", "player_list_rooms",
+    "player_start_game", "player_update_game_port", "player_end_game",
+    "player_rate_game", "player_review_game", "player_list_reviews",
+    "success", "error", "room_update", "player_joined", "player_left",
+    "game_started", "player_list_games_page", "player_download_delta", "hello",
+]
+
+# First payload byte tells the codec apart: JSON envelopes start with '{'
+_BINARY_MAGIC = 0xB1
+
+# Codecs this side speaks, most preferred first
+CODECS = ["binary", "json"]
+
+_LENGTH = struct.Struct('!I')
+_TYPE_BY_VALUE = {t.value: t for t in MessageType}
+_CODE_BY_TYPE = {t: TYPE_CODES.index(t.value) for t in MessageType if t.value in TYPE_CODES}
+_TYPE_BY_CODE = {code: _TYPE_BY_VALUE.get(value) for code, value in enumerate(TYPE_CODES)}
+
+_local = threading.local()  # codec used by encode_message on this thread
+_socket_codecs = weakref.WeakKeyDictionary()  # socket -> negotiated codec
+_readers = weakref.WeakKeyDictionary()  # socket -> FrameReader
+
+
+def choose_codec(offered):
+    """Pick the first codec in the peer's offer that we also speak"""
+    for codec in offered or []:
+        if codec in CODECS:
+            return codec
+    return "json"
+
+
+def set_socket_codec(sock, codec):
+    """Record the codec negotiated for a connection"""
+    _socket_codecs[sock] = codec
+
+
+def socket_codec(sock):
+    """The codec negotiated for a connection (json until HELLO)"""
+    return _socket_codecs.get(sock, "json")
+
+
+def bind_socket_codec(sock):
+    """Make encode_message on this thread use sock's codec"""
+    _local.codec = socket_codec(sock)
+
+
+class FrameReader:
+    """Receive buffer for one connection
+    
+    Each recv_into takes whatever the kernel has ready, so several small
+    frames usually arrive in one system call; length prefixes are parsed in
+    place and payloads are handed out as views into the buffer, valid until
+    the next read from the same connection.
+    """
+    
+    def __init__(self, size=FRAME_BUFFER_SIZE):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.start = 0  # first unread byte
+        self.end = 0    # one past the last received byte
+    
+    def buffered(self):
+        return self.end - self.start
+    
+    def wanted(self):
+        """Bytes that must be buffered before the next frame is complete"""
+        if self.buffered() < _LENGTH.size:
+            return _LENGTH.size
+        return _LENGTH.size + _LENGTH.unpack_from(self.buffer, self.start)[0]
+    
+    def writable(self, need):
+        """Free space to receive into, with room for `need` unread bytes"""
+        pending = self.buffered()
+        if pending == 0:
+            self.start = self.end = 0
+            if len(self.buffer) > self.size:
+                self.buffer = bytearray(self.size)  # drop space grown for a large frame
+        if self.start + need > len(self.buffer):
+            if need > len(self.buffer):
+                grown = bytearray(max(need, len(self.buffer) * 2))
+                grown[:pending] = self.buffer[self.start:self.end]
+                self.buffer = grown
+            else:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        return memoryview(self.buffer)[self.end:]
+    
+    def commit(self, count):
+        """Account for count bytes received into writable()"""
+        self.end += count
+    
+    def take(self, n):
+        """Consume up to n buffered bytes and return them as a view"""
+        n = min(n, self.buffered())
+        view = memoryview(self.buffer)[self.start:self.start + n]
+        self.start += n
+        return view
+    
+    def next_frame(self):
+        """Payload of the next frame if it is fully buffered, else None"""
+        if self.buffered() < self.wanted():
+            return None
+        length = self.wanted() - _LENGTH.size
+        self.start += _LENGTH.size
+        return self.take(length)
+    
+    def fill(self, sock, need):
+        """Block until need bytes are buffered; False if the peer closed"""
+        while self.buffered() < need:
+            count = sock.recv_into(self.writable(need))
+            if not count:
+                return False
+            self.commit(count)
+        return True
+
+
+def get_reader(sock):
+    """The FrameReader for a socket; every read on it must go through this"""
+    reader = _readers.get(sock)
+    if reader is None:
+        reader = _readers[sock] = FrameReader()
+    return reader
+
+
+# Binary codec body: the msgpack wire format for the JSON data model
+# (nil, bool, int, float64, str, array, map), packed with struct
+_PACK_I8 = struct.Struct('!b')
+_PACK_U8 = struct.Struct('!B')
+_PACK_I16 = struct.Struct('!h')
+_PACK_U16 = struct.Struct('!H')
+_PACK_I32 = struct.Struct('!i')
+_PACK_U32 = struct.Struct('!I')
+_PACK_I64 = struct.Struct('!q')
+_PACK_U64 = struct.Struct('!Q')
+_PACK_F64 = struct.Struct('!d')
+
+
+def _pack_header(out, n, fix, fix_max, tag16, tag32):
+    """Length header of a str, array or map"""
+    if n <= fix_max:
+        out.append(fix | n)
+    elif n < 0x10000:
+        out.append(tag16)
+        out += _PACK_U16.pack(n)
+    else:
+        out.append(tag32)
+        out += _PACK_U32.pack(n)
+
+
+def _pack(out, value):
+    """Append value to out. Raises OverflowError for ints wider than 64 bits"""
+    if value is None:
+        out.append(0xC0)
+    elif value is True:
+        out.append(0xC3)
+    elif value is False:
+        out.append(0xC2)
+    elif isinstance(value, str):
+        raw = value.encode('utf-8')
+        n = len(raw)
+        if n < 32:
+            out.append(0xA0 | n)
+        elif n < 0x100:
+            out.append(0xD9)
+            out.append(n)
+        else:
+            _pack_header(out, n, 0xA0, -1, 0xDA, 0xDB)
+        out += raw
+    elif isinstance(value, int):
+        if -32 <= value < 128:
+            out += _PACK_I8.pack(value)  # positive / negative fixint
+        elif -0x8000_0000_0000_0000 <= value < 0x8000_0000_0000_0000:
+            out.append(0xD3)
+            out += _PACK_I64.pack(value)
+        elif 0 <= value < 0x1_0000_0000_0000_0000:
+            out.append(0xCF)
+            out += _PACK_U64.pack(value)
+        else:
+            raise OverflowError("int too wide for the binary codec")
+    elif isinstance(value, float):
+        out.append(0xCB)
+        out += _PACK_F64.pack(value)
+    elif isinstance(value, dict):
+        _pack_header(out, len(value), 0x80, 15, 0xDE, 0xDF)
+        for key, item in value.items():
+            # Keys become strings, as json.dumps would make them
+            _pack(out, key if isinstance(key, str) else json.dumps(key))
+            _pack(out, item)
+    elif isinstance(value, (list, tuple)):
+        _pack_header(out, len(value), 0x90, 15, 0xDC, 0xDD)
+        for item in value:
+            _pack(out, item)
+    else:
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def _unpack(data, pos):
+    """Decode the value at data[pos]. Returns (value, next position)"""
+    tag = data[pos]
+    pos += 1
+    if tag < 0x80:
+        return tag, pos
+    if tag >= 0xE0:
+        return tag - 0x100, pos
+    if 0xA0 <= tag < 0xC0:
+        n = tag & 0x1F
+        return str(data[pos:pos + n], 'utf-8'), pos + n
+    if 0x80 <= tag < 0x90:
+        return _unpack_map(data, pos, tag & 0x0F)
+    if 0x90 <= tag < 0xA0:
+        return _unpack_array(data, pos, tag & 0x0F)
+    if tag == 0xC0:
+        return None, pos
+    if tag == 0xC2:
+        return False, pos
+    if tag == 0xC3:
+        return True, pos
+    if tag in _SCALARS:
+        packer = _SCALARS[tag]
+        return packer.unpack_from(data, pos)[0], pos + packer.size
+    if tag in _STR_LENGTHS:
+        packer = _STR_LENGTHS[tag]
+        n = packer.unpack_from(data, pos)[0]
+        pos += packer.size
+        if pos + n > len(data):
+            raise ValueError("truncated string")
+        return str(data[pos:pos + n], 'utf-8'), pos + n
+    if tag in (0xDC, 0xDD, 0xDE, 0xDF):
+        packer = _PACK_U16 if tag in (0xDC, 0xDE) else _PACK_U32
+        n = packer.unpack_from(data, pos)[0]
+        pos += packer.size
+        if tag in (0xDC, 0xDD):
+            return _unpack_array(data, pos, n)
+        return _unpack_map(data, pos, n)
+    raise ValueError(f"unsupported tag 0x{tag:02x}")
+
+
+def _unpack_array(data, pos, n):
+    items = []
+    for _ in range(n):
+        item, pos = _unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(data, pos, n):
+    items = {}
+    for _ in range(n):
+        key, pos = _unpack(data, pos)
+        items[key], pos = _unpack(data, pos)
+    return items, pos
+
+
+_SCALARS = {
+    0xCC: _PACK_U8, 0xCD: _PACK_U16, 0xCE: _PACK_U32, 0xCF: _PACK_U64,
+    0xD0: _PACK_I8, 0xD1: _PACK_I16, 0xD2: _PACK_I32, 0xD3: _PACK_I64,
+    0xCA: struct.Struct('!f'), 0xCB: _PACK_F64,
+}
+_STR_LENGTHS = {0xD9: _PACK_U8, 0xDA: _PACK_U16, 0xDB: _PACK_U32}
+
+
+def pack_body(data):
+    """Encode a message body for the binary codec"""
+    out = bytearray()
+    _pack(out, data)
+    return out
+
+
+def unpack_body(data):
+    """Decode a binary codec body. Raises ValueError if malformed"""
+    try:
+        value, pos = _unpack(data, 0)
+    except (IndexError, TypeError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"truncated or malformed body: {e}")
+    if pos != len(data):
+        raise ValueError("trailing bytes after body")
+    return value
+
+
 class Protocol:
     """Protocol handler for encoding/decoding messages"""
     
     @staticmethod
-    def encode_message(msg_type: MessageType, data: dict) -> bytes:
-        """Encode a message to bytes"""
-        message = {
-            "type": msg_type.value,
-            "data": data
-        }
-        json_str = json.dumps(message)
+    def encode_message(msg_type: MessageType, data: dict, codec: str = None) -> bytes:
+        """Encode a message to bytes (codec defaults to the one bound to this thread)"""
+        codec = codec or getattr(_local, 'codec', "json")
+        code = _CODE_BY_TYPE.get(msg_type)
+        
+        # Encode once; the length prefix is taken from the encoded payload
+        payload = None
+        if codec == "binary" and code is not None:
+            try:
+                payload = bytes((_BINARY_MAGIC, code)) + pack_body(data)
+            except OverflowError:
+                pass  # the JSON envelope carries any int; decoders accept both per frame
+        if payload is None:
+            message = {
+                "type": msg_type.value,
+                "data": data
+            }
+            payload = json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        
         # Add length prefix (4 bytes)
-        length = len(json_str.encode('utf-8'))
-        return length.to_bytes(4, byteorder='big') + json_str.encode('utf-8')
+        return _LENGTH.pack(len(payload)) + payload
     
     @staticmethod
     def decode_message(data: bytes) -> tuple:
-        """Decode a message from bytes. Returns (msg_type, data)"""
+        """Decode a message from bytes in either codec. Returns (msg_type, data)"""
         try:
-            message = json.loads(data.decode('utf-8'))
-            msg_type = MessageType(message['type'])
-            return msg_type, message['data']
+            if data[0] == _BINARY_MAGIC:
+                msg_type = _TYPE_BY_CODE.get(data[1])
+                if msg_type is None:
+                    raise ValueError(f"unknown type id {data[1]}")
+                return msg_type, unpack_body(data[2:])
+            
+            message = json.loads(bytes(data))
+            return _TYPE_BY_VALUE[message['type']], message['data']
         except Exception as e:
             raise ValueError(f"Failed to decode message: {e}")
     
@@ -82,57 +400,65 @@ class Protocol:
 
 def recv_message(sock):
     """Receive a complete message from socket"""
-    # First, receive the length prefix (4 bytes)
-    length_bytes = recv_exact(sock, 4)
-    if not length_bytes:
-        return None
-    
-    length = int.from_bytes(length_bytes, byteorder='big')
+    reader = get_reader(sock)
     
-    # Then receive the actual message
-    data = recv_exact(sock, length)
-    if not data:
+    # A frame may already be buffered from an earlier recv
+    if not reader.fill(sock, _LENGTH.size) or not reader.fill(sock, reader.wanted()):
         return None
     
-    return Protocol.decode_message(data)
+    return Protocol.decode_message(reader.next_frame())
 
 
 def send_message(sock, msg_type: MessageType, data: dict):
-    """Send a message through socket"""
-    message = Protocol.encode_message(msg_type, data)
+    """Send a message through socket using the codec negotiated for it"""
+    message = Protocol.encode_message(msg_type, data, socket_codec(sock))
     sock.sendall(message)
 
 
 def recv_exact(sock, n):
     """Receive exactly n bytes from socket"""
-    data = b''
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
-            return None
-        data += chunk
-    return data
+    reader = get_reader(sock)
+    if not reader.fill(sock, n):
+        return None
+    return bytes(reader.take(n))
 
 
-def send_file(sock, file_path):
-    """Send a file through socket"""
+def send_file(sock, file_path, offset=0):
+    """Send a file through socket, starting at offset (to resume a transfer)"""
     import os
     
-    # Send file size first
+    # Send the number of bytes that follow first
     file_size = os.path.getsize(file_path)
-    sock.sendall(file_size.to_bytes(8, byteorder='big'))
+    offset = min(offset, file_size)
+    sock.sendall((file_size - offset).to_bytes(8, byteorder='big'))
     
     # Send file data
     with open(file_path, 'rb') as f:
+        # Let the kernel copy straight from the page cache to the socket
+        if hasattr(os, 'sendfile'):
+            try:
+                sock.sendfile(f, offset, file_size - offset)
+                return
+            except (ValueError, NotImplementedError):
+                # Non-blocking or wrapped sockets; nothing was sent yet
+                pass
+        
+        f.seek(offset)
+        buffer = bytearray(FILE_CHUNK_SIZE)
+        view = memoryview(buffer)
         while True:
-            chunk = f.read(4096)
-            if not chunk:
+            count = f.readinto(buffer)
+            if not count:
                 break
-            sock.sendall(chunk)
+            sock.sendall(view[:count])
 
 
-def recv_file(sock, save_path):
-    """Receive a file from socket"""
+def recv_file(sock, save_path, append=False):
+    """Receive a file from socket
+    
+    With append=True the bytes are added to an existing partial file, and
+    whatever arrived before a dropped connection is kept on disk.
+    """
     import os
     
     # Receive file size first
@@ -145,15 +471,17 @@ def recv_file(sock, save_path):
     # Create directory if not exists
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
     
-    # Receive file data
-    received = 0
-    with open(save_path, 'wb') as f:
+    # Write out bytes that arrived with the header, then receive the rest
+    # straight into one reused buffer
+    buffer = bytearray(max(1, min(FILE_CHUNK_SIZE, file_size)))
+    view = memoryview(buffer)
+    with open(save_path, 'ab' if append else 'wb') as f:
+        received = f.write(get_reader(sock).take(file_size))
         while received < file_size:
-            chunk_size = min(4096, file_size - received)
-            chunk = recv_exact(sock, chunk_size)
-            if not chunk:
+            count = sock.recv_into(view, min(len(buffer), file_size - received))
+            if not count:
                 return False
-            f.write(chunk)
-            received += len(chunk)
+            f.write(view[:count])
+            received += count
     
     return True
@@ -0,0 +1,99 @@
+"""
+Archive Store for Game Store System
+Builds one deterministic zip per uploaded game version and stores it under
+its SHA-256 so downloads can stream a ready-made file
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+
+
+ARCHIVE_DIR = ".archives"
+
+# Fixed timestamp so identical files always produce identical archive bytes
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def file_sha256(filepath):
+    """Hash a file in chunks (also used for manifests)"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArchiveStore:
+    """Content-addressed download archives under <upload_dir>/.archives"""
+    
+    def __init__(self, upload_dir):
+        self.root = os.path.join(upload_dir, ARCHIVE_DIR)
+        os.makedirs(self.root, exist_ok=True)
+    
+    def path_for(self, digest):
+        """Path of the archive with the given SHA-256"""
+        return os.path.join(self.root, f"{digest}.zip")
+    
+    def build(self, source_dir, version):
+        """Zip source_dir and store it by hash
+        
+        Returns the archive info kept on the game record:
+        {"version", "sha256", "size"}. Building the same content twice
+        reuses the existing archive.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for root, dirs, files in os.walk(source_dir):
+                    dirs.sort()
+                    for file in sorted(files):
+                        file_path = os.path.join(root, file)
+                        arcname = os.path.relpath(file_path, source_dir).replace(os.sep, '/')
+                        info = zipfile.ZipInfo(arcname, date_time=_ZIP_DATE_TIME)
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        info.external_attr = (os.stat(file_path).st_mode & 0o777) << 16
+                        with open(file_path, 'rb') as src, zipf.open(info, 'w') as dst:
+                            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                                dst.write(chunk)
+            
+            digest = file_sha256(tmp_path)
+            size = os.path.getsize(tmp_path)
+            archive_path = self.path_for(digest)
+            
+            if os.path.exists(archive_path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, archive_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        return {"version": version, "sha256": digest, "size": size}
+    
+    def lookup(self, game):
+        """Path of the game's archive if it exists and matches the current version"""
+        archive = game.get('archive')
+        if not archive or archive.get('version') != game.get('version'):
+            return None
+        archive_path = self.path_for(archive['sha256'])
+        if not os.path.exists(archive_path):
+            return None
+        return archive_path
+    
+    def release(self, digest, games):
+        """Delete an archive no longer referenced by any game record"""
+        for game in games.values():
+            archive = game.get('archive')
+            if archive and archive.get('sha256') == digest:
+                return False
+        
+        archive_path = self.path_for(digest)
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+            return True
+        return False
@@ -0,0 +1,273 @@
+"""
+Event-Loop Transport for Game Store Servers
+Serves the length-prefixed Protocol on one asyncio loop so idle sessions
+cost a socket, not a thread; handlers still run as plain blocking code
+"""
+
+import asyncio
+import os
+import socket
+import threading
+
+from protocol import Protocol, MessageType, get_reader, socket_codec
+from dispatcher import Dispatcher
+
+
+# Transport settings (override with environment variables)
+TRANSPORT = os.environ.get('GAME_STORE_TRANSPORT', 'asyncio')  # asyncio | threads
+BACKLOG = int(os.environ.get('GAME_STORE_BACKLOG', '1024'))
+MAX_CONNECTIONS = int(os.environ.get('GAME_STORE_MAX_CONNECTIONS', '10000'))
+
+
+def raise_fd_limit():
+    """Raise the open file soft limit to the hard limit (one fd per session)"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class ClientSession:
+    """Per-connection state shared by the transport and the handlers"""
+    
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.username = None
+        self.send_lock = threading.Lock()
+        
+        # Pushes raised while a request is in flight wait here so they can
+        # never land between a response and the file data that follows it
+        self.holding = False
+        self.held = []
+        self.deliver = None  # set by the event loop to push while idle
+        self.write_lock = None  # asyncio.Lock for writes made on the loop
+    
+    def send(self, payload):
+        """Send bytes; the socket must be in blocking mode"""
+        with self.send_lock:
+            self.sock.sendall(payload)
+    
+    def hold(self):
+        """Queue pushes until the current request has been answered"""
+        with self.send_lock:
+            self.holding = True
+    
+    def release(self):
+        """Stop queueing pushes and return the ones held meanwhile"""
+        with self.send_lock:
+            held, self.held = self.held, []
+            self.holding = False
+            return held
+    
+    def finish(self, response):
+        """Send a response, then any pushes held while it was prepared"""
+        with self.send_lock:
+            if response is not None:
+                self.sock.sendall(response)
+            for payload in self.held:
+                self.sock.sendall(payload)
+            self.held = []
+            self.holding = False
+    
+    def push(self, payload):
+        """Send an unsolicited message (room events) from any thread"""
+        with self.send_lock:
+            if self.holding:
+                self.held.append(payload)
+            elif self.deliver:
+                self.deliver(payload)
+            else:
+                self.sock.sendall(payload)
+
+
+class AsyncServer:
+    """Accept and read on an event loop, run handlers on bounded worker lanes
+    
+    dispatch(session, msg_type, data) returns the response bytes.
+    on_disconnect(session) cleans up after the client goes away.
+    routes maps message types to dispatcher lanes (see dispatcher.py).
+    streaming lists message types whose request is followed by raw bytes
+    (uploads); they queue on a full lane instead of being refused, since a
+    refusal would leave those bytes to be misread as frames.
+    """
+    
+    def __init__(self, name, host, port, dispatch, on_disconnect, routes=None,
+                 backlog=BACKLOG, max_connections=MAX_CONNECTIONS, streaming=()):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.dispatch = dispatch
+        self.on_disconnect = on_disconnect
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.dispatcher = Dispatcher(routes or {})
+        self.streaming = frozenset(streaming)
+        
+        self.server_socket = None
+        self.loop = None
+        self.sessions = set()
+        self._stopped = None
+    
+    def run(self):
+        """Serve until stop() is called"""
+        raise_fd_limit()
+        asyncio.run(self._serve())
+    
+    def stop(self):
+        """Stop accepting and close the listening socket (thread-safe)"""
+        if self.loop and self._stopped and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+    
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        
+        print(f"{self.name} started on {self.host}:{self.port} "
+              f"(asyncio, backlog {self.backlog}, max {self.max_connections} connections)")
+        
+        accept_task = asyncio.ensure_future(self._accept_loop())
+        await self._stopped.wait()
+        accept_task.cancel()
+        self.server_socket.close()
+        self.dispatcher.shutdown()
+    
+    async def _accept_loop(self):
+        while True:
+            try:
+                client_socket, address = await self.loop.sock_accept(self.server_socket)
+            except asyncio.CancelledError:
+                raise
+            except OSError as e:
+                print(f"Error accepting connection: {e}")
+                await asyncio.sleep(0.1)
+                continue
+            
+            client_socket.setblocking(False)
+            if len(self.sessions) >= self.max_connections:
+                await self._reject(client_socket)
+                continue
+            
+            session = ClientSession(client_socket, address)
+            session.write_lock = asyncio.Lock()
+            session.deliver = lambda payload, session=session: self._deliver(session, payload)
+            self.sessions.add(session)
+            asyncio.ensure_future(self._serve_client(session))
+    
+    async def _reject(self, client_socket):
+        """Refuse a connection over the limit with an error message"""
+        try:
+            await asyncio.wait_for(
+                self.loop.sock_sendall(client_socket, self._error(client_socket, "伺服器連線數已滿，請稍後再試")),
+                timeout=1
+            )
+        except (OSError, asyncio.TimeoutError):
+            pass
+        client_socket.close()
+    
+    @staticmethod
+    def _error(sock, error_msg):
+        """Error response in the codec negotiated for sock
+        
+        The loop thread's bound codec belongs to whichever session it last
+        served inline, so replies built here name the codec explicitly.
+        """
+        return Protocol.encode_message(MessageType.ERROR, {"error": error_msg}, socket_codec(sock))
+    
+    async def _next_frame(self, reader, sock):
+        """Next payload from the connection's frame reader; None on EOF
+        
+        Frames already buffered by an earlier recv are returned without
+        waiting on the loop again.
+        """
+        while True:
+            payload = reader.next_frame()
+            if payload is not None:
+                return payload
+            count = await self.loop.sock_recv_into(sock, reader.writable(reader.wanted()))
+            if not count:
+                return None
+            reader.commit(count)
+    
+    def _handle(self, session, msg_type, data):
+        """Run one request on a worker thread with the socket in blocking mode
+        
+        Handlers may stream files or send several messages directly on
+        session.sock, exactly as with a thread-per-client server.
+        """
+        session.sock.setblocking(True)
+        try:
+            session.finish(self.dispatch(session, msg_type, data))
+        finally:
+            session.release()
+            session.sock.setblocking(False)
+    
+    async def _route(self, session, msg_type, data):
+        """Answer cheap requests on the loop, queue the rest on their lane"""
+        lane = self.dispatcher.lane_for(msg_type)
+        session.hold()
+        
+        # Wait for pushes already being written, and keep new ones queued
+        # until this request's replies are out
+        async with session.write_lock:
+            if lane is None:
+                # Inline handlers only read in-memory state and never touch the socket
+                response = self.dispatch(session, msg_type, data)
+            elif not lane.try_acquire(force=msg_type in self.streaming):
+                response = self._error(session.sock, "伺服器忙碌中，請稍後再試")
+            else:
+                try:
+                    await self.loop.run_in_executor(lane.executor, self._handle, session, msg_type, data)
+                finally:
+                    lane.release()
+                return
+            
+            await self.loop.sock_sendall(session.sock, response + b''.join(session.release()))
+    
+    def _deliver(self, session, payload):
+        """Push to an idle session from any thread"""
+        self.loop.call_soon_threadsafe(asyncio.ensure_future, self._push(session, payload))
+    
+    async def _push(self, session, payload):
+        async with session.write_lock:
+            try:
+                await self.loop.sock_sendall(session.sock, payload)
+            except (OSError, ValueError):
+                pass  # closed meanwhile; the read side notices the disconnect
+    
+    async def _serve_client(self, session):
+        sock = session.sock
+        print(f"{self.name}: client connected from {session.address}")
+        # Shared with handlers, which read uploads from the same buffer
+        reader = get_reader(sock)
+        try:
+            while True:
+                payload = await self._next_frame(reader, sock)
+                if payload is None:
+                    break
+                
+                msg_type, data = Protocol.decode_message(payload)
+                await self._route(session, msg_type, data)
+        
+        except Exception as e:
+            print(f"Error handling client {session.address}: {e}")
+        
+        finally:
+            self.sessions.discard(session)
+            try:
+                await self.loop.run_in_executor(
+                    self.dispatcher.lanes["default"].executor, self.on_disconnect, session
+                )
+            except Exception as e:
+                print(f"Error cleaning up client {session.address}: {e}")
+            sock.close()
+            print(f"{self.name}: client {session.address} disconnected")
@@ -0,0 +1,128 @@
+"""
+Blob Store for Game Store System
+Keeps one copy of every uploaded file under its SHA-256; version directories
+are hardlink farms over the read-only blobs, so versions that share files
+share disk, and game servers run from a writable copy of their version
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from manifest import MANIFEST_DIR
+
+
+BLOB_DIR = ".blobs"
+RUN_DIR = ".run"  # <upload_dir>/<game_id>/.run/<version>: where game servers run
+
+
+class BlobStore:
+    """Content-addressed file store under <upload_dir>/.blobs"""
+    
+    def __init__(self, upload_dir):
+        self.upload_dir = upload_dir
+        self.root = os.path.join(upload_dir, BLOB_DIR)
+        self.lock = threading.Lock()  # ingest vs. garbage collection
+        os.makedirs(self.root, exist_ok=True)
+    
+    def path_for(self, digest):
+        """Path of the blob with the given SHA-256"""
+        return os.path.join(self.root, digest[:2], digest)
+    
+    @staticmethod
+    def _link(blob_path, file_path):
+        """Hardlink a blob into a version directory, copying if links are not supported"""
+        try:
+            os.link(blob_path, file_path)
+        except OSError:
+            shutil.copy2(blob_path, file_path)
+    
+    def ingest(self, version_dir, manifest):
+        """Move a freshly extracted version into the store and link it back
+        
+        The manifest must already be saved so that a concurrent collect()
+        sees the new blobs as referenced. Returns the bytes deduplicated.
+        """
+        saved = 0
+        with self.lock:
+            for relpath, entry in manifest['files'].items():
+                file_path = os.path.join(version_dir, *relpath.split('/'))
+                blob_path = self.path_for(entry['sha256'])
+                
+                if os.path.exists(blob_path):
+                    os.remove(file_path)
+                    saved += entry['size']
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(file_path, blob_path)
+                
+                # Every version linking the blob shares its inode
+                os.chmod(blob_path, 0o444)
+                self._link(blob_path, file_path)
+        return saved
+    
+    def _referenced(self):
+        """Hashes listed by the manifest of any version still on disk"""
+        digests = set()
+        for game_id in os.listdir(self.upload_dir):
+            manifest_dir = os.path.join(self.upload_dir, game_id, MANIFEST_DIR)
+            if game_id.startswith('.') or not os.path.isdir(manifest_dir):
+                continue
+            for filename in os.listdir(manifest_dir):
+                if not filename.endswith('.json'):
+                    continue
+                version = filename[:-len('.json')]
+                if not os.path.isdir(os.path.join(self.upload_dir, game_id, version)):
+                    continue
+                try:
+                    with open(os.path.join(manifest_dir, filename), 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except ValueError:
+                    continue
+                digests.update(entry['sha256'] for entry in manifest['files'].values())
+        return digests
+    
+    def collect(self):
+        """Delete blobs no version references. Returns (blobs removed, bytes freed)"""
+        removed = 0
+        freed = 0
+        with self.lock:
+            referenced = self._referenced()
+            for prefix in os.listdir(self.root):
+                prefix_dir = os.path.join(self.root, prefix)
+                for digest in os.listdir(prefix_dir):
+                    if digest in referenced:
+                        continue
+                    blob_path = os.path.join(prefix_dir, digest)
+                    freed += os.path.getsize(blob_path)
+                    os.remove(blob_path)
+                    removed += 1
+                if not os.listdir(prefix_dir):
+                    os.rmdir(prefix_dir)
+        return removed, freed
+
+
+def run_dir(upload_dir, game_id, version):
+    """Writable copy of a stored version for game servers to run in, made on first use
+    
+    Version files are links to shared read-only blobs, so a game that
+    writes next to itself must not run from the version directory.
+    Raises OSError if the copy cannot be made.
+    """
+    path = os.path.join(upload_dir, game_id, RUN_DIR, version)
+    if os.path.isdir(path):
+        return path
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{version}.", dir=os.path.dirname(path))
+    try:
+        shutil.copytree(os.path.join(upload_dir, game_id, version), staging,
+                        copy_function=shutil.copyfile, dirs_exist_ok=True)
+        os.rename(staging, path)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(path):  # else a concurrent start made it first
+            raise
+    return path
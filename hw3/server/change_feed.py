@@ -0,0 +1,134 @@
+"""
+Change Feed for Game Store System
+The developer server announces game changes on a local Unix datagram
+socket and the lobby applies them to its in-memory collections, so the
+lobby learns about uploads from events instead of checking files per read
+"""
+
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+
+# Socket path shared by both servers ("off" disables the feed)
+CHANGE_FEED = os.environ.get('GAME_STORE_CHANGE_FEED', '')
+SEND_TIMEOUT = 0.5  # seconds a publisher waits on a full lobby queue
+MAX_EVENT_SIZE = 256 * 1024
+
+# Seconds between resyncs from disk, so a lost last event is still picked up
+RESYNC_INTERVAL = float(os.environ.get('GAME_STORE_FEED_RESYNC', '5'))
+
+
+def feed_path(data_dir):
+    """Path of the feed socket, or None when the feed is off or unsupported"""
+    if CHANGE_FEED == 'off' or not hasattr(socket, 'AF_UNIX'):
+        return None
+    return CHANGE_FEED or os.path.join(data_dir, "changes.sock")
+
+
+class ChangePublisher:
+    """Send change events to the feed socket; never fails the caller
+    
+    Every event carries this process's pid and a sequence number, so a
+    subscriber can tell when one was dropped (nobody listening, queue full).
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = itertools.count(1)
+        self.stats = {"sent": 0, "dropped": 0}
+        self.sock = None
+        if path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.settimeout(SEND_TIMEOUT)
+    
+    def publish(self, op, collection, key, value=None):
+        """Announce one change (op: upsert, delist or delete). False if not delivered"""
+        if self.sock is None:
+            return False
+        
+        with self.lock:
+            event = {
+                "op": op,
+                "collection": collection,
+                "key": key,
+                "value": value,
+                "source": os.getpid(),
+                "seq": next(self.seq)
+            }
+            try:
+                self.sock.sendto(json.dumps(event, ensure_ascii=False).encode('utf-8'), self.path)
+                self.stats["sent"] += 1
+                return True
+            except OSError:
+                # The lobby sees the sequence gap and revalidates from disk
+                self.stats["dropped"] += 1
+                return False
+
+
+class ChangeSubscriber:
+    """Receive change events on the feed socket
+    
+    on_event(event) runs on the feed thread for every event; on_gap() runs
+    when events may have been missed, before the event that revealed it.
+    A dropped event is only revealed by the next one, so on_gap() also runs
+    every resync_interval seconds.
+    """
+    
+    def __init__(self, path, on_event, on_gap, resync_interval=RESYNC_INTERVAL):
+        self.path = path
+        self.on_event = on_event
+        self.on_gap = on_gap
+        self.resync_interval = resync_interval
+        self.sources = {}  # publisher pid -> last seq seen
+        self.stats = {"received": 0, "gaps": 0, "resyncs": 0}
+        self.sock = None
+    
+    def start(self):
+        """Bind the feed socket and start the feed thread. Raises OSError if it cannot bind"""
+        try:
+            os.unlink(self.path)  # left by a previous lobby
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.settimeout(self.resync_interval)
+        threading.Thread(target=self._run, name="change-feed", daemon=True).start()
+    
+    def _run(self):
+        next_resync = time.monotonic() + self.resync_interval
+        while True:
+            if time.monotonic() >= next_resync:
+                self.stats["resyncs"] += 1
+                self._call(self.on_gap)
+                next_resync = time.monotonic() + self.resync_interval
+            
+            try:
+                event = json.loads(self.sock.recv(MAX_EVENT_SIZE))
+            except socket.timeout:
+                continue
+            except ValueError:
+                continue
+            except OSError:
+                return
+            
+            source, seq = event.get('source'), event.get('seq')
+            last = self.sources.get(source)
+            self.sources[source] = seq
+            self.stats["received"] += 1
+            # A publisher's first event we see must be its first one too
+            if seq != (last or 0) + 1:
+                self.stats["gaps"] += 1
+                self._call(self.on_gap)
+            self._call(self.on_event, event)
+    
+    @staticmethod
+    def _call(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[ChangeFeed] Error applying change: {e}")
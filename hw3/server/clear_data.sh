@@ -33,9 +33,13 @@ rm -f data/player_users.json
 rm -f data/games.json
 rm -f data/reviews.json
 rm -f data/rooms.json
+rm -f data/ratings.json
+rm -f data/*.journal
+rm -f data/game_store.db data/game_store.db-wal data/game_store.db-shm
 
 # Remove uploaded games
 rm -rf uploaded_games/*
+rm -rf uploaded_games/.archives uploaded_games/.blobs
 
 # Remove player downloads (keep .gitkeep)
 echo "Clearing player downloads..."
@@ -0,0 +1,94 @@
+"""
+Instrumented Locks for Game Store System
+Per-collection and striped per-key locks that record how long callers
+waited for them, so contention in the database layer can be measured
+"""
+
+import threading
+import time
+
+
+class LockStats:
+    """Acquisition and wait-time counters of one lock (updated while it is held)"""
+    
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0  # acquisitions that had to wait
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def add(self, other):
+        self.acquisitions += other.acquisitions
+        self.contended += other.contended
+        self.wait_total += other.wait_total
+        self.wait_max = max(self.wait_max, other.wait_max)
+    
+    def as_dict(self):
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_ms": round(self.wait_total * 1000, 3),
+            "max_wait_ms": round(self.wait_max * 1000, 3)
+        }
+
+
+class InstrumentedLock:
+    """threading.Lock that records how often and how long callers waited"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.stats = LockStats()
+    
+    def acquire(self, blocking=True):
+        # Uncontended path costs one non-blocking acquire, no clock reads
+        if self._lock.acquire(blocking=False):
+            self.stats.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        
+        started = time.perf_counter()
+        self._lock.acquire()
+        waited = time.perf_counter() - started
+        stats = self.stats
+        stats.acquisitions += 1
+        stats.contended += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        return True
+    
+    def release(self):
+        self._lock.release()
+    
+    def locked(self):
+        return self._lock.locked()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc):
+        self.release()
+
+
+class StripedLock:
+    """Fixed set of locks; a key always maps to the same stripe
+    
+    Operations on different keys mostly take different locks, without one
+    lock object per key.
+    """
+    
+    def __init__(self, name, stripes=16):
+        self.name = name
+        self.stripes = [InstrumentedLock(f"{name}[{i}]") for i in range(stripes)]
+    
+    def for_key(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+    
+    def stats(self):
+        """Counters summed over all stripes"""
+        total = LockStats()
+        for lock in self.stripes:
+            total.add(lock.stats)
+        return total
@@ -1,13 +1,17 @@
 """
 Database Server for Game Store System
-Handles persistent data storage using JSON files
+Handles persistent data storage through a pluggable storage engine
 """
 
-import json
 import os
-import threading
 import hashlib
 from datetime import datetime
+from db_locks import InstrumentedLock, StripedLock
+from group_commit import GroupCommit, durability_policies
+from storage import create_storage
+
+
+COLLECTIONS = ("dev_users", "player_users", "games", "reviews", "ratings")
 
 
 class DatabaseServer:
@@ -18,50 +22,199 @@ class DatabaseServer:
         """Hash password using SHA-256"""
         return hashlib.sha256(password.encode('utf-8')).hexdigest()
     
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", storage=None):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         
-        # Data files
-        self.dev_users_file = os.path.join(data_dir, "dev_users.json")
-        self.player_users_file = os.path.join(data_dir, "player_users.json")
-        self.games_file = os.path.join(data_dir, "games.json")
-        self.reviews_file = os.path.join(data_dir, "reviews.json")
-        self.rooms_file = os.path.join(data_dir, "rooms.json")
+        # Storage engine (journal by default, see storage.create_storage)
+        self.storage = storage or create_storage(data_dir)
+        
+        # One lock per collection guards its dict and its storage writes;
+        # users also take a per-key stripe around read-modify-write
+        # (lock order: key stripe, then collection, reviews before ratings).
+        # Entries are replaced, never changed in place, so readers take
+        # snapshot views without locking.
+        self.locks = {name: InstrumentedLock(name) for name in COLLECTIONS}
+        self.key_locks = {name: StripedLock(name) for name in ("dev_users", "player_users")}
+        
+        # Collections written synchronously, by the group-commit thread, or not at all
+        self.durability = durability_policies()
+        self.group_commit = GroupCommit(self.storage, self._snapshot)
+        
+        # Initialize data structures (recover torn journal tails on startup)
+        self.dev_users = self.storage.load("dev_users", {}, recover=True)
+        self.player_users = self.storage.load("player_users", {}, recover=True)
+        self.games = self.storage.load("games", {}, recover=True)
+        self.reviews = self.storage.load("reviews", {}, recover=True)
         
-        # Thread locks for concurrent access
-        self.lock = threading.Lock()
+        self.ratings = self.storage.load("ratings", {}, recover=True)
         
-        # Initialize data structures
-        self.dev_users = self._load_json(self.dev_users_file, {})
-        self.player_users = self._load_json(self.player_users_file, {})
-        self.games = self._load_json(self.games_file, {})
-        self.reviews = self._load_json(self.reviews_file, {})
-        self.rooms = self._load_json(self.rooms_file, {})
+        # Bumped whenever a collection changes (own write or another process)
+        self.generations = {name: 0 for name in COLLECTIONS}
+        
+        # Running rating aggregates per game, kept in step with reviews
+        self._rebuild_stale_ratings()
+        
+        # Secondary indexes, rebuilt on load and when another process changed
+        # the collection, updated in place by our own writes
+        self.played = {}  # username -> {game_id}
+        self.games_by_author = {}  # author -> {game_id}
+        for collection in ("player_users", "games"):
+            self._reindex(collection)
+        
+        # Collections another process announces changes to over the change
+        # feed; reads skip revalidation and changes arrive via apply_change()
+        self.followed = set()
         
         # Track online sessions
         self.dev_sessions = {}  # username -> connection
         self.player_sessions = {}  # username -> connection
     
-    def _load_json(self, filepath, default):
-        """Load JSON file or return default if not exists"""
-        if os.path.exists(filepath):
+    def _persist(self, collection, key, value=None, op='set', index=None):
+        """Hand one mutation of a collection to the storage engine"""
+        policy = self.durability.get(collection, 'sync')
+        if policy == 'sync':
+            data = getattr(self, collection)
+            if op == 'set' and value is None:
+                value = data[key]
+            self.storage.record(collection, data, op, key, value, index)
+        elif policy == 'batched':
+            self.group_commit.mark(collection)
+        self.generations[collection] += 1
+    
+    def _snapshot(self, collection):
+        """Copy of a collection the group-commit thread can write outside its lock"""
+        with self.locks[collection]:
+            # Entries are replaced rather than changed, except review lists (appended to)
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in getattr(self, collection).items()}
+    
+    def _refresh(self, collection):
+        """Pick up writes made by the other server process (call with the collection lock held)"""
+        data = self.storage.refresh(collection, getattr(self, collection), {})
+        if data is not None:
+            setattr(self, collection, data)
+            self._reindex(collection)
+            self.generations[collection] += 1
+    
+    def _reindex(self, collection):
+        """Rebuild the secondary index derived from a collection (if it has one)"""
+        if collection == "player_users":
+            self.played = {username: set(user.get('played_games', []))
+                           for username, user in self.player_users.items()}
+        elif collection == "games":
+            games_by_author = {}
+            for game_id, game in self.games.items():
+                games_by_author.setdefault(game.get('author'), set()).add(game_id)
+            self.games_by_author = games_by_author
+    
+    def _index_game(self, game_id, old, new):
+        """Move a game between authors in games_by_author"""
+        if old is not None:
+            game_ids = self.games_by_author.get(old.get('author'))
+            if game_ids is not None:
+                game_ids.discard(game_id)
+                if not game_ids:
+                    del self.games_by_author[old.get('author')]
+        if new is not None:
+            self.games_by_author.setdefault(new.get('author'), set()).add(game_id)
+    
+    def _revalidate(self, collection):
+        """Refresh a collection for a reader without waiting on writers
+        
+        While a writer of this process holds the collection, the reader uses
+        the current snapshot; the next read revalidates. Followed
+        collections are kept current by the change feed instead.
+        """
+        if collection in self.followed:
+            return
+        lock = self.locks[collection]
+        if lock.acquire(blocking=False):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return default
-        return default
+                self._refresh(collection)
+            finally:
+                lock.release()
+    
+    def follow(self, collection):
+        """Stop revalidating a collection on read; the caller feeds it changes"""
+        self.followed.add(collection)
+    
+    def resync(self, collection):
+        """Catch up with the files after change-feed events may have been missed"""
+        with self.locks[collection]:
+            self._refresh(collection)
+    
+    def apply_change(self, collection, key, value):
+        """Apply a change another process announced (value None deletes the key)
+        
+        The other process already persisted it; this only updates our copy.
+        """
+        with self.locks[collection]:
+            data = getattr(self, collection)
+            old = data.get(key)
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+            if collection == "games":
+                self._index_game(key, old, value)
+            else:
+                self._reindex(collection)
+            self.generations[collection] += 1
     
-    def _save_json(self, filepath, data):
-        """Save data to JSON file"""
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    def _key_lock(self, collection, key):
+        return self.key_locks[collection].for_key(key)
+    
+    @staticmethod
+    def _rating_bucket(rating):
+        """Histogram bucket ("1".."5") for a rating"""
+        return str(min(5, max(1, int(rating))))
+    
+    def _rebuild_stale_ratings(self):
+        """Recompute aggregates that do not match the stored reviews
+        
+        Covers data written before aggregates existed and a crash between
+        appending a review and saving its aggregate.
+        """
+        for game_id, reviews in self.reviews.items():
+            stats = self.ratings.get(game_id)
+            if stats and stats.get('count') == len(reviews):
+                continue
+            
+            histogram = {str(i): 0 for i in range(1, 6)}
+            for review in reviews:
+                histogram[self._rating_bucket(review['rating'])] += 1
+            self.ratings[game_id] = {
+                "sum": sum(r['rating'] for r in reviews),
+                "count": len(reviews),
+                "histogram": histogram
+            }
+            self._persist("ratings", game_id)
+    
+    def get_generation(self, collection):
+        """Get the change counter of a collection after revalidating it"""
+        self._revalidate(collection)
+        return self.generations[collection]
+    
+    def get_cache_stats(self):
+        """Get revalidation hit/miss counters per collection"""
+        return {name: stats.as_dict() for name, stats in dict(self.storage.stats).items()}
+    
+    def get_flush_stats(self):
+        """Get durability policies and group-commit counters"""
+        return {"durability": dict(self.durability), **self.group_commit.stats}
+    
+    def get_lock_stats(self):
+        """Get acquisitions and wait time per collection lock and per key-stripe set"""
+        stats = {name: lock.stats.as_dict() for name, lock in self.locks.items()}
+        for name, striped in self.key_locks.items():
+            stats[f"{name}.keys"] = striped.stats().as_dict()
+        return stats
     
     # Developer User Management
     def register_dev_user(self, username, password):
         """Register a new developer user"""
-        with self.lock:
+        with self._key_lock("dev_users", username), self.locks["dev_users"]:
             if username in self.dev_users:
                 return False, "帳號已被使用"
             
@@ -69,16 +222,17 @@ class DatabaseServer:
                 "password": self._hash_password(password),
                 "created_at": datetime.now().isoformat()
             }
-            self._save_json(self.dev_users_file, self.dev_users)
+            self._persist("dev_users", username)
             return True, "註冊成功"
     
     def login_dev_user(self, username, password):
         """Login developer user"""
-        with self.lock:
-            if username not in self.dev_users:
+        with self._key_lock("dev_users", username):
+            user = self.dev_users.get(username)
+            if user is None:
                 return False, "帳號或密碼錯誤"
             
-            if self.dev_users[username]["password"] != self._hash_password(password):
+            if user["password"] != self._hash_password(password):
                 return False, "帳號或密碼錯誤"
             
             if username in self.dev_sessions:
@@ -88,7 +242,7 @@ class DatabaseServer:
     
     def set_dev_session(self, username, conn=None):
         """Set developer session"""
-        with self.lock:
+        with self._key_lock("dev_users", username):
             if conn:
                 self.dev_sessions[username] = conn
             elif username in self.dev_sessions:
@@ -97,7 +251,7 @@ class DatabaseServer:
     # Player User Management
     def register_player_user(self, username, password):
         """Register a new player user"""
-        with self.lock:
+        with self._key_lock("player_users", username), self.locks["player_users"]:
             if username in self.player_users:
                 return False, "帳號已被使用"
             
@@ -106,16 +260,18 @@ class DatabaseServer:
                 "created_at": datetime.now().isoformat(),
                 "played_games": []
             }
-            self._save_json(self.player_users_file, self.player_users)
+            self.played[username] = set()
+            self._persist("player_users", username)
             return True, "註冊成功"
     
     def login_player_user(self, username, password):
         """Login player user"""
-        with self.lock:
-            if username not in self.player_users:
+        with self._key_lock("player_users", username):
+            user = self.player_users.get(username)
+            if user is None:
                 return False, "帳號或密碼錯誤"
             
-            if self.player_users[username]["password"] != self._hash_password(password):
+            if user["password"] != self._hash_password(password):
                 return False, "帳號或密碼錯誤"
             
             if username in self.player_sessions:
@@ -125,7 +281,7 @@ class DatabaseServer:
     
     def set_player_session(self, username, conn=None):
         """Set player session"""
-        with self.lock:
+        with self._key_lock("player_users", username):
             if conn:
                 self.player_sessions[username] = conn
             elif username in self.player_sessions:
@@ -134,57 +290,55 @@ class DatabaseServer:
     # Game Management
     def add_game(self, game_id, game_data):
         """Add a new game"""
-        with self.lock:
+        with self.locks["games"]:
+            self._index_game(game_id, self.games.get(game_id), game_data)
             self.games[game_id] = game_data
-            self._save_json(self.games_file, self.games)
+            self._persist("games", game_id)
             return True
     
     def update_game(self, game_id, game_data):
         """Update an existing game"""
-        with self.lock:
+        with self.locks["games"]:
             if game_id not in self.games:
                 return False, "遊戲不存在"
             
-            # Keep original data and update
-            self.games[game_id].update(game_data)
-            self._save_json(self.games_file, self.games)
+            # Keep original data and update (as a new entry, for lock-free readers)
+            old = self.games[game_id]
+            self.games[game_id] = {**old, **game_data}
+            self._index_game(game_id, old, self.games[game_id])
+            self._persist("games", game_id)
             return True, "更新成功"
     
     def delete_game(self, game_id):
         """Delete a game"""
-        with self.lock:
+        with self.locks["games"]:
             if game_id not in self.games:
                 return False, "遊戲不存在"
             
-            del self.games[game_id]
-            self._save_json(self.games_file, self.games)
+            self._index_game(game_id, self.games.pop(game_id), None)
+            self._persist("games", game_id, op='delete')
             return True, "刪除成功"
     
     def get_game(self, game_id):
-        """Get game info (reload from file to ensure freshness)"""
-        with self.lock:
-            # Reload from file to get latest updates from other server instances
-            self.games = self._load_json(self.games_file, {})
-            return self.games.get(game_id)
+        """Get game info (revalidated against writes by other server instances)"""
+        self._revalidate("games")
+        return self.games.get(game_id)
     
     def get_all_games(self):
-        """Get all games (reload from file to ensure freshness)"""
-        with self.lock:
-            # Reload from file to get latest updates from other server instances
-            self.games = self._load_json(self.games_file, {})
-            return dict(self.games)
+        """Get all games (revalidated against writes by other server instances)"""
+        self._revalidate("games")
+        return dict(self.games)
     
     def get_games_by_author(self, author):
-        """Get games by author (reload from file to ensure freshness)"""
-        with self.lock:
-            # Reload from file to get latest updates from other server instances
-            self.games = self._load_json(self.games_file, {})
-            return {gid: g for gid, g in self.games.items() if g.get('author') == author}
+        """Get games by author (revalidated against writes by other server instances)"""
+        self._revalidate("games")
+        games = self.games
+        return {gid: games[gid] for gid in list(self.games_by_author.get(author, ())) if gid in games}
     
     # Review Management
     def add_review(self, game_id, username, rating, comment):
         """Add a review for a game"""
-        with self.lock:
+        with self.locks["reviews"]:
             if game_id not in self.reviews:
                 self.reviews[game_id] = []
             
@@ -195,84 +349,74 @@ class DatabaseServer:
                 "created_at": datetime.now().isoformat()
             }
             self.reviews[game_id].append(review)
-            self._save_json(self.reviews_file, self.reviews)
+            self._persist("reviews", game_id, review, op='append',
+                          index=len(self.reviews[game_id]) - 1)
+            
+            # Update the running aggregate instead of re-summing on read
+            with self.locks["ratings"]:
+                stats = self.ratings.get(game_id) or {
+                    "sum": 0, "count": 0,
+                    "histogram": {str(i): 0 for i in range(1, 6)}
+                }
+                histogram = dict(stats['histogram'])
+                histogram[self._rating_bucket(rating)] += 1
+                self.ratings[game_id] = {
+                    "sum": stats['sum'] + rating,
+                    "count": stats['count'] + 1,
+                    "histogram": histogram
+                }
+                self._persist("ratings", game_id)
             return True
     
     def get_reviews(self, game_id):
         """Get all reviews for a game"""
-        with self.lock:
-            return self.reviews.get(game_id, [])
+        return list(self.reviews.get(game_id, []))
     
     def get_average_rating(self, game_id):
         """Get average rating for a game"""
-        with self.lock:
-            reviews = self.reviews.get(game_id, [])
-            if not reviews:
-                return 0
-            return sum(r['rating'] for r in reviews) / len(reviews)
-    
-    # Room Management
-    def create_room(self, room_id, room_data):
-        """Create a new room"""
-        with self.lock:
-            self.rooms[room_id] = room_data
-            self._save_json(self.rooms_file, self.rooms)
-            return True
-    
-    def get_room(self, room_id):
-        """Get room info"""
-        with self.lock:
-            return self.rooms.get(room_id)
-    
-    def get_all_rooms(self):
-        """Get all rooms"""
-        with self.lock:
-            return dict(self.rooms)
-    
-    def update_room(self, room_id, room_data):
-        """Update room info"""
-        with self.lock:
-            if room_id not in self.rooms:
-                return False
-            self.rooms[room_id].update(room_data)
-            self._save_json(self.rooms_file, self.rooms)
-            return True
+        stats = self.ratings.get(game_id)
+        if not stats or not stats['count']:
+            return 0
+        return stats['sum'] / stats['count']
     
-    def delete_room(self, room_id):
-        """Delete a room"""
-        with self.lock:
-            if room_id in self.rooms:
-                del self.rooms[room_id]
-                self._save_json(self.rooms_file, self.rooms)
-                return True
-            return False
+    def get_rating_summary(self, game_id):
+        """Get average, review count and rating histogram for a game"""
+        stats = self.ratings.get(game_id)
+        if not stats or not stats['count']:
+            return {"average": 0, "count": 0,
+                    "histogram": {str(i): 0 for i in range(1, 6)}}
+        return {
+            "average": stats['sum'] / stats['count'],
+            "count": stats['count'],
+            "histogram": dict(stats['histogram'])
+        }
     
     def add_played_game(self, username, game_id):
         """Mark that a player has played a game"""
-        with self.lock:
-            if username in self.player_users:
-                if 'played_games' not in self.player_users[username]:
-                    self.player_users[username]['played_games'] = []
-                if game_id not in self.player_users[username]['played_games']:
-                    self.player_users[username]['played_games'].append(game_id)
-                    self._save_json(self.player_users_file, self.player_users)
+        with self._key_lock("player_users", username), self.locks["player_users"]:
+            user = self.player_users.get(username)
+            if user is None or game_id in self.played.get(username, ()):
+                return
+            self.player_users[username] = {**user, "played_games": user.get('played_games', []) + [game_id]}
+            self.played.setdefault(username, set()).add(game_id)
+            self._persist("player_users", username)
     
     def has_played_game(self, username, game_id):
         """Check if player has played a game"""
-        with self.lock:
-            # Reload from file to get latest data
-            self.player_users = self._load_json(self.player_users_file, {})
-            if username in self.player_users:
-                return game_id in self.player_users[username].get('played_games', [])
-            return False
-
+        # Pick up played games recorded by the lobby process
+        self._revalidate("player_users")
+        return game_id in self.played.get(username, ())
 
 # Singleton instance
 _db_instance = None
 
 def get_db():
-    """Get database singleton instance"""
+    """Get database singleton instance (GAME_STORE_STORAGE=sqlite selects SQLite)"""
     global _db_instance
     if _db_instance is None:
-        _db_instance = DatabaseServer()
+        if os.environ.get('GAME_STORE_STORAGE') == 'sqlite':
+            from sqlite_db import SQLiteDatabaseServer
+            _db_instance = SQLiteDatabaseServer()
+        else:
+            _db_instance = DatabaseServer()
     return _db_instance
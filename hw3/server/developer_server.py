@@ -8,28 +8,90 @@ import threading
 import os
 import shutil
 import json
-from protocol import Protocol, MessageType, recv_message, send_message, recv_file
+from protocol import Protocol, MessageType, recv_message, send_message, choose_codec, set_socket_codec, bind_socket_codec
 from db_server import get_db
+from archive_store import ArchiveStore
+from manifest import save_manifest, manifest_path
+from stream_unzip import recv_zip
+from async_transport import AsyncServer, ClientSession, TRANSPORT, BACKLOG
+from dispatcher import INLINE
+from blob_store import BlobStore, RUN_DIR
+from change_feed import ChangePublisher, feed_path
+from stats_log import StatsLog
+
+
+def _valid_path_part(name):
+    """True if name is usable as a single directory name (no separators, no '..')"""
+    return (isinstance(name, str) and name.strip() != '' and '..' not in name
+            and not any(c in name for c in ('/', '\\', '\0')))
+
+
+def _valid_version(version):
+    """Version numbers: letters, digits, '.', '-' and '_' only"""
+    return (_valid_path_part(version)
+            and version.replace('.', '').replace('-', '').replace('_', '').isalnum())
 
 
 class DeveloperServer:
+    # Worker lane per message type; INLINE requests are answered on the event loop
+    # and must not block (reads revalidate files, so they get a lane)
+    ROUTES = {
+        MessageType.HELLO: INLINE,
+        MessageType.DEV_LIST_MY_GAMES: "read",
+        MessageType.DEV_UPLOAD_GAME: "transfer",
+        MessageType.DEV_UPDATE_GAME: "transfer",
+        MessageType.DEV_REGISTER: "write",
+        MessageType.DEV_LOGIN: "write",
+        MessageType.DEV_DELETE_GAME: "write",
+    }
+    
+    # Requests followed by a zip upload; never refused when their lane is full
+    STREAMING = (MessageType.DEV_UPLOAD_GAME, MessageType.DEV_UPDATE_GAME)
+    
     def __init__(self, host='0.0.0.0', port=8001, upload_dir='uploaded_games'):
         self.host = host
         self.port = port
         self.upload_dir = upload_dir
         self.db = get_db()
         self.server_socket = None
+        self.transport = None
         self.running = False
         
         os.makedirs(upload_dir, exist_ok=True)
+        self.archives = ArchiveStore(upload_dir)
+        self.blobs = BlobStore(upload_dir)
+        
+        # Tell the lobby about game changes so it need not re-check games on disk
+        self.changes = ChangePublisher(feed_path(self.db.data_dir))
+        
+        # Counters logged every GAME_STORE_STATS_INTERVAL seconds (off by default)
+        self.stats_log = StatsLog("Developer Server", {
+            "cache": self.db.get_cache_stats,
+            "locks": self.db.get_lock_stats,
+            "flush": self.db.get_flush_stats,
+            "lanes": lambda: self.transport.dispatcher.stats() if self.transport else {},
+            "feed": lambda: dict(self.changes.stats),
+        })
     
     def start(self):
         """Start the developer server"""
+        self.running = True
+        
+        if TRANSPORT == 'threads':
+            self._serve_threads()
+            return
+        
+        self.transport = AsyncServer("Developer Server", self.host, self.port,
+                                     self.dispatch, self.on_disconnect, self.ROUTES,
+                                     streaming=self.STREAMING)
+        self.transport.run()
+    
+    def _serve_threads(self):
+        """Thread-per-client transport (GAME_STORE_TRANSPORT=threads)"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        self.running = True
+        self.server_socket.listen(BACKLOG)
         
         print(f"Developer Server started on {self.host}:{self.port}")
         
@@ -49,7 +111,7 @@ class DeveloperServer:
     
     def handle_client(self, client_socket, address):
         """Handle developer client connection"""
-        username = None
+        session = ClientSession(client_socket, address)
         
         try:
             while True:
@@ -58,64 +120,73 @@ class DeveloperServer:
                     break
                 
                 msg_type, data = result
-                
-                if msg_type == MessageType.DEV_REGISTER:
-                    response = self.handle_register(data)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.DEV_LOGIN:
-                    response, user = self.handle_login(data)
-                    client_socket.sendall(response)
-                    if user:
-                        username = user
-                        self.db.set_dev_session(username, client_socket)
-                
-                elif msg_type == MessageType.DEV_LOGOUT:
-                    if username:
-                        self.db.set_dev_session(username, None)
-                        username = None
-                    client_socket.sendall(Protocol.success_response({"message": "登出成功"}))
-                
-                elif msg_type == MessageType.DEV_UPLOAD_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_upload_game(data, username, client_socket)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.DEV_UPDATE_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_update_game(data, username, client_socket)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.DEV_DELETE_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_delete_game(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.DEV_LIST_MY_GAMES:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_list_my_games(username)
-                    client_socket.sendall(response)
-                
-                else:
-                    client_socket.sendall(Protocol.error_response("未知的請求類型"))
+                session.send(self.dispatch(session, msg_type, data))
         
         except Exception as e:
             print(f"Error handling client {address}: {e}")
         
         finally:
-            if username:
-                self.db.set_dev_session(username, None)
+            self.on_disconnect(session)
             client_socket.close()
             print(f"Developer client {address} disconnected")
     
+    def dispatch(self, session, msg_type, data):
+        """Handle one request and return the response to send"""
+        username = session.username
+        client_socket = session.sock
+        bind_socket_codec(client_socket)
+        
+        if msg_type == MessageType.HELLO:
+            # Reply in the old codec, then switch this connection over
+            codec = choose_codec(data.get('codecs'))
+            response = Protocol.success_response({"codec": codec})
+            set_socket_codec(client_socket, codec)
+            return response
+        
+        elif msg_type == MessageType.DEV_REGISTER:
+            return self.handle_register(data)
+        
+        elif msg_type == MessageType.DEV_LOGIN:
+            response, user = self.handle_login(data)
+            if user:
+                session.username = user
+                self.db.set_dev_session(user, client_socket)
+            return response
+        
+        elif msg_type == MessageType.DEV_LOGOUT:
+            if username:
+                self.db.set_dev_session(username, None)
+                session.username = None
+            return Protocol.success_response({"message": "登出成功"})
+        
+        elif msg_type == MessageType.DEV_UPLOAD_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_upload_game(data, username, client_socket)
+        
+        elif msg_type == MessageType.DEV_UPDATE_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_update_game(data, username, client_socket)
+        
+        elif msg_type == MessageType.DEV_DELETE_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_delete_game(data, username)
+        
+        elif msg_type == MessageType.DEV_LIST_MY_GAMES:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_list_my_games(username)
+        
+        else:
+            return Protocol.error_response("未知的請求類型")
+    
+    def on_disconnect(self, session):
+        """Clear the session of a disconnected developer"""
+        if session.username:
+            self.db.set_dev_session(session.username, None)
+    
     def handle_register(self, data):
         """Handle developer registration"""
         username = data.get('username')
@@ -159,6 +230,12 @@ class DeveloperServer:
             if not all([game_name, description, game_type, start_command]):
                 return Protocol.error_response("缺少必要欄位")
             
+            # Both end up in the upload path
+            if not _valid_path_part(game_name):
+                return Protocol.error_response("遊戲名稱不合法")
+            if not _valid_version(version):
+                return Protocol.error_response("版本號格式不合法")
+            
             # Generate game ID
             game_id = f"{username}_{game_name}".replace(' ', '_')
             
@@ -166,22 +243,40 @@ class DeveloperServer:
             if self.db.get_game(game_id):
                 return Protocol.error_response("遊戲名稱已存在，請使用更新功能")
             
+            # Prepare the directory before the ready signal: after it the
+            # client sends the zip, and an early error would leave it unread
+            game_dir = os.path.join(self.upload_dir, game_id, version)
+            if not self._inside_upload_dir(game_dir):
+                return Protocol.error_response("遊戲路徑不合法")
+            if os.path.exists(game_dir):
+                # Left over from a failed upload; its files may be blob links,
+                # which must never be extracted over
+                shutil.rmtree(game_dir)
+            os.makedirs(game_dir, exist_ok=True)
+            
             # Send ready signal
             send_message(client_socket, MessageType.SUCCESS, {"message": "準備接收遊戲檔案"})
             
-            # Receive game files as a zip
-            game_dir = os.path.join(self.upload_dir, game_id, version)
-            os.makedirs(game_dir, exist_ok=True)
+            # Extract entries as they arrive; hashes come out of the same pass
+            try:
+                manifest = recv_zip(client_socket, game_dir)
+            except ValueError as e:
+                shutil.rmtree(game_dir, ignore_errors=True)
+                return Protocol.error_response(f"遊戲檔案不合法: {str(e)}")
+            except OSError as e:
+                shutil.rmtree(game_dir, ignore_errors=True)
+                return Protocol.error_response(f"儲存遊戲檔案失敗: {str(e)}")
             
-            zip_path = os.path.join(game_dir, "game.zip")
-            if not recv_file(client_socket, zip_path):
+            if manifest is None:
+                shutil.rmtree(game_dir, ignore_errors=True)
                 return Protocol.error_response("接收遊戲檔案失敗")
             
-            # Extract zip file
-            import zipfile
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(game_dir)
-            os.remove(zip_path)
+            # Store files by hash; the manifest goes first so GC sees them
+            save_manifest(self.upload_dir, game_id, version, manifest)
+            self.blobs.ingest(game_dir, manifest)
+            
+            # Build the download archive once, players get this exact file
+            archive = self.archives.build(game_dir, version)
             
             # Save game metadata
             game_data = {
@@ -195,10 +290,12 @@ class DeveloperServer:
                 "start_command": start_command,
                 "created_at": __import__('datetime').datetime.now().isoformat(),
                 "updated_at": __import__('datetime').datetime.now().isoformat(),
-                "active": True
+                "active": True,
+                "archive": archive
             }
             
             self.db.add_game(game_id, game_data)
+            self.changes.publish("upsert", "games", game_id, game_data)
             
             return Protocol.success_response({
                 "message": "遊戲上架成功",
@@ -220,7 +317,7 @@ class DeveloperServer:
                 return Protocol.error_response("缺少遊戲ID或版本號")
             
             # 驗證版本號格式
-            if not new_version.replace('.', '').replace('-', '').replace('_', '').isalnum():
+            if not _valid_version(new_version):
                 return Protocol.error_response("版本號格式不合法")
             
             # Check if game exists and belongs to user
@@ -238,40 +335,48 @@ class DeveloperServer:
             if not game.get('active', True):
                 return Protocol.error_response("無法更新已下架的遊戲")
             
-            # Send ready signal
-            send_message(client_socket, MessageType.SUCCESS, {"message": "準備接收遊戲檔案"})
-            
-            # Receive new game files
+            # Stored versions share files with other versions and are immutable
             game_dir = os.path.join(self.upload_dir, game_id, new_version)
+            if not self._inside_upload_dir(game_dir):
+                return Protocol.error_response("遊戲路徑不合法")
+            if os.path.exists(game_dir):
+                return Protocol.error_response("此版本號已存在，請使用新的版本號")
+            
             os.makedirs(game_dir, exist_ok=True)
             
-            zip_path = os.path.join(game_dir, "game.zip")
+            # Send ready signal
+            send_message(client_socket, MessageType.SUCCESS, {"message": "準備接收遊戲檔案"})
+            
+            # 錯誤處理：檔案不合法（路徑、大小、格式）
+            try:
+                manifest = recv_zip(client_socket, game_dir)
+            except ValueError as e:
+                # 清理失敗的目錄
+                shutil.rmtree(game_dir, ignore_errors=True)
+                return Protocol.error_response(f"遊戲檔案不合法: {str(e)}")
+            except OSError as e:
+                shutil.rmtree(game_dir, ignore_errors=True)
+                return Protocol.error_response(f"儲存遊戲檔案失敗: {str(e)}")
             
             # 錯誤處理：接收檔案失敗
-            if not recv_file(client_socket, zip_path):
+            if manifest is None:
                 # 清理失敗的目錄
-                import shutil
-                if os.path.exists(game_dir):
-                    shutil.rmtree(game_dir)
+                shutil.rmtree(game_dir, ignore_errors=True)
                 return Protocol.error_response("接收遊戲檔案失敗")
             
-            # Extract zip file
-            try:
-                import zipfile
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(game_dir)
-                os.remove(zip_path)
-            except Exception as e:
-                # 清理失敗的目錄
-                import shutil
-                if os.path.exists(game_dir):
-                    shutil.rmtree(game_dir)
-                return Protocol.error_response(f"解壓縮遊戲檔案失敗: {str(e)}")
+            # Store files by hash; unchanged files cost no extra disk
+            save_manifest(self.upload_dir, game_id, new_version, manifest)
+            self.blobs.ingest(game_dir, manifest)
+            
+            # Build the download archive for the new version
+            archive = self.archives.build(game_dir, new_version)
+            old_archive = game.get('archive')
             
             # Update game metadata
             update_data = {
                 "version": new_version,
-                "updated_at": __import__('datetime').datetime.now().isoformat()
+                "updated_at": __import__('datetime').datetime.now().isoformat(),
+                "archive": archive
             }
             
             # 儲存更新說明
@@ -288,6 +393,11 @@ class DeveloperServer:
             
             if not success:
                 return Protocol.error_response(message)
+            self.changes.publish("upsert", "games", game_id, self.db.get_game(game_id))
+            
+            # The previous version's archive is no longer served
+            if old_archive and old_archive['sha256'] != archive['sha256']:
+                self.archives.release(old_archive['sha256'], self.db.get_all_games())
             
             return Protocol.success_response({
                 "message": f"遊戲已成功更新至版本 {new_version}",
@@ -320,9 +430,40 @@ class DeveloperServer:
         
         # Mark game as inactive instead of deleting
         self.db.update_game(game_id, {"active": False})
+        self.changes.publish("delist", "games", game_id, self.db.get_game(game_id))
+        
+        # Only the last listed version is kept around
+        self._prune_versions(game_id, keep=game['version'])
         
         return Protocol.success_response({"message": "遊戲已下架"})
     
+    def _inside_upload_dir(self, path):
+        """True if path resolves to somewhere below upload_dir"""
+        root = os.path.realpath(self.upload_dir)
+        return os.path.realpath(path).startswith(root + os.sep)
+    
+    def _prune_versions(self, game_id, keep):
+        """Remove every stored version and run copy except keep, then drop unreferenced blobs"""
+        game_root = os.path.join(self.upload_dir, game_id)
+        if os.path.isdir(game_root):
+            for version in os.listdir(game_root):
+                if version.startswith('.') or version == keep:
+                    continue
+                shutil.rmtree(os.path.join(game_root, version), ignore_errors=True)
+                version_manifest = manifest_path(self.upload_dir, game_id, version)
+                if os.path.exists(version_manifest):
+                    os.remove(version_manifest)
+            
+            # Run copies of removed versions (dot names are copies still being made)
+            run_root = os.path.join(game_root, RUN_DIR)
+            if os.path.isdir(run_root):
+                for version in os.listdir(run_root):
+                    if not version.startswith('.') and version != keep:
+                        shutil.rmtree(os.path.join(run_root, version), ignore_errors=True)
+        
+        removed, freed = self.blobs.collect()
+        print(f"[Developer] Pruned {game_id}: {removed} blobs removed, {freed} bytes freed")
+    
     def handle_list_my_games(self, username):
         """List games by this developer"""
         games = self.db.get_games_by_author(username)
@@ -344,6 +485,8 @@ class DeveloperServer:
     def stop(self):
         """Stop the server"""
         self.running = False
+        if self.transport:
+            self.transport.stop()
         if self.server_socket:
             self.server_socket.close()
 
@@ -0,0 +1,102 @@
+"""
+Request Dispatcher for Game Store Servers
+Routes each message type to a bounded worker lane, or answers it inline on
+the event loop when it never blocks, so heavy requests cannot starve light ones
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# lane -> (workers, queued requests allowed beyond busy workers)
+DEFAULT_LANES = {
+    "read": (8, 128),       # catalog, room and review reads (may stat or reload files)
+    "transfer": (8, 32),    # file downloads / uploads
+    "game": (4, 16),        # game server start / stop
+    "write": (8, 64),       # account, room and review writes
+    "default": (int(os.environ.get('GAME_STORE_WORKERS', '32')), 256),
+}
+
+INLINE = "inline"
+
+
+def _lanes_from_env():
+    """Apply GAME_STORE_LANES overrides, e.g. "transfer=4:8,write=16:128" """
+    lanes = dict(DEFAULT_LANES)
+    spec = os.environ.get('GAME_STORE_LANES', '')
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            name, sizes = item.split('=')
+            workers, max_queue = sizes.split(':')
+            lanes[name] = (int(workers), int(max_queue))
+        except ValueError:
+            print(f"[Dispatcher] Ignoring invalid lane spec: {item}")
+    return lanes
+
+
+class Lane:
+    """A thread pool that refuses work once its queue is full"""
+    
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self.lock = threading.Lock()
+        self.pending = 0  # running + queued
+        self.completed = 0
+        self.rejected = 0
+    
+    def try_acquire(self, force=False):
+        """Reserve a slot; False means the lane is saturated (force queues anyway)"""
+        with self.lock:
+            if not force and self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            return True
+    
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+
+
+class Dispatcher:
+    """Map message types to lanes
+    
+    routes maps MessageType -> lane name or INLINE; unlisted types use the
+    "default" lane.
+    """
+    
+    def __init__(self, routes, lanes=None):
+        self.routes = routes
+        self.lanes = {
+            name: Lane(name, workers, max_queue)
+            for name, (workers, max_queue) in (lanes or _lanes_from_env()).items()
+        }
+    
+    def lane_for(self, msg_type):
+        """The lane for a message type, or None if it is answered inline"""
+        name = self.routes.get(msg_type, "default")
+        if name == INLINE:
+            return None
+        return self.lanes.get(name, self.lanes["default"])
+    
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+    
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.executor.shutdown(wait=False)
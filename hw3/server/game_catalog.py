@@ -0,0 +1,178 @@
+"""
+Game Catalog Index for Lobby Server
+Keeps the store listing pre-sorted by every supported key so that paged
+requests only touch the rows they return
+"""
+
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right
+
+
+# sort key -> default direction
+SORT_KEYS = {
+    "rating": "desc",
+    "updated_at": "desc",
+    "name": "asc",
+}
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort, order, key):
+    """Opaque cursor pointing just past the given index key"""
+    raw = json.dumps([sort, order, list(key)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (sort, order, key). Raises ValueError if malformed
+    
+    The key must have the shape of the sort's index key, since it is
+    compared against that index.
+    """
+    try:
+        sort, order, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        value, game_id = key
+    except Exception:
+        raise ValueError("invalid cursor")
+    
+    if sort == "rating":
+        value_ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    else:
+        value_ok = isinstance(value, str)
+    if sort not in SORT_KEYS or not value_ok or not isinstance(game_id, str):
+        raise ValueError("invalid cursor")
+    return sort, order, (value, game_id)
+
+
+class GameCatalog:
+    """Sorted indexes over active games, rebuilt only when games or ratings change"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self._built_for = None  # (games generation, ratings generation)
+        self._indexes = {}  # sort key -> (sorted keys, entries in same order)
+        self._entries = {}  # game_id -> listing entry
+    
+    @staticmethod
+    def _index_key(sort, entry):
+        """Ascending index key; game_id breaks ties so keys are unique"""
+        if sort == "rating":
+            return (entry['rating'], entry['game_id'])
+        if sort == "updated_at":
+            return (entry['updated_at'] or "", entry['game_id'])
+        return (entry['name'].casefold(), entry['game_id'])
+    
+    def _rebuild_if_stale(self):
+        """Rebuild indexes when the catalog or ratings changed (lock held)"""
+        version = (self.db.get_generation("games"), self.db.get_generation("ratings"))
+        if version == self._built_for:
+            return
+        
+        entries = {}
+        for game_id, game in self.db.get_all_games().items():
+            if not game.get('active', True):
+                continue
+            entries[game_id] = {
+                "game_id": game_id,
+                "name": game['name'],
+                "author": game['author'],
+                "type": game['type'],
+                "max_players": game['max_players'],
+                "version": game['version'],
+                "updated_at": game.get('updated_at', game.get('created_at', '')),
+                "rating": round(self.db.get_average_rating(game_id), 1)
+            }
+        
+        indexes = {}
+        for sort in SORT_KEYS:
+            ordered = sorted(entries.values(), key=lambda e: self._index_key(sort, e))
+            indexes[sort] = ([self._index_key(sort, e) for e in ordered], ordered)
+        
+        self._entries = entries
+        self._indexes = indexes
+        self._built_for = version
+    
+    def all_entries(self):
+        """All active games as listing entries"""
+        with self.lock:
+            self._rebuild_if_stale()
+            return list(self._entries.values())
+    
+    @staticmethod
+    def _matches(entry, filters):
+        """Check an entry against the request filters"""
+        game_type = filters.get('type')
+        if game_type and game_type.upper() not in entry['type'].upper():
+            return False
+        author = filters.get('author')
+        if author and entry['author'] != author:
+            return False
+        min_rating = filters.get('min_rating')
+        if min_rating is not None and entry['rating'] < min_rating:
+            return False
+        max_players = filters.get('max_players')
+        if max_players is not None and entry['max_players'] != max_players:
+            return False
+        game_ids = filters.get('game_ids')
+        if game_ids is not None and entry['game_id'] not in game_ids:
+            return False
+        return True
+    
+    def page(self, sort=None, order=None, cursor=None, page_size=DEFAULT_PAGE_SIZE, filters=None):
+        """Return (games, next_cursor, total) for one page of the listing
+        
+        total is the number of listed games, or None for a filtered listing
+        (counting matches would scan the whole catalog); next_cursor tells
+        whether more pages follow either way.
+        Raises ValueError for an unknown sort key, order or a bad cursor.
+        """
+        sort = sort or "rating"
+        if sort not in SORT_KEYS:
+            raise ValueError("unknown sort")
+        order = order or SORT_KEYS[sort]
+        if order not in ("asc", "desc"):
+            raise ValueError("unknown order")
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        filters = filters or {}
+        if filters.get('game_ids') is not None:
+            filters = dict(filters, game_ids=set(filters['game_ids']))
+        
+        after = None
+        if cursor:
+            cursor_sort, cursor_order, after = decode_cursor(cursor)
+            if (cursor_sort, cursor_order) != (sort, order):
+                raise ValueError("cursor does not match sort")
+        
+        with self.lock:
+            self._rebuild_if_stale()
+            keys, ordered = self._indexes[sort]
+            total = None if filters else len(ordered)
+            
+            # Walk the index from the cursor position in the requested direction
+            if order == "asc":
+                start = bisect_right(keys, after) if after else 0
+                positions = range(start, len(ordered))
+            else:
+                start = bisect_left(keys, after) if after else len(ordered)
+                positions = range(start - 1, -1, -1)
+            
+            games = []
+            last_key = None
+            more = False
+            for pos in positions:
+                entry = ordered[pos]
+                if not self._matches(entry, filters):
+                    continue
+                if len(games) == page_size:
+                    more = True
+                    break
+                games.append(dict(entry))
+                last_key = keys[pos]
+        
+        next_cursor = encode_cursor(sort, order, last_key) if more else None
+        return games, next_cursor, total
@@ -0,0 +1,217 @@
+"""
+Game Server Supervisor for Game Store System
+Launches game servers and reacts the moment one exits: one thread waits on
+process fds (pidfd) and output pipes together, so no timer polls the rooms
+"""
+
+import os
+import selectors
+import subprocess
+import threading
+import time
+
+
+OUTPUT_TAIL_BYTES = 8 * 1024  # game server output kept for the result
+
+
+class GameProcess:
+    """A running (or finished) game server and what is known about it"""
+    
+    def __init__(self, room_id, process, meta):
+        self.room_id = room_id
+        self.process = process
+        self.meta = meta  # caller's data (game_id, port, ...)
+        self.started_at = time.time()
+        self.ended_at = None
+        self.exit_code = None
+        self.stopped = False  # ended by stop(), not by itself
+        self.output = bytearray()
+        self.pidfd = None
+    
+    def result(self, lines=10):
+        """Last lines the game server printed"""
+        text = self.output.decode('utf-8', errors='replace').strip()
+        return '\n'.join(text.split('\n')[-lines:]) if text else ''
+    
+    def rss(self):
+        """Resident set size in bytes, or None if unknown"""
+        try:
+            with open(f"/proc/{self.process.pid}/status", 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+    
+    def metrics(self):
+        end = self.ended_at or time.time()
+        return {
+            "pid": self.process.pid,
+            "uptime": round(end - self.started_at, 3),
+            "exit_code": self.exit_code,
+            "rss": self.rss() if self.exit_code is None else None
+        }
+
+
+class GameSupervisor:
+    """Start game servers and call on_exit(game) as soon as one exits
+    
+    on_exit runs on the supervisor thread, once per process, after its
+    output has been drained; game.stopped tells a stop() apart from the game
+    ending by itself.
+    """
+    
+    def __init__(self, on_exit):
+        self.on_exit = on_exit
+        self.lock = threading.Lock()
+        self.games = {}  # room_id -> GameProcess
+        self.selector = selectors.DefaultSelector()
+        
+        # Wakes the selector when a process is added from another thread
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._pending = []
+        
+        self.thread = threading.Thread(target=self._run, name="game-supervisor", daemon=True)
+        self.thread.start()
+    
+    def launch(self, room_id, cmd, cwd, **meta):
+        """Start a game server for a room. Raises OSError if it cannot start"""
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        game = GameProcess(room_id, process, meta)
+        
+        with self.lock:
+            self.games[room_id] = game
+            self._pending.append((game, 'watch'))
+        os.write(self._wake_w, b'\0')
+        return game
+    
+    def get(self, room_id):
+        with self.lock:
+            return self.games.get(room_id)
+    
+    def assign(self, room_id, new_room_id):
+        """Move a running game server to another room (warm pool hand-off)"""
+        with self.lock:
+            game = self.games.pop(room_id)
+            game.room_id = new_room_id
+            self.games[new_room_id] = game
+        return game
+    
+    def stop(self, room_id, timeout=5):
+        """Terminate a room's game server and wait for it. False if none was running"""
+        game = self.get(room_id)
+        if not game or game.process.poll() is not None:
+            return False
+        
+        game.stopped = True
+        game.process.terminate()
+        try:
+            game.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            game.process.kill()
+            game.process.wait()
+        return True
+    
+    def metrics(self):
+        """room_id -> {pid, uptime, exit_code, rss} for running game servers"""
+        with self.lock:
+            games = list(self.games.values())
+        return {game.room_id: game.metrics() for game in games}
+    
+    def _watch(self, game):
+        """Register a new process's output pipe and exit notification"""
+        fd = game.process.stdout.fileno()
+        os.set_blocking(fd, False)
+        self.selector.register(fd, selectors.EVENT_READ, (game, 'output'))
+        
+        if hasattr(os, 'pidfd_open'):
+            try:
+                game.pidfd = os.pidfd_open(game.process.pid)
+            except OSError:
+                game.pidfd = None
+        if game.pidfd is not None:
+            self.selector.register(game.pidfd, selectors.EVENT_READ, (game, 'exit'))
+        else:
+            # No pidfd (not Linux); a waiter thread blocks on this one process
+            threading.Thread(target=self._wait, args=(game,), daemon=True).start()
+    
+    def _wait(self, game):
+        game.process.wait()
+        with self.lock:
+            self._pending.append((game, 'exit'))
+        os.write(self._wake_w, b'\0')
+    
+    def _read_output(self, game):
+        """Read what the pipe has; False at end of file"""
+        fd = game.process.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return True
+            except OSError:
+                data = b''
+            if not data:
+                self.selector.unregister(fd)
+                game.process.stdout.close()
+                return False
+            game.output += data
+            del game.output[:-OUTPUT_TAIL_BYTES]
+    
+    def _exited(self, game):
+        """Reap the process, drain its output and report it"""
+        if game.pidfd is not None:
+            self.selector.unregister(game.pidfd)
+            os.close(game.pidfd)
+            game.pidfd = None
+        
+        game.exit_code = game.process.wait()
+        game.ended_at = time.time()
+        if not game.process.stdout.closed:
+            self._read_output(game)
+            if not game.process.stdout.closed:
+                # A grandchild still holds the pipe; stop collecting
+                self.selector.unregister(game.process.stdout.fileno())
+                game.process.stdout.close()
+        
+        with self.lock:
+            if self.games.get(game.room_id) is game:
+                del self.games[game.room_id]
+        
+        try:
+            self.on_exit(game)
+        except Exception as e:
+            print(f"[Supervisor] Error handling exit of room {game.room_id}: {e}")
+    
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    with self.lock:
+                        pending, self._pending = self._pending, []
+                    for game, kind in pending:
+                        if kind == 'watch':
+                            self._watch(game)
+                        else:
+                            self._exited(game)
+                    continue
+                
+                game, kind = key.data
+                if kind == 'output':
+                    if not game.process.stdout.closed:
+                        self._read_output(game)
+                elif game.pidfd is not None:
+                    self._exited(game)
@@ -0,0 +1,112 @@
+"""
+Group Commit for Game Store System
+Coalesces writes to collections that need not be on disk when the call
+returns: writers mark a collection dirty and one background thread writes
+each dirty collection once per interval, or sooner when writes pile up
+"""
+
+import atexit
+import os
+import threading
+import time
+
+
+# Flush timing (override with environment variables)
+FLUSH_INTERVAL = float(os.environ.get('GAME_STORE_FLUSH_INTERVAL', '0.2'))  # seconds
+FLUSH_THRESHOLD = int(os.environ.get('GAME_STORE_FLUSH_THRESHOLD', '100'))  # writes that flush at once
+
+# sync: on disk before the call returns
+# batched: written by the group-commit thread within FLUSH_INTERVAL
+# ephemeral: kept in memory only
+DURABILITY_POLICIES = ("sync", "batched", "ephemeral")
+DEFAULT_DURABILITY = {}  # every collection is sync unless overridden
+
+
+def durability_policies(spec=None):
+    """collection -> policy, overridden by GAME_STORE_DURABILITY="reviews=batched,ratings=batched" """
+    if spec is None:
+        spec = os.environ.get('GAME_STORE_DURABILITY', '')
+    
+    policies = dict(DEFAULT_DURABILITY)
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        collection, _, policy = item.partition('=')
+        policy = policy.strip()
+        if policy not in DURABILITY_POLICIES:
+            raise ValueError(f"Unknown durability policy for {collection.strip()}: {policy}")
+        policies[collection.strip()] = policy
+    return policies
+
+
+class GroupCommit:
+    """Background writer for batched collections
+    
+    snapshot(collection) must return a copy of the collection that is safe
+    to serialize while writers keep changing the original; it is written
+    with storage.flush() (atomic rename, fsync per the engine's setting).
+    Pending writes are flushed on close() and at interpreter exit.
+    """
+    
+    def __init__(self, storage, snapshot, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD):
+        self.storage = storage
+        self.snapshot = snapshot
+        self.interval = interval
+        self.threshold = threshold
+        
+        self.cond = threading.Condition()
+        self.dirty = {}  # collection -> writes since its last flush
+        self.closed = False
+        self.stats = {"writes": 0, "flushes": 0, "errors": 0}
+        
+        self.thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+    
+    def mark(self, collection):
+        """Record one write to a collection; returns without touching disk"""
+        with self.cond:
+            count = self.dirty.get(collection, 0) + 1
+            self.dirty[collection] = count
+            self.stats["writes"] += 1
+            if count == 1 or count >= self.threshold:
+                self.cond.notify()
+    
+    def close(self):
+        """Flush what is pending and stop the thread"""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+    
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.dirty and not self.closed:
+                    self.cond.wait()
+                if not self.dirty:
+                    return
+                
+                # Let writes gather for one interval unless enough piled up
+                deadline = time.monotonic() + self.interval
+                while not self.closed and max(self.dirty.values()) < self.threshold:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                dirty, self.dirty = self.dirty, {}
+            
+            for collection, count in dirty.items():
+                try:
+                    self.storage.flush(collection, self.snapshot(collection))
+                    self.stats["flushes"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"[GroupCommit] Failed to write {collection}: {e}")
+                    with self.cond:
+                        if self.closed:
+                            continue  # shutting down; nothing left to retry with
+                        self.dirty[collection] = self.dirty.get(collection, 0) + count
+                    time.sleep(self.interval)  # do not spin on a full disk
@@ -8,17 +8,59 @@ import threading
 import os
 import shutil
 import zipfile
-import time
-from protocol import Protocol, MessageType, recv_message, send_message, send_file
+from protocol import Protocol, MessageType, recv_message, send_message, send_file, choose_codec, set_socket_codec, bind_socket_codec
 from db_server import get_db
+from game_catalog import GameCatalog, DEFAULT_PAGE_SIZE
+from archive_store import ArchiveStore
+from async_transport import AsyncServer, ClientSession, TRANSPORT, BACKLOG
+from dispatcher import INLINE
+from room_events import RoomSubscriptions
+from room_registry import RoomRegistry
+from change_feed import ChangeSubscriber, feed_path
+from game_supervisor import GameSupervisor
+from port_allocator import PortAllocator
+from warm_pool import WarmPool
+from manifest import load_manifest, diff_manifests
+from blob_store import run_dir
+from stats_log import StatsLog
+
+
+START_ATTEMPTS = 3  # ports tried when a new game server exits before binding
 
 
 class LobbyServer:
+    # Worker lane per message type; INLINE requests are answered on the event loop
+    # and must not block (reads revalidate files or read /proc, so they get a lane)
+    ROUTES = {
+        MessageType.HELLO: INLINE,
+        MessageType.PLAYER_LIST_GAMES: "read",
+        MessageType.PLAYER_LIST_GAMES_PAGE: "read",
+        MessageType.PLAYER_GAME_DETAILS: "read",
+        MessageType.PLAYER_LIST_ROOMS: "read",
+        MessageType.PLAYER_LIST_REVIEWS: "read",
+        MessageType.PLAYER_DOWNLOAD_GAME: "transfer",
+        MessageType.PLAYER_DOWNLOAD_DELTA: "transfer",
+        MessageType.PLAYER_START_GAME: "game",
+        MessageType.PLAYER_END_GAME: "game",
+        MessageType.PLAYER_REGISTER: "write",
+        MessageType.PLAYER_LOGIN: "write",
+        MessageType.PLAYER_CREATE_ROOM: "write",
+        MessageType.PLAYER_JOIN_ROOM: "write",
+        MessageType.PLAYER_LEAVE_ROOM: "write",
+        MessageType.PLAYER_UPDATE_GAME_PORT: "write",
+        MessageType.PLAYER_RATE_GAME: "write",
+        MessageType.PLAYER_REVIEW_GAME: "write",
+    }
+    
     def __init__(self, host='0.0.0.0', port=8002, upload_dir='uploaded_games'):
         self.host = host
         self.port = port
         self.upload_dir = upload_dir
         self.db = get_db()
+        self.catalog = GameCatalog(self.db)
+        self.archives = ArchiveStore(upload_dir)
+        self.legacy_archives = {}  # game_id -> archive info built on first download
+        self.archive_lock = threading.Lock()
         self.server_socket = None
         self.running = False
         
@@ -33,79 +75,108 @@ class LobbyServer:
         
         print(f"Public hostname for game servers: {self.public_host}")
         
-        # Track active game servers
-        self.game_servers = {}  # room_id -> process
+        # Game servers; rooms are reset and ports reclaimed as soon as one exits
+        self.supervisor = GameSupervisor(self._on_game_exit)
+        self.ports = PortAllocator()
+        self.warm_pool = WarmPool(self.supervisor, self.ports)
         
-        # Clear all rooms on server startup (all players disconnected)
-        self._clear_all_rooms()
+        # Sessions to push room events to
+        self.subscriptions = RoomSubscriptions()
         
-        # Start game port monitor thread
-        self.monitor_thread = None
-    
-    def _clear_all_rooms(self):
-        """Clear all rooms when server starts (all players have disconnected)"""
-        rooms = self.db.get_all_rooms()
-        for room_id in list(rooms.keys()):
-            self.db.delete_room(room_id)
-        print("All rooms cleared on server startup")
-    
-    def _monitor_game_ports(self):
-        """Monitor game server processes and reset room status if process terminates"""
-        from datetime import datetime, timedelta
+        # Rooms live in memory only; they die with the lobby and its players
+        self.rooms = RoomRegistry(os.path.join(self.db.data_dir, "rooms_snapshot.json"))
         
-        while self.running:
+        # Game changes arrive from the developer server over the change feed;
+        # without it every catalog read re-checks games on disk
+        self.changes = None
+        path = feed_path(self.db.data_dir)
+        if path:
+            self.changes = ChangeSubscriber(path, self._on_change, lambda: self.db.resync("games"))
             try:
-                time.sleep(5)  # Check every 5 seconds
-                rooms = self.db.get_all_rooms()
-                
-                for room_id, room in rooms.items():
-                    # Only check rooms that are playing
-                    if room.get('status') == 'playing':
-                        # Skip checking if game just started (within 10 seconds)
-                        game_start_time = room.get('game_start_time')
-                        if game_start_time:
-                            start_dt = datetime.fromisoformat(game_start_time)
-                            if datetime.now() - start_dt < timedelta(seconds=10):
-                                continue  # Skip checking for newly started games
-                        
-                        # Check if game server process is still running
-                        if room_id in self.game_servers:
-                            process = self.game_servers[room_id]
-                            if process.poll() is not None:
-                                # Process has terminated
-                                print(f"Game server for room {room_id} has terminated, resetting to waiting")
-                                
-                                # Clean up the process reference
-                                del self.game_servers[room_id]
-                                
-                                # Record game history for all players
-                                game_id = room.get('game_id')
-                                if game_id:
-                                    for player in room['players']:
-                                        self.db.add_played_game(player, game_id)
-                                        print(f"Recorded game {game_id} for player {player}")
-                                
-                                room['status'] = 'waiting'
-                                room['game_port'] = None
-                                room['game_host'] = None
-                                room['game_start_time'] = None
-                            self.db.update_room(room_id, room)
-                            
-            except Exception as e:
-                print(f"Error in game port monitor: {e}")
-                time.sleep(5)
+                self.changes.start()
+                self.db.follow("games")
+                self.db.resync("games")  # changes made before we were listening
+            except OSError as e:
+                self.changes = None
+                print(f"Change feed unavailable ({e}); revalidating games on read")
+        
+        self.transport = None
+        
+        # Counters logged every GAME_STORE_STATS_INTERVAL seconds (off by default)
+        self.stats_log = StatsLog("Lobby Server", {
+            "cache": self.db.get_cache_stats,
+            "locks": self.db.get_lock_stats,
+            "flush": self.db.get_flush_stats,
+            "lanes": lambda: self.transport.dispatcher.stats() if self.transport else {},
+            "ports": self.ports.stats,
+            "feed": lambda: dict(self.changes.stats) if self.changes else {},
+        })
+    
+    def _on_change(self, event):
+        """Apply a change the developer server announced"""
+        if event.get('collection') != "games":
+            return
+        value = None if event.get('op') == "delete" else event.get('value')
+        self.db.apply_change("games", event.get('key'), value)
+    
+    def _on_game_exit(self, game):
+        """Reset a room the moment its game server exits on its own"""
+        metrics = game.metrics()
+        print(f"Game server for room {game.room_id} exited with code {game.exit_code} "
+              f"after {metrics['uptime']:.1f}s")
+        self.ports.release(game.room_id, game.meta.get('port'))
+        if game.stopped or self.warm_pool.is_warm(game.room_id):
+            return  # handle_end_game already reset the room, or it never had one
+        
+        with self.rooms.locked(game.room_id):
+            room = self.rooms.get(game.room_id)
+            if not room or room.get('status') != 'playing':
+                return
+            
+            # Record game history for all players
+            game_id = room.get('game_id')
+            if game_id:
+                for player in room['players']:
+                    self.db.add_played_game(player, game_id)
+            
+            result = game.result() or "遊戲已結束"
+            room['status'] = 'waiting'
+            room['game_port'] = None
+            room['game_host'] = None
+            room['game_start_time'] = None
+            room['game_result'] = result
+            self.rooms.update(game.room_id, room)
+            
+            self.subscriptions.publish(game.room_id, MessageType.ROOM_UPDATE, {
+                "room_id": game.room_id,
+                "event": "game_ended",
+                "result": result,
+                "room_data": room
+            })
+    
+    def _release_port(self, room_id):
+        """Return a room's port unless its game server still runs (its exit returns it)"""
+        if not self.supervisor.get(room_id):
+            self.ports.release(room_id)
     
     def start(self):
         """Start the lobby server"""
+        self.running = True
+        
+        if TRANSPORT == 'threads':
+            self._serve_threads()
+            return
+        
+        self.transport = AsyncServer("Lobby Server", self.host, self.port,
+                                     self.dispatch, self.on_disconnect, self.ROUTES)
+        self.transport.run()
+    
+    def _serve_threads(self):
+        """Thread-per-client transport (GAME_STORE_TRANSPORT=threads)"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        self.running = True
-        
-        # Start game port monitor
-        self.monitor_thread = threading.Thread(target=self._monitor_game_ports, daemon=True)
-        self.monitor_thread.start()
+        self.server_socket.listen(BACKLOG)
         
         print(f"Lobby Server started on {self.host}:{self.port}")
         
@@ -125,7 +196,7 @@ class LobbyServer:
     
     def handle_client(self, client_socket, address):
         """Handle player client connection"""
-        username = None
+        session = ClientSession(client_socket, address)
         
         try:
             while True:
@@ -134,135 +205,153 @@ class LobbyServer:
                     break
                 
                 msg_type, data = result
-                
-                if msg_type == MessageType.PLAYER_REGISTER:
-                    response = self.handle_register(data)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_LOGIN:
-                    response, user = self.handle_login(data)
-                    client_socket.sendall(response)
-                    if user:
-                        username = user
-                        self.db.set_player_session(username, client_socket)
-                
-                elif msg_type == MessageType.PLAYER_LOGOUT:
-                    if username:
-                        self.db.set_player_session(username, None)
-                        username = None
-                    client_socket.sendall(Protocol.success_response({"message": "登出成功"}))
-                
-                elif msg_type == MessageType.PLAYER_LIST_GAMES:
-                    response = self.handle_list_games()
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_GAME_DETAILS:
-                    response = self.handle_game_details(data)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_DOWNLOAD_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_download_game(data, username, client_socket)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_CREATE_ROOM:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_create_room(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_LIST_ROOMS:
-                    response = self.handle_list_rooms()
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_JOIN_ROOM:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_join_room(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_LEAVE_ROOM:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_leave_room(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_START_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_start_game(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_UPDATE_GAME_PORT:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_update_game_port(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_END_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_end_game(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_RATE_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_rate_game(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_REVIEW_GAME:
-                    if not username:
-                        client_socket.sendall(Protocol.error_response("請先登入"))
-                        continue
-                    response = self.handle_review_game(data, username)
-                    client_socket.sendall(response)
-                
-                elif msg_type == MessageType.PLAYER_LIST_REVIEWS:
-                    response = self.handle_list_reviews(data)
-                    client_socket.sendall(response)
-                
-                else:
-                    client_socket.sendall(Protocol.error_response("未知的請求類型"))
+                session.hold()
+                session.finish(self.dispatch(session, msg_type, data))
         
         except Exception as e:
             print(f"Error handling client {address}: {e}")
         
         finally:
+            self.on_disconnect(session)
+            client_socket.close()
+            print(f"Player client {address} disconnected")
+    
+    def dispatch(self, session, msg_type, data):
+        """Handle one request and return the response to send"""
+        username = session.username
+        client_socket = session.sock
+        bind_socket_codec(client_socket)
+        
+        if msg_type == MessageType.HELLO:
+            # Reply in the old codec, then switch this connection over
+            codec = choose_codec(data.get('codecs'))
+            response = Protocol.success_response({"codec": codec})
+            set_socket_codec(client_socket, codec)
+            return response
+        
+        elif msg_type == MessageType.PLAYER_REGISTER:
+            return self.handle_register(data)
+        
+        elif msg_type == MessageType.PLAYER_LOGIN:
+            response, user = self.handle_login(data)
+            if user:
+                session.username = user
+                self.db.set_player_session(user, client_socket)
+            return response
+        
+        elif msg_type == MessageType.PLAYER_LOGOUT:
             if username:
-                # Clear session
                 self.db.set_player_session(username, None)
-                
-                # Remove player from any room they were in
-                rooms = self.db.get_all_rooms()
-                for room_id, room in rooms.items():
-                    if username in room['players']:
-                        print(f"Removing {username} from room {room_id} due to disconnection")
-                        room['players'].remove(username)
-                        
-                        # If room is empty, delete it
-                        if not room['players']:
-                            self.db.delete_room(room_id)
-                            print(f"Room {room_id} deleted (empty)")
-                        else:
-                            # If host disconnected, assign new host
-                            if room['host'] == username:
-                                room['host'] = room['players'][0]
-                                print(f"New host for room {room_id}: {room['host']}")
-                            self.db.update_room(room_id, room)
-                        break
+                session.username = None
+            return Protocol.success_response({"message": "登出成功"})
+        
+        elif msg_type == MessageType.PLAYER_LIST_GAMES:
+            return self.handle_list_games()
+        
+        elif msg_type == MessageType.PLAYER_LIST_GAMES_PAGE:
+            return self.handle_list_games_page(data)
+        
+        elif msg_type == MessageType.PLAYER_GAME_DETAILS:
+            return self.handle_game_details(data)
+        
+        elif msg_type == MessageType.PLAYER_DOWNLOAD_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_download_game(data, username, client_socket)
+        
+        elif msg_type == MessageType.PLAYER_DOWNLOAD_DELTA:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_download_delta(data, username, client_socket)
+        
+        elif msg_type == MessageType.PLAYER_CREATE_ROOM:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_create_room(data, username)
+        
+        elif msg_type == MessageType.PLAYER_LIST_ROOMS:
+            return self.handle_list_rooms()
+        
+        elif msg_type == MessageType.PLAYER_JOIN_ROOM:
+            if not username:
+                return Protocol.error_response("請先登入")
+            with self.rooms.locked(data.get('room_id')):
+                return self.handle_join_room(data, username, session)
+        
+        elif msg_type == MessageType.PLAYER_LEAVE_ROOM:
+            if not username:
+                return Protocol.error_response("請先登入")
+            with self.rooms.locked(data.get('room_id')):
+                return self.handle_leave_room(data, username)
+        
+        elif msg_type == MessageType.PLAYER_START_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            with self.rooms.locked(data.get('room_id')):
+                return self.handle_start_game(data, username)
+        
+        elif msg_type == MessageType.PLAYER_UPDATE_GAME_PORT:
+            if not username:
+                return Protocol.error_response("請先登入")
+            with self.rooms.locked(data.get('room_id')):
+                return self.handle_update_game_port(data, username)
+        
+        elif msg_type == MessageType.PLAYER_END_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            with self.rooms.locked(data.get('room_id')):
+                return self.handle_end_game(data, username)
+        
+        elif msg_type == MessageType.PLAYER_RATE_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_rate_game(data, username)
+        
+        elif msg_type == MessageType.PLAYER_REVIEW_GAME:
+            if not username:
+                return Protocol.error_response("請先登入")
+            return self.handle_review_game(data, username)
+        
+        elif msg_type == MessageType.PLAYER_LIST_REVIEWS:
+            return self.handle_list_reviews(data)
+        
+        else:
+            return Protocol.error_response("未知的請求類型")
+    
+    def on_disconnect(self, session):
+        """Clear the session and room membership of a disconnected player"""
+        username = session.username
+        if username:
+            # Clear session
+            self.db.set_player_session(username, None)
             
-            client_socket.close()
-            print(f"Player client {address} disconnected")
+            # Remove player from any room they were in
+            for room_id in self.rooms.of_player(username):
+                with self.rooms.locked(room_id):
+                    room = self.rooms.get(room_id)
+                    if not room or username not in room['players']:
+                        continue
+                    print(f"Removing {username} from room {room_id} due to disconnection")
+                    room['players'].remove(username)
+                    self.subscriptions.unsubscribe(room_id, username)
+                    
+                    # If room is empty, delete it
+                    if not room['players']:
+                        self.rooms.delete(room_id)
+                        self.subscriptions.drop_room(room_id)
+                        self._release_port(room_id)
+                        print(f"Room {room_id} deleted (empty)")
+                    else:
+                        # If host disconnected, assign new host
+                        if room['host'] == username:
+                            room['host'] = room['players'][0]
+                            print(f"New host for room {room_id}: {room['host']}")
+                        self.rooms.update(room_id, room)
+                        self.subscriptions.publish(room_id, MessageType.PLAYER_LEFT, {
+                            "room_id": room_id,
+                            "username": username,
+                            "room_data": room
+                        })
     
     def handle_register(self, data):
         """Handle player registration"""
@@ -296,23 +385,44 @@ class LobbyServer:
     
     def handle_list_games(self):
         """List all active games"""
-        all_games = self.db.get_all_games()
-        
-        game_list = []
-        for game_id, game in all_games.items():
-            if game.get('active', True):
-                avg_rating = self.db.get_average_rating(game_id)
-                game_list.append({
-                    "game_id": game_id,
-                    "name": game['name'],
-                    "author": game['author'],
-                    "type": game['type'],
-                    "max_players": game['max_players'],
-                    "version": game['version'],
-                    "rating": round(avg_rating, 1)
-                })
+        return Protocol.success_response({"games": self.catalog.all_entries()})
+    
+    def handle_list_games_page(self, data):
+        """List one page of active games with filters and sorting"""
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return Protocol.error_response("篩選條件格式錯誤")
+        filters = dict(filters)
+        if not isinstance(filters.get('type') or '', str) or not isinstance(filters.get('author') or '', str):
+            return Protocol.error_response("篩選條件格式錯誤")
+        if filters.get('game_ids') is not None and not isinstance(filters['game_ids'], list):
+            return Protocol.error_response("篩選條件格式錯誤")
+        try:
+            if filters.get('min_rating') is not None:
+                filters['min_rating'] = float(filters['min_rating'])
+            if filters.get('max_players') is not None:
+                filters['max_players'] = int(filters['max_players'])
+            page_size = int(data.get('page_size', DEFAULT_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return Protocol.error_response("篩選條件格式錯誤")
         
-        return Protocol.success_response({"games": game_list})
+        try:
+            games, next_cursor, total = self.catalog.page(
+                sort=data.get('sort'),
+                order=data.get('order'),
+                cursor=data.get('cursor'),
+                page_size=page_size,
+                filters=filters
+            )
+        except ValueError:
+            return Protocol.error_response("排序方式或分頁游標無效")
+        
+        return Protocol.success_response({
+            "games": games,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "total": total  # None when filtered
+        })
     
     def handle_game_details(self, data):
         """Get detailed game information"""
@@ -325,8 +435,8 @@ class LobbyServer:
         if not game or not game.get('active', True):
             return Protocol.error_response("遊戲不存在")
         
-        avg_rating = self.db.get_average_rating(game_id)
-        reviews = self.db.get_reviews(game_id)
+        # Aggregates are maintained on add_review, no need to copy reviews
+        rating = self.db.get_rating_summary(game_id)
         
         game_info = {
             "game_id": game_id,
@@ -338,8 +448,9 @@ class LobbyServer:
             "version": game['version'],
             "created_at": game['created_at'],
             "updated_at": game['updated_at'],
-            "rating": round(avg_rating, 1),
-            "review_count": len(reviews)
+            "rating": round(rating['average'], 1),
+            "review_count": rating['count'],
+            "rating_histogram": rating['histogram']
         }
         
         return Protocol.success_response({"game": game_info})
@@ -362,33 +473,97 @@ class LobbyServer:
             if not os.path.exists(game_dir):
                 return Protocol.error_response("遊戲檔案不存在")
             
-            # Create zip file for download
-            temp_zip = f"/tmp/{game_id}_{version}.zip"
-            with zipfile.ZipFile(temp_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(game_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, game_dir)
-                        zipf.write(file_path, arcname)
+            # Serve the archive built at upload time
+            archive_path = self.archives.lookup(game)
+            if archive_path:
+                archive = game['archive']
+            else:
+                archive = self._legacy_archive(game_id, version, game_dir)
+                archive_path = self.archives.path_for(archive['sha256'])
+            
+            # Resume only if the client's partial file is of this exact archive
+            offset = data.get('offset', 0)
+            if (data.get('sha256') != archive['sha256'] or not isinstance(offset, int)
+                    or not (0 <= offset <= archive['size'])):
+                offset = 0
             
             # Send game info first
             send_message(client_socket, MessageType.SUCCESS, {
                 "game_id": game_id,
                 "version": version,
-                "start_command": game['start_command']
+                "start_command": game['start_command'],
+                "sha256": archive['sha256'],
+                "size": archive['size'],
+                "offset": offset
             })
             
-            # Send zip file
-            send_file(client_socket, temp_zip)
-            
-            # Clean up
-            os.remove(temp_zip)
+            # Send zip file from the agreed offset
+            send_file(client_socket, archive_path, offset)
             
             return Protocol.success_response({"message": "遊戲下載完成"})
         
         except Exception as e:
             return Protocol.error_response(f"下載失敗: {str(e)}")
     
+    def handle_download_delta(self, data, username, client_socket):
+        """Send only the files that changed between the player's version and the current one"""
+        try:
+            game_id = data.get('game_id')
+            from_version = data.get('from_version')
+            
+            if not game_id or not from_version:
+                return Protocol.error_response("缺少遊戲ID或版本號")
+            
+            # The version is used as a directory name
+            if '/' in from_version or '\\' in from_version or from_version.startswith('.'):
+                return Protocol.error_response("版本號格式不合法")
+            
+            game = self.db.get_game(game_id)
+            if not game or not game.get('active', True):
+                return Protocol.error_response("遊戲不存在或已下架")
+            
+            version = game['version']
+            old_manifest = load_manifest(self.upload_dir, game_id, from_version)
+            new_manifest = load_manifest(self.upload_dir, game_id, version)
+            
+            # Without the old version on disk the client must do a full download
+            if old_manifest is None or new_manifest is None:
+                return Protocol.error_response("無法計算版本差異，請完整下載")
+            
+            changed, removed = diff_manifests(old_manifest, new_manifest)
+            
+            # Send the delta manifest, then each changed file in the same order
+            send_message(client_socket, MessageType.SUCCESS, {
+                "game_id": game_id,
+                "version": version,
+                "start_command": game['start_command'],
+                "changed": changed,
+                "removed": removed
+            })
+            
+            game_dir = os.path.join(self.upload_dir, game_id, version)
+            for entry in changed:
+                send_file(client_socket, os.path.join(game_dir, *entry['path'].split('/')))
+            
+            return Protocol.success_response({"message": "遊戲更新完成"})
+        
+        except Exception as e:
+            return Protocol.error_response(f"更新失敗: {str(e)}")
+    
+    def _legacy_archive(self, game_id, version, game_dir):
+        """Build the archive for games uploaded before archives existed"""
+        with self.archive_lock:
+            archive = self.legacy_archives.get(game_id)
+            if archive and archive['version'] == version:
+                archive_path = self.archives.path_for(archive['sha256'])
+                if os.path.exists(archive_path):
+                    return archive
+            
+            archive = self.archives.build(game_dir, version)
+            self.legacy_archives[game_id] = archive
+            print(f"[Lobby] Built missing archive for {game_id} v{version}")
+            return archive
+    
     def handle_create_room(self, data, username):
         """Handle room creation"""
         try:
@@ -422,7 +597,7 @@ class LobbyServer:
                 "created_at": __import__('datetime').datetime.now().isoformat()
             }
             
-            self.db.create_room(room_id, room_data)
+            self.rooms.create(room_id, room_data)
             
             return Protocol.success_response({
                 "message": "房間建立成功",
@@ -435,7 +610,8 @@ class LobbyServer:
     
     def handle_list_rooms(self):
         """List all active rooms"""
-        rooms = self.db.get_all_rooms()
+        rooms = self.rooms.all()
+        processes = self.supervisor.metrics()  # pid, uptime, exit_code, rss
         
         room_list = []
         for room_id, room in rooms.items():
@@ -450,12 +626,13 @@ class LobbyServer:
                     "host": room['host'],
                     "players": room['players'],  # Return player list instead of count
                     "max_players": room['max_players'],
-                    "status": room['status']
+                    "status": room['status'],
+                    "game_process": processes.get(room_id)
                 })
         
         return Protocol.success_response({"rooms": room_list})
     
-    def handle_join_room(self, data, username):
+    def handle_join_room(self, data, username, session):
         """Handle joining a room"""
         room_id = data.get('room_id')
         player_game_version = data.get('game_version')  # Get player's local game version
@@ -464,12 +641,11 @@ class LobbyServer:
             return Protocol.error_response("缺少房間ID")
         
         # Check if player is already in another room
-        all_rooms = self.db.get_all_rooms()
-        for rid, r in all_rooms.items():
-            if username in r['players'] and rid != room_id:
+        for rid, r in self.rooms.of_player(username).items():
+            if rid != room_id:
                 return Protocol.error_response(f"你已經在房間中: {r['room_name']}，請先離開再加入其他房間")
         
-        room = self.db.get_room(room_id)
+        room = self.rooms.get(room_id)
         if not room:
             return Protocol.error_response("房間不存在")
         
@@ -489,7 +665,14 @@ class LobbyServer:
             return Protocol.error_response("你已在房間中")
         
         room['players'].append(username)
-        self.db.update_room(room_id, room)
+        self.rooms.update(room_id, room)
+        
+        self.subscriptions.subscribe(room_id, session)
+        self.subscriptions.publish(room_id, MessageType.PLAYER_JOINED, {
+            "room_id": room_id,
+            "username": username,
+            "room_data": room
+        }, exclude=username)
         
         return Protocol.success_response({
             "message": "加入房間成功",
@@ -503,7 +686,7 @@ class LobbyServer:
         if not room_id:
             return Protocol.error_response("缺少房間ID")
         
-        room = self.db.get_room(room_id)
+        room = self.rooms.get(room_id)
         if not room:
             return Protocol.error_response("房間不存在")
         
@@ -511,15 +694,23 @@ class LobbyServer:
             return Protocol.error_response("你不在此房間中")
         
         room['players'].remove(username)
+        self.subscriptions.unsubscribe(room_id, username)
         
         # If room is empty, delete it
         if not room['players']:
-            self.db.delete_room(room_id)
+            self.rooms.delete(room_id)
+            self.subscriptions.drop_room(room_id)
+            self._release_port(room_id)
         else:
             # If host leaves, assign new host
             if room['host'] == username:
                 room['host'] = room['players'][0]
-            self.db.update_room(room_id, room)
+            self.rooms.update(room_id, room)
+            self.subscriptions.publish(room_id, MessageType.PLAYER_LEFT, {
+                "room_id": room_id,
+                "username": username,
+                "room_data": room
+            })
         
         return Protocol.success_response({"message": "離開房間成功"})
     
@@ -530,7 +721,7 @@ class LobbyServer:
         if not room_id:
             return Protocol.error_response("缺少房間ID")
         
-        room = self.db.get_room(room_id)
+        room = self.rooms.get(room_id)
         if not room:
             return Protocol.error_response("房間不存在")
         
@@ -554,7 +745,6 @@ class LobbyServer:
             return Protocol.error_response("遊戲不存在")
         
         # Start game server on server side
-        import subprocess
         import json
         
         # Find game directory
@@ -577,41 +767,55 @@ class LobbyServer:
         if 'MULTIPLAYER' in config.get('type', '') and not config.get('server_command'):
             return Protocol.error_response("多人遊戲缺少 server_command 配置")
         
-        # Find available port
-        def find_available_port(start_port=15000):
-            for port in range(start_port, start_port + 1000):
-                try:
-                    test_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    test_sock.bind(('0.0.0.0', port))
-                    test_sock.close()
-                    return port
-                except:
-                    continue
-            return None
-        
-        game_port = find_available_port()
-        if not game_port:
-            return Protocol.error_response("無法分配遊戲端口")
-        
         # Start game server
         server_command = config.get('server_command', '')
+        game_process = None
         if server_command:
             cmd_parts = server_command.split()
             if cmd_parts[0] == 'python':
                 cmd_parts[0] = 'python3'
-            cmd_parts.extend(['--port', str(game_port)])
             
+            # Servers run from a writable copy; the version files are shared blobs
             try:
-                process = subprocess.Popen(
-                    cmd_parts,
-                    cwd=game_dir,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                self.game_servers[room_id] = process
-                print(f"✓ Started game server for room {room_id} on port {game_port} (PID: {process.pid})")
-            except Exception as e:
-                return Protocol.error_response(f"啟動遊戲服務器失敗: {e}")
+                game_dir = run_dir(self.upload_dir, game_id, game['version'])
+            except OSError as e:
+                return Protocol.error_response(f"準備遊戲執行目錄失敗: {e}")
+            
+            # A warm server is already listening; take one if the pool has it
+            game_process = self.warm_pool.take(game_id, game['version'], room_id)
+            self.warm_pool.refill_later(game_id, game['version'], cmd_parts, game_dir)
+        
+        if game_process:
+            game_port = game_process.meta['port']
+            print(f"✓ Assigned warm game server to room {room_id} on port {game_port} (PID: {game_process.process.pid})")
+        else:
+            # Lease a port; the supervisor returns it when the server exits
+            game_port = self.ports.lease(room_id)
+            if not game_port:
+                return Protocol.error_response("無法分配遊戲端口")
+            
+            for attempt in range(START_ATTEMPTS if server_command else 0):
+                try:
+                    game_process = self.supervisor.launch(room_id, cmd_parts + ['--port', str(game_port)], game_dir,
+                                                          game_id=game_id, port=game_port)
+                except Exception as e:
+                    self.ports.release(room_id)
+                    return Protocol.error_response(f"啟動遊戲服務器失敗: {e}")
+                
+                if self.ports.wait_bound(game_process.process, game_port):
+                    print(f"✓ Started game server for room {room_id} on port {game_port} (PID: {game_process.process.pid})")
+                    break
+                
+                # It exited before binding (port taken meanwhile?); retry on another port
+                game_process.stopped = True  # its exit must not reset the room
+                self.ports.release(room_id, game_port)
+                game_port = self.ports.lease(room_id)
+                if not game_port:
+                    return Protocol.error_response("無法分配遊戲端口")
+            else:
+                if server_command:
+                    self.ports.release(room_id, game_port)
+                    return Protocol.error_response("啟動遊戲服務器失敗: 遊戲服務器無法啟動")
         
         # Update room status to playing and record start time and game port
         from datetime import datetime
@@ -619,7 +823,13 @@ class LobbyServer:
         room['game_start_time'] = datetime.now().isoformat()
         room['game_port'] = game_port
         room['game_host'] = self.public_host  # Use public hostname
-        self.db.update_room(room_id, room)
+        self.rooms.update(room_id, room)
+        
+        # The other players launch their clients when this arrives
+        self.subscriptions.publish(room_id, MessageType.GAME_STARTED, {
+            "room_id": room_id,
+            "room_data": room
+        }, exclude=username)
         
         return Protocol.success_response({
             "message": f"遊戲已開始，遊戲服務器運行在 {self.public_host}:{game_port}",
@@ -634,7 +844,7 @@ class LobbyServer:
         if not room_id or not game_port:
             return Protocol.error_response("缺少房間ID或遊戲端口")
         
-        room = self.db.get_room(room_id)
+        room = self.rooms.get(room_id)
         if not room:
             return Protocol.error_response("房間不存在")
         
@@ -644,7 +854,13 @@ class LobbyServer:
         
         # Update room with game port
         room['game_port'] = game_port
-        self.db.update_room(room_id, room)
+        self.rooms.update(room_id, room)
+        
+        self.subscriptions.publish(room_id, MessageType.ROOM_UPDATE, {
+            "room_id": room_id,
+            "event": "game_port",
+            "room_data": room
+        }, exclude=username)
         
         return Protocol.success_response({
             "message": f"遊戲端口已更新: {game_port}",
@@ -659,7 +875,7 @@ class LobbyServer:
         if not room_id:
             return Protocol.error_response("缺少房間ID")
         
-        room = self.db.get_room(room_id)
+        room = self.rooms.get(room_id)
         if not room:
             return Protocol.error_response("房間不存在")
         
@@ -675,19 +891,12 @@ class LobbyServer:
                 print(f"Recorded game {game_id} for player {player}")
         
         # Terminate game server process if it's running
-        if room_id in self.game_servers:
-            try:
-                process = self.game_servers[room_id]
-                if process.poll() is None:  # Process is still running
-                    process.terminate()
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-                    print(f"✓ Terminated game server for room {room_id}")
-                del self.game_servers[room_id]
-            except Exception as e:
-                print(f"⚠️  Error terminating game server: {e}")
+        try:
+            if self.supervisor.stop(room_id):
+                print(f"✓ Terminated game server for room {room_id}")
+        except Exception as e:
+            print(f"⚠️  Error terminating game server: {e}")
+        self._release_port(room_id)
         
         # Reset room status to waiting
         room['status'] = 'waiting'
@@ -695,7 +904,14 @@ class LobbyServer:
         room['game_host'] = None  # Clear game host
         room['game_start_time'] = None  # Clear game start time
         room['game_result'] = game_result  # Store game result
-        self.db.update_room(room_id, room)
+        self.rooms.update(room_id, room)
+        
+        self.subscriptions.publish(room_id, MessageType.ROOM_UPDATE, {
+            "room_id": room_id,
+            "event": "game_ended",
+            "result": game_result,
+            "room_data": room
+        }, exclude=username)
         
         return Protocol.success_response({
             "message": "遊戲已結束，房間重置為等待狀態",
@@ -756,6 +972,8 @@ class LobbyServer:
     def stop(self):
         """Stop the server"""
         self.running = False
+        if self.transport:
+            self.transport.stop()
         if self.server_socket:
             self.server_socket.close()
 
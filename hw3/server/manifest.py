@@ -0,0 +1,84 @@
+"""
+Version Manifests for Game Store System
+Record the SHA-256 and size of every file in an uploaded game version so
+players can update by fetching only the files that changed
+"""
+
+import json
+import os
+import tempfile
+
+from archive_store import file_sha256
+
+
+MANIFEST_DIR = ".manifests"
+
+
+def build_manifest(version_dir):
+    """Map every file under version_dir (relative, '/'-separated) to its hash and size"""
+    files = {}
+    for root, dirs, filenames in os.walk(version_dir):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            relpath = os.path.relpath(file_path, version_dir).replace(os.sep, '/')
+            files[relpath] = {
+                "sha256": file_sha256(file_path),
+                "size": os.path.getsize(file_path)
+            }
+    return {"files": files}
+
+
+def manifest_path(upload_dir, game_id, version):
+    """Path of a version's manifest, kept beside (not inside) the version directory"""
+    return os.path.join(upload_dir, game_id, MANIFEST_DIR, f"{version}.json")
+
+
+def save_manifest(upload_dir, game_id, version, manifest):
+    """Write a version manifest atomically"""
+    path = manifest_path(upload_dir, game_id, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique temp name: lobby threads may build a legacy manifest concurrently
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(upload_dir, game_id, version):
+    """Load a version manifest, building it for versions uploaded before manifests existed
+    
+    Returns None if the version is not on disk.
+    """
+    path = manifest_path(upload_dir, game_id, version)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    
+    version_dir = os.path.join(upload_dir, game_id, version)
+    if not os.path.isdir(version_dir):
+        return None
+    
+    manifest = build_manifest(version_dir)
+    save_manifest(upload_dir, game_id, version, manifest)
+    return manifest
+
+
+def diff_manifests(old, new):
+    """Files to fetch and files to delete when going from old to new
+    
+    Returns (changed, removed): changed is a list of {"path", "sha256", "size"}
+    sorted by path, removed a sorted list of paths.
+    """
+    old_files = old['files']
+    new_files = new['files']
+    
+    changed = [
+        {"path": path, "sha256": entry['sha256'], "size": entry['size']}
+        for path, entry in sorted(new_files.items())
+        if old_files.get(path, {}).get('sha256') != entry['sha256']
+    ]
+    removed = sorted(path for path in old_files if path not in new_files)
+    return changed, removed
@@ -0,0 +1,90 @@
+"""
+Migration Tool: JSON/journal data files -> SQLite
+Usage: python3 migrate_to_sqlite.py [data_dir] [db_path]
+"""
+
+import json
+import os
+import sys
+from storage import create_storage
+from db_server import DatabaseServer
+from sqlite_db import SQLiteDatabaseServer
+
+
+def migrate(data_dir="data", db_path=None):
+    """Copy every collection from the file store into a SQLite database"""
+    # Journal engine reads plain JSON snapshots too and replays any journal
+    storage = create_storage(data_dir, backend='journal')
+    db = SQLiteDatabaseServer(data_dir, db_path)
+    conn = db._conn()
+    
+    dev_users = storage.load("dev_users", {})
+    player_users = storage.load("player_users", {})
+    games = storage.load("games", {})
+    reviews = storage.load("reviews", {})
+    
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for username, user in dev_users.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO dev_users(username, password, created_at) VALUES(?, ?, ?)",
+                (username, user['password'], user.get('created_at'))
+            )
+        
+        for username, user in player_users.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO player_users(username, password, created_at) VALUES(?, ?, ?)",
+                (username, user['password'], user.get('created_at'))
+            )
+            for game_id in user.get('played_games', []):
+                conn.execute(
+                    "INSERT OR IGNORE INTO played_games(username, game_id) VALUES(?, ?)",
+                    (username, game_id)
+                )
+        
+        for game_id, game in games.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO games(game_id, author, data) VALUES(?, ?, ?)",
+                (game_id, game.get('author'), json.dumps(game, ensure_ascii=False))
+            )
+        
+        # Reviews have no natural key, so start from a clean table
+        conn.execute("DELETE FROM reviews")
+        conn.execute("DELETE FROM game_ratings")
+        for game_id, game_reviews in reviews.items():
+            histogram = {str(i): 0 for i in range(1, 6)}
+            for review in game_reviews:
+                conn.execute(
+                    "INSERT INTO reviews(game_id, username, rating, comment, created_at) "
+                    "VALUES(?, ?, ?, ?, ?)",
+                    (game_id, review.get('username'), review.get('rating'),
+                     review.get('comment', ''), review.get('created_at'))
+                )
+                histogram[DatabaseServer._rating_bucket(review['rating'])] += 1
+            conn.execute(
+                "INSERT INTO game_ratings(game_id, rating_sum, rating_count, histogram) "
+                "VALUES(?, ?, ?, ?)",
+                (game_id, sum(r['rating'] for r in game_reviews), len(game_reviews),
+                 json.dumps(histogram))
+            )
+        
+        # Rooms are cleared on every lobby start, so they are not migrated
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    
+    print(f"Migrated {len(dev_users)} developers, {len(player_users)} players, "
+          f"{len(games)} games, {sum(len(r) for r in reviews.values())} reviews "
+          f"into {db.db_path}")
+
+
+if __name__ == "__main__":
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else None
+    
+    if not os.path.isdir(data_dir):
+        print(f"Data directory not found: {data_dir}")
+        sys.exit(1)
+    
+    migrate(data_dir, db_path)
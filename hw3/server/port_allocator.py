@@ -0,0 +1,132 @@
+"""
+Game Port Allocator for Game Store System
+Leases game server ports to rooms from a free list, so concurrent starts
+never pick the same port and a start costs one bind probe, not a scan
+"""
+
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+
+# Ports handed to game servers (override with GAME_STORE_GAME_PORTS=first-last)
+GAME_PORTS = os.environ.get('GAME_STORE_GAME_PORTS', '15000-15999')
+BIND_TIMEOUT = 3.0  # seconds a new game server gets to bind its port
+
+
+def _port_range(spec):
+    first, last = (int(part) for part in spec.split('-'))
+    return range(first, last + 1)
+
+
+class PortAllocator:
+    """Free list of game ports; room_id -> leased port"""
+    
+    def __init__(self, ports=None):
+        self.lock = threading.Lock()
+        self.free = deque(ports or _port_range(GAME_PORTS))
+        self.leases = {}
+    
+    @staticmethod
+    def _bindable(port):
+        """Whether nothing outside the lobby holds the port"""
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            probe.bind(('0.0.0.0', port))
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+    
+    def lease(self, room_id):
+        """Lease a port to a room (the room's existing lease if any). None if all are taken"""
+        with self.lock:
+            if room_id in self.leases:
+                return self.leases[room_id]
+            
+            # Ports held by other programs go to the back of the list
+            for _ in range(len(self.free)):
+                port = self.free.popleft()
+                if self._bindable(port):
+                    self.leases[room_id] = port
+                    return port
+                self.free.append(port)
+            return None
+    
+    def release(self, room_id, port=None):
+        """Return a room's port; released ports are reused last
+        
+        With port given, only that lease is released, so a late release for
+        a finished game cannot free the port of the room's next game.
+        """
+        with self.lock:
+            leased = self.leases.get(room_id)
+            if leased is None or (port is not None and port != leased):
+                return None
+            del self.leases[room_id]
+            self.free.append(leased)
+            return leased
+    
+    def transfer(self, room_id, new_room_id):
+        """Move a lease to another room (a warm server handed to a room)"""
+        with self.lock:
+            port = self.leases.pop(room_id)
+            self.leases[new_room_id] = port
+            return port
+    
+    @classmethod
+    def _listening(cls, pid, port):
+        """Whether process pid listens on port
+        
+        Read from /proc on Linux; elsewhere any holder of the port counts.
+        """
+        inodes = set()
+        for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+            try:
+                with open(table, 'r') as f:
+                    rows = f.read().splitlines()[1:]
+            except OSError:
+                continue
+            for row in rows:
+                fields = row.split()
+                # local_address is HEX_IP:HEX_PORT, state 0A is LISTEN
+                if fields[3] == '0A' and int(fields[1].rsplit(':', 1)[1], 16) == port:
+                    inodes.add(f"socket:[{fields[9]}]")
+        
+        fd_dir = f"/proc/{pid}/fd"
+        if not os.path.isdir(fd_dir):
+            return not cls._bindable(port)
+        try:
+            for fd in os.listdir(fd_dir):
+                try:
+                    if os.readlink(os.path.join(fd_dir, fd)) in inodes:
+                        return True
+                except OSError:
+                    continue
+        except OSError:
+            pass
+        return False
+    
+    def wait_bound(self, process, port, timeout=BIND_TIMEOUT):
+        """Wait until a just-started game server holds its port
+        
+        Uploaded servers bind --port themselves, so another program can take
+        the port between our probe and their bind; they then exit. Returns
+        False if the process exited first. A server still starting after
+        timeout is assumed to be fine.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                return False
+            if self._listening(process.pid, port):
+                return True
+            time.sleep(0.05)
+        return process.poll() is None
+    
+    def stats(self):
+        with self.lock:
+            return {"leased": len(self.leases), "free": len(self.free)}
@@ -0,0 +1,59 @@
+"""
+Room Subscriptions for Game Store System
+Pushes room changes to the sessions of the players in that room, so clients
+learn about joins, leaves and game start/end without polling the room list
+"""
+
+import threading
+
+from protocol import Protocol, socket_codec
+
+
+class RoomSubscriptions:
+    """room_id -> sessions subscribed to that room's events"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}  # room_id -> {username: session}
+    
+    def subscribe(self, room_id, session):
+        with self.lock:
+            self.rooms.setdefault(room_id, {})[session.username] = session
+    
+    def unsubscribe(self, room_id, username):
+        with self.lock:
+            members = self.rooms.get(room_id)
+            if members is None:
+                return
+            members.pop(username, None)
+            if not members:
+                del self.rooms[room_id]
+    
+    def drop_room(self, room_id):
+        with self.lock:
+            self.rooms.pop(room_id, None)
+    
+    def publish(self, room_id, msg_type, data, exclude=None):
+        """Push one event to every subscriber except `exclude` (a username)
+        
+        The message is encoded once per codec in use, not once per player.
+        Returns the number of sessions it was pushed to.
+        """
+        with self.lock:
+            sessions = [
+                session for username, session in self.rooms.get(room_id, {}).items()
+                if username != exclude
+            ]
+        
+        encoded = {}
+        pushed = 0
+        for session in sessions:
+            codec = socket_codec(session.sock)
+            if codec not in encoded:
+                encoded[codec] = Protocol.encode_message(msg_type, data, codec)
+            try:
+                session.push(encoded[codec])
+                pushed += 1
+            except Exception as e:
+                print(f"[Rooms] Failed to push {msg_type.value} to {session.address}: {e}")
+        return pushed
@@ -0,0 +1,132 @@
+"""
+Room Registry for Game Store System
+Rooms only live as long as the lobby process, so they are kept in memory:
+lookups by id, by game and by player are dictionary hits, each room has its
+own lock, and nothing touches the disk unless debug snapshots are enabled
+"""
+
+import copy
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from storage import _write_json_atomic
+
+
+# Seconds between debug snapshots of all rooms (0 = never)
+ROOM_SNAPSHOT_INTERVAL = float(os.environ.get('GAME_STORE_ROOM_SNAPSHOT', '0'))
+
+
+class RoomRegistry:
+    """room_id -> room dict, indexed by game and by player
+    
+    get()/all() return copies; change a room by passing the modified copy to
+    update(). Hold locked(room_id) around a read-modify-write so concurrent
+    requests for the same room do not overwrite each other.
+    """
+    
+    def __init__(self, snapshot_path=None, snapshot_interval=ROOM_SNAPSHOT_INTERVAL):
+        self.lock = threading.Lock()  # guards the maps below, held briefly
+        self.rooms = {}  # room_id -> room
+        self.room_locks = {}  # room_id -> RLock
+        self.by_game = {}  # game_id -> {room_id}
+        self.by_player = {}  # username -> {room_id}
+        self.generation = 0  # bumped on every change
+        
+        if snapshot_path and snapshot_interval > 0:
+            threading.Thread(target=self._snapshot_loop, args=(snapshot_path, snapshot_interval),
+                             name="room-snapshots", daemon=True).start()
+    
+    def _index(self, room_id, room):
+        self.by_game.setdefault(room.get('game_id'), set()).add(room_id)
+        for username in room.get('players', []):
+            self.by_player.setdefault(username, set()).add(room_id)
+    
+    def _unindex(self, room_id, room):
+        self._discard(self.by_game, room.get('game_id'), room_id)
+        for username in room.get('players', []):
+            self._discard(self.by_player, username, room_id)
+    
+    @staticmethod
+    def _discard(index, key, room_id):
+        room_ids = index.get(key)
+        if room_ids is not None:
+            room_ids.discard(room_id)
+            if not room_ids:
+                del index[key]
+    
+    @contextmanager
+    def locked(self, room_id):
+        """Hold a room's lock (no-op for unknown rooms)"""
+        with self.lock:
+            room_lock = self.room_locks.get(room_id)
+        with room_lock or nullcontext():
+            yield
+    
+    def create(self, room_id, room):
+        room = copy.deepcopy(room)
+        with self.lock:
+            self.rooms[room_id] = room
+            self.room_locks[room_id] = threading.RLock()
+            self._index(room_id, room)
+            self.generation += 1
+    
+    def get(self, room_id):
+        with self.lock:
+            room = self.rooms.get(room_id)
+            return copy.deepcopy(room) if room is not None else None
+    
+    def all(self):
+        with self.lock:
+            return copy.deepcopy(self.rooms)
+    
+    def of_player(self, username):
+        """Rooms a player is in"""
+        with self.lock:
+            return {room_id: copy.deepcopy(self.rooms[room_id])
+                    for room_id in self.by_player.get(username, ())}
+    
+    def of_game(self, game_id):
+        """Rooms playing a game"""
+        with self.lock:
+            return {room_id: copy.deepcopy(self.rooms[room_id])
+                    for room_id in self.by_game.get(game_id, ())}
+    
+    def update(self, room_id, room_data):
+        """Merge changes into a room. False if it no longer exists"""
+        room_data = copy.deepcopy(room_data)
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                return False
+            self._unindex(room_id, room)
+            room = self.rooms[room_id] = {**room, **room_data}
+            self._index(room_id, room)
+            self.generation += 1
+            return True
+    
+    def delete(self, room_id):
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+            if room is None:
+                return False
+            self.room_locks.pop(room_id, None)
+            self._unindex(room_id, room)
+            self.generation += 1
+            return True
+    
+    def _snapshot_loop(self, path, interval):
+        """Write all rooms to a JSON file when they changed (debugging aid)"""
+        written = None
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                if self.generation == written:
+                    continue
+                written = self.generation
+                rooms = copy.deepcopy(self.rooms)
+            try:
+                _write_json_atomic(path, rooms)
+            except OSError as e:
+                print(f"[Rooms] Failed to write snapshot: {e}")
@@ -0,0 +1,342 @@
+"""
+SQLite Database Server for Game Store System
+Drop-in alternative to DatabaseServer backed by one SQLite file in WAL mode,
+so the developer and lobby servers share a consistent store without reloads
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from db_locks import InstrumentedLock
+from db_server import DatabaseServer
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dev_users(
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS player_users(
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS played_games(
+    username TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    PRIMARY KEY (username, game_id)
+);
+CREATE TABLE IF NOT EXISTS games(
+    game_id TEXT PRIMARY KEY,
+    author TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_games_author ON games(author);
+CREATE TABLE IF NOT EXISTS reviews(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id TEXT NOT NULL,
+    username TEXT,
+    rating REAL,
+    comment TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_game_id ON reviews(game_id);
+CREATE TABLE IF NOT EXISTS game_ratings(
+    game_id TEXT PRIMARY KEY,
+    rating_sum REAL NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    histogram TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations(
+    collection TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteDatabaseServer:
+    """Database server storing all persistent data in SQLite"""
+    
+    _hash_password = staticmethod(DatabaseServer._hash_password)
+    
+    def __init__(self, data_dir="data", db_path=None):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.db_path = db_path or os.path.join(data_dir, "game_store.db")
+        
+        # One connection per thread; SQLite handles cross-process locking
+        self._local = threading.local()
+        
+        # Protects the in-memory session maps only
+        self.lock = InstrumentedLock("sessions")
+        
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.commit()
+        
+        # Track online sessions
+        self.dev_sessions = {}  # username -> connection
+        self.player_sessions = {}  # username -> connection
+    
+    def _conn(self):
+        """Get this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.changes = conn.total_changes
+        return conn
+    
+    @contextmanager
+    def _transaction(self, collection):
+        """Write transaction that bumps the collection generation on commit"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            if conn.total_changes != self._local.changes:
+                conn.execute(
+                    "INSERT INTO generations(collection, value) VALUES(?, 1) "
+                    "ON CONFLICT(collection) DO UPDATE SET value = value + 1",
+                    (collection,)
+                )
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.changes = conn.total_changes
+    
+    def _write(self, collection, sql, params):
+        """Run one statement in a write transaction. Returns affected rows"""
+        with self._transaction(collection) as conn:
+            return conn.execute(sql, params).rowcount
+    
+    # Developer User Management
+    def register_dev_user(self, username, password):
+        """Register a new developer user"""
+        try:
+            self._write(
+                "dev_users",
+                "INSERT INTO dev_users(username, password, created_at) VALUES(?, ?, ?)",
+                (username, self._hash_password(password), datetime.now().isoformat())
+            )
+        except sqlite3.IntegrityError:
+            return False, "帳號已被使用"
+        return True, "註冊成功"
+    
+    def login_dev_user(self, username, password):
+        """Login developer user"""
+        row = self._conn().execute(
+            "SELECT password FROM dev_users WHERE username = ?", (username,)
+        ).fetchone()
+        if not row or row[0] != self._hash_password(password):
+            return False, "帳號或密碼錯誤"
+        
+        with self.lock:
+            if username in self.dev_sessions:
+                return False, "帳號已在其他裝置登入"
+        
+        return True, "登入成功"
+    
+    def set_dev_session(self, username, conn=None):
+        """Set developer session"""
+        with self.lock:
+            if conn:
+                self.dev_sessions[username] = conn
+            elif username in self.dev_sessions:
+                del self.dev_sessions[username]
+    
+    # Player User Management
+    def register_player_user(self, username, password):
+        """Register a new player user"""
+        try:
+            self._write(
+                "player_users",
+                "INSERT INTO player_users(username, password, created_at) VALUES(?, ?, ?)",
+                (username, self._hash_password(password), datetime.now().isoformat())
+            )
+        except sqlite3.IntegrityError:
+            return False, "帳號已被使用"
+        return True, "註冊成功"
+    
+    def login_player_user(self, username, password):
+        """Login player user"""
+        row = self._conn().execute(
+            "SELECT password FROM player_users WHERE username = ?", (username,)
+        ).fetchone()
+        if not row or row[0] != self._hash_password(password):
+            return False, "帳號或密碼錯誤"
+        
+        with self.lock:
+            if username in self.player_sessions:
+                return False, "帳號已在其他裝置登入"
+        
+        return True, "登入成功"
+    
+    def set_player_session(self, username, conn=None):
+        """Set player session"""
+        with self.lock:
+            if conn:
+                self.player_sessions[username] = conn
+            elif username in self.player_sessions:
+                del self.player_sessions[username]
+    
+    # Game Management
+    def add_game(self, game_id, game_data):
+        """Add a new game"""
+        self._write(
+            "games",
+            "INSERT OR REPLACE INTO games(game_id, author, data) VALUES(?, ?, ?)",
+            (game_id, game_data.get('author'), json.dumps(game_data, ensure_ascii=False))
+        )
+        return True
+    
+    def update_game(self, game_id, game_data):
+        """Update an existing game"""
+        with self._transaction("games") as conn:
+            row = conn.execute("SELECT data FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if not row:
+                return False, "遊戲不存在"
+            
+            # Keep original data and update
+            game = json.loads(row[0])
+            game.update(game_data)
+            conn.execute(
+                "UPDATE games SET author = ?, data = ? WHERE game_id = ?",
+                (game.get('author'), json.dumps(game, ensure_ascii=False), game_id)
+            )
+        return True, "更新成功"
+    
+    def delete_game(self, game_id):
+        """Delete a game"""
+        if not self._write("games", "DELETE FROM games WHERE game_id = ?", (game_id,)):
+            return False, "遊戲不存在"
+        return True, "刪除成功"
+    
+    def get_game(self, game_id):
+        """Get game info"""
+        row = self._conn().execute(
+            "SELECT data FROM games WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def get_all_games(self):
+        """Get all games"""
+        rows = self._conn().execute("SELECT game_id, data FROM games").fetchall()
+        return {game_id: json.loads(data) for game_id, data in rows}
+    
+    def get_games_by_author(self, author):
+        """Get games by author (indexed lookup)"""
+        rows = self._conn().execute(
+            "SELECT game_id, data FROM games WHERE author = ?", (author,)
+        ).fetchall()
+        return {game_id: json.loads(data) for game_id, data in rows}
+    
+    # Review Management
+    def add_review(self, game_id, username, rating, comment):
+        """Add a review for a game and update its rating aggregate"""
+        with self._transaction("reviews") as conn:
+            conn.execute(
+                "INSERT INTO reviews(game_id, username, rating, comment, created_at) "
+                "VALUES(?, ?, ?, ?, ?)",
+                (game_id, username, rating, comment, datetime.now().isoformat())
+            )
+            row = conn.execute(
+                "SELECT histogram FROM game_ratings WHERE game_id = ?", (game_id,)
+            ).fetchone()
+            histogram = json.loads(row[0]) if row else {str(i): 0 for i in range(1, 6)}
+            histogram[DatabaseServer._rating_bucket(rating)] += 1
+            conn.execute(
+                "INSERT INTO game_ratings(game_id, rating_sum, rating_count, histogram) "
+                "VALUES(?, ?, 1, ?) ON CONFLICT(game_id) DO UPDATE SET "
+                "rating_sum = rating_sum + excluded.rating_sum, "
+                "rating_count = rating_count + 1, histogram = excluded.histogram",
+                (game_id, rating, json.dumps(histogram))
+            )
+        return True
+    
+    def get_reviews(self, game_id):
+        """Get all reviews for a game"""
+        rows = self._conn().execute(
+            "SELECT username, rating, comment, created_at FROM reviews "
+            "WHERE game_id = ? ORDER BY id", (game_id,)
+        ).fetchall()
+        return [
+            {"username": u, "rating": r, "comment": c, "created_at": t}
+            for u, r, c, t in rows
+        ]
+    
+    def get_average_rating(self, game_id):
+        """Get average rating for a game"""
+        row = self._conn().execute(
+            "SELECT rating_sum, rating_count FROM game_ratings WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        if not row or not row[1]:
+            return 0
+        return row[0] / row[1]
+    
+    def get_rating_summary(self, game_id):
+        """Get average, review count and rating histogram for a game"""
+        row = self._conn().execute(
+            "SELECT rating_sum, rating_count, histogram FROM game_ratings WHERE game_id = ?",
+            (game_id,)
+        ).fetchone()
+        if not row or not row[1]:
+            return {"average": 0, "count": 0, "histogram": {str(i): 0 for i in range(1, 6)}}
+        return {"average": row[0] / row[1], "count": row[1], "histogram": json.loads(row[2])}
+    
+    def add_played_game(self, username, game_id):
+        """Mark that a player has played a game"""
+        if not self._conn().execute(
+            "SELECT 1 FROM player_users WHERE username = ?", (username,)
+        ).fetchone():
+            return
+        self._write(
+            "player_users",
+            "INSERT OR IGNORE INTO played_games(username, game_id) VALUES(?, ?)",
+            (username, game_id)
+        )
+    
+    def has_played_game(self, username, game_id):
+        """Check if player has played a game"""
+        row = self._conn().execute(
+            "SELECT 1 FROM played_games WHERE username = ? AND game_id = ?",
+            (username, game_id)
+        ).fetchone()
+        return row is not None
+    
+    def get_generation(self, collection):
+        """Get the change counter of a collection (shared by all processes)"""
+        row = self._conn().execute(
+            "SELECT value FROM generations WHERE collection = ?", (collection,)
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def get_cache_stats(self):
+        """No application-level cache: every read is an indexed query"""
+        return {}
+    
+    def get_flush_stats(self):
+        """Nothing is batched: every write commits its own transaction"""
+        return {}
+    
+    def get_lock_stats(self):
+        """Only the session lock is ours; SQLite does the data locking"""
+        return {"sessions": self.lock.stats.as_dict()}
+    
+    # Change feed: every read is a query, so there is no copy to keep current
+    def follow(self, collection):
+        pass
+    
+    def resync(self, collection):
+        pass
+    
+    def apply_change(self, collection, key, value):
+        pass
@@ -0,0 +1,47 @@
+"""
+Periodic Stats Log for Game Store System
+Prints a server's database, lock, flush and worker-lane counters as one
+JSON log line at a fixed interval, so they can be watched without a debugger
+"""
+
+import json
+import os
+import threading
+import time
+
+
+# Seconds between stats lines (0 = never)
+STATS_INTERVAL = float(os.environ.get('GAME_STORE_STATS_INTERVAL', '0'))
+
+
+class StatsLog:
+    """Log the counters of named sources every interval seconds
+    
+    sources maps a name to a callable returning a JSON-serializable dict;
+    a source that fails is logged as {"error": ...} instead of stopping
+    the others.
+    """
+    
+    def __init__(self, name, sources, interval=STATS_INTERVAL):
+        self.name = name
+        self.sources = sources
+        
+        if interval > 0:
+            threading.Thread(target=self._run, args=(interval,),
+                             name="stats-log", daemon=True).start()
+    
+    def collect(self):
+        """Current counters of every source"""
+        stats = {}
+        for name, source in self.sources.items():
+            try:
+                stats[name] = source()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return stats
+    
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            line = json.dumps(self.collect(), ensure_ascii=False, sort_keys=True, default=str)
+            print(f"[Stats] {self.name} {line}")
@@ -0,0 +1,443 @@
+"""
+Storage Engines for Game Store System
+Persist database collections either as whole JSON files or as
+append-only journals that are periodically compacted into snapshots
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock shared with the other server process
+    fcntl = None
+
+
+def _read_json(filepath, default):
+    """Load JSON file or return default if not exists"""
+    if os.path.exists(filepath):
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            return default
+    return default
+
+
+def _write_json_atomic(filepath, data, fsync=False):
+    """Write JSON to a temp file and rename it over the target"""
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+def _signature(filepath):
+    """Identify a file version by (inode, size, mtime); None if missing"""
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class CacheStats:
+    """Hit/miss counters for collection revalidation"""
+    
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.tails = 0  # journal appends applied without a full reload
+    
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses, "tails": self.tails}
+
+
+def apply_record(data, record):
+    """Apply one journal record to a collection dict
+    
+    Every operation is idempotent so that replaying a journal on top of a
+    snapshot that already contains some of its records is harmless:
+    set/delete are absolute, and append carries the list index it wrote.
+    """
+    op = record.get('op')
+    key = record.get('key')
+    
+    if op == 'set':
+        data[key] = record.get('value')
+    elif op == 'delete':
+        data.pop(key, None)
+    elif op == 'append':
+        items = data.setdefault(key, [])
+        if len(items) <= record.get('index', len(items)):
+            items.append(record.get('value'))
+
+
+class JSONStorage:
+    """Rewrite the whole collection file on every mutation"""
+    
+    name = "json"
+    
+    def __init__(self, data_dir, fsync=False):
+        self.data_dir = data_dir
+        self.fsync = fsync
+        os.makedirs(data_dir, exist_ok=True)
+        
+        self._signatures = {}  # collection -> signature of the file we last saw
+        self.stats = {}  # collection -> CacheStats
+    
+    def snapshot_path(self, collection):
+        """Path of the collection's JSON file"""
+        return os.path.join(self.data_dir, f"{collection}.json")
+    
+    def journal_path(self, collection):
+        """Path of a journal left behind by the journal engine"""
+        return os.path.join(self.data_dir, f"{collection}.journal")
+    
+    def load(self, collection, default, recover=False):
+        """Load a collection"""
+        self._signatures[collection] = _signature(self.snapshot_path(collection))
+        data = _read_json(self.snapshot_path(collection), default)
+        
+        # Fold in a journal left by the journal engine so switching
+        # backends never loses acknowledged writes
+        journal_path = self.journal_path(collection)
+        if recover and os.path.exists(journal_path):
+            records, _ = _read_journal(journal_path)
+            for record in records:
+                apply_record(data, record)
+            _write_json_atomic(self.snapshot_path(collection), data, self.fsync)
+            os.remove(journal_path)
+            self._signatures[collection] = _signature(self.snapshot_path(collection))
+            print(f"[Storage] Folded {len(records)} journal records into {collection}.json")
+        
+        return data
+    
+    def refresh(self, collection, data, default):
+        """Reload a collection only if another process rewrote its file
+        
+        Returns the new data, or None when the cached copy is still current.
+        """
+        stats = self.stats.setdefault(collection, CacheStats())
+        if _signature(self.snapshot_path(collection)) == self._signatures.get(collection):
+            stats.hits += 1
+            return None
+        
+        stats.misses += 1
+        return self.load(collection, default)
+    
+    def record(self, collection, data, op, key, value=None, index=None):
+        """Persist a mutation by rewriting the whole collection"""
+        self.flush(collection, data)
+    
+    def flush(self, collection, data):
+        """Write the whole collection (also used by group commit)"""
+        # Rename into place so readers in other processes never see half a file
+        filepath = self.snapshot_path(collection)
+        _write_json_atomic(filepath, data, self.fsync)
+        self._signatures[collection] = _signature(filepath)
+    
+    def close(self):
+        """Nothing to release"""
+        pass
+
+
+def _read_journal(journal_path, offset=0):
+    """Read journal records from offset. Returns (records, offset after last good record)"""
+    records = []
+    good_offset = offset
+    
+    with open(journal_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            # A missing newline means the writer died mid-record
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                break
+            good_offset += len(line)
+    
+    return records, good_offset
+
+
+class JournalStorage:
+    """Append one record per mutation and compact into snapshots periodically"""
+    
+    name = "journal"
+    
+    def __init__(self, data_dir, compact_threshold=1000, fsync=False):
+        self.data_dir = data_dir
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        os.makedirs(data_dir, exist_ok=True)
+        
+        self._handles = {}  # collection -> open journal file
+        self._pending = {}  # collection -> records since last snapshot
+        
+        # One lock per collection: compacting reviews never stalls a users append
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        
+        # flock()ed files shared with the other server process, so it never
+        # appends while we truncate or compact (taken inside the thread lock)
+        self._lock_files = {}  # collection -> fd
+        
+        # collection -> (snapshot signature, journal inode, journal offset read)
+        self._positions = {}
+        self.stats = {}  # collection -> CacheStats
+    
+    def snapshot_path(self, collection):
+        """Path of the collection snapshot (same format as JSONStorage)"""
+        return os.path.join(self.data_dir, f"{collection}.json")
+    
+    def journal_path(self, collection):
+        """Path of the collection journal"""
+        return os.path.join(self.data_dir, f"{collection}.journal")
+    
+    def lock_path(self, collection):
+        """Path of the file both server processes lock around journal changes"""
+        return os.path.join(self.data_dir, f"{collection}.lock")
+    
+    def load(self, collection, default, recover=False):
+        """Load snapshot and replay journal on top of it
+        
+        With recover=True a torn trailing record (crash mid-append) is cut
+        off so that later appends start on a clean line. The file lock is
+        held meanwhile: a record the other process is still writing would
+        otherwise look torn.
+        """
+        if recover:
+            with self._lock(collection), self._file_lock(collection):
+                return self._load(collection, default, recover=True)
+        return self._load(collection, default)
+    
+    def _load(self, collection, default, recover=False):
+        snapshot_signature = _signature(self.snapshot_path(collection))
+        data = _read_json(self.snapshot_path(collection), default)
+        
+        journal_path = self.journal_path(collection)
+        journal_signature = _signature(journal_path)
+        if journal_signature is None:
+            self._pending[collection] = 0
+            self._positions[collection] = (snapshot_signature, None, 0)
+            return data
+        
+        records, good_offset = _read_journal(journal_path)
+        for record in records:
+            apply_record(data, record)
+        self._pending[collection] = len(records)
+        self._positions[collection] = (snapshot_signature, journal_signature[0], good_offset)
+        
+        if recover and good_offset < os.path.getsize(journal_path):
+            with open(journal_path, 'r+b') as f:
+                f.truncate(good_offset)
+            print(f"[Storage] Truncated torn record at end of {collection}.journal")
+        
+        return data
+    
+    def refresh(self, collection, data, default):
+        """Bring a cached collection up to date with other processes' writes
+        
+        Unchanged files cost two stat calls. If only the journal grew, the new
+        records are applied to data in place; a new snapshot (compaction by
+        the writer) forces a full reload. Returns the current data, or None
+        when nothing changed.
+        """
+        stats = self.stats.setdefault(collection, CacheStats())
+        snapshot_signature = _signature(self.snapshot_path(collection))
+        journal_path = self.journal_path(collection)
+        journal_signature = _signature(journal_path)
+        known_snapshot, known_inode, offset = self._positions.get(collection, (None, None, 0))
+        
+        if collection in self._positions and snapshot_signature == known_snapshot:
+            if journal_signature is None and known_inode is None:
+                stats.hits += 1
+                return None
+            if journal_signature and journal_signature[0] == known_inode:
+                if journal_signature[1] == offset:
+                    stats.hits += 1
+                    return None
+                if journal_signature[1] > offset:
+                    records, good_offset = _read_journal(journal_path, offset)
+                    for record in records:
+                        apply_record(data, record)
+                    self._positions[collection] = (known_snapshot, known_inode, good_offset)
+                    if not records:
+                        # Only a record still being written; nothing to apply yet
+                        stats.hits += 1
+                        return None
+                    stats.tails += 1
+                    return data
+        
+        stats.misses += 1
+        return self.load(collection, default)
+    
+    def _lock(self, collection):
+        """Get (or create) the lock of a collection's journal"""
+        lock = self._locks.get(collection)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(collection, threading.Lock())
+        return lock
+    
+    @contextmanager
+    def _file_lock(self, collection):
+        """Hold the cross-process lock of a collection (call with its thread lock held)"""
+        if fcntl is None:
+            yield
+            return
+        fd = self._lock_files.get(collection)
+        if fd is None:
+            fd = os.open(self.lock_path(collection), os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_files[collection] = fd
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    
+    def _handle(self, collection):
+        """Get (or open) the append handle for a collection journal"""
+        fh = self._handles.get(collection)
+        if fh is None:
+            fh = open(self.journal_path(collection), 'ab')
+            self._handles[collection] = fh
+        return fh
+    
+    def record(self, collection, data, op, key, value=None, index=None):
+        """Append one mutation record; data is the collection after the change"""
+        record = {"op": op, "key": key}
+        if op != 'delete':
+            record["value"] = value
+        if index is not None:
+            record["index"] = index
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+        
+        payload = line.encode('utf-8')
+        
+        with self._lock(collection), self._file_lock(collection):
+            fh = self._handle(collection)
+            size_before = os.fstat(fh.fileno()).st_size
+            fh.write(payload)
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+            
+            # Skip our own record on the next refresh unless another
+            # process has appended records we have not read yet
+            position = self._positions.get(collection)
+            if position and position[2] == size_before and fh.tell() == size_before + len(payload):
+                inode = os.fstat(fh.fileno()).st_ino
+                if position[1] in (None, inode):
+                    self._positions[collection] = (position[0], inode, fh.tell())
+            
+            self._pending[collection] = self._pending.get(collection, 0) + 1
+            if self._pending[collection] >= self.compact_threshold:
+                self._compact_merged(collection, data)
+    
+    def compact(self, collection, data):
+        """Write a snapshot of data and reset the journal"""
+        with self._lock(collection), self._file_lock(collection):
+            self._compact_merged(collection, data)
+    
+    def flush(self, collection, data):
+        """Write the whole collection as a snapshot (group commit); the journal is reset
+        
+        Batched collections are written by one process only, so data is
+        written as is: it holds writes that are not on disk yet.
+        """
+        with self._lock(collection), self._file_lock(collection):
+            self._compact(collection, data)
+    
+    def _compact_merged(self, collection, data):
+        """Compact, keeping records another process appended that we have not read"""
+        merged = self._merge_unread(collection, data)
+        self._compact(collection, merged)
+        if merged is not data:
+            # Our copy lacks the other process's records; reload on next read
+            self._positions.pop(collection, None)
+    
+    def _merge_unread(self, collection, data):
+        """data plus the other process's unread writes (file lock held)
+        
+        Returns data itself when there is nothing unread. Every process folds
+        the journal in before compacting, so snapshot plus journal always
+        hold every acknowledged write, ours included.
+        """
+        journal_path = self.journal_path(collection)
+        journal_signature = _signature(journal_path)
+        known_snapshot, known_inode, offset = self._positions.get(collection, (None, None, 0))
+        
+        if (collection in self._positions
+                and _signature(self.snapshot_path(collection)) == known_snapshot):
+            if journal_signature is None and known_inode is None:
+                return data
+            if journal_signature and journal_signature[0] == known_inode and journal_signature[1] >= offset:
+                records, _ = _read_journal(journal_path, offset)
+                if not records:
+                    return data
+                # Review lists are appended to, so copy them before replaying
+                merged = {key: list(value) if isinstance(value, list) else value
+                          for key, value in data.items()}
+                for record in records:
+                    apply_record(merged, record)
+                return merged
+        
+        # Another process compacted since we last read: the files are complete
+        merged = _read_json(self.snapshot_path(collection), {})
+        if journal_signature is not None:
+            records, _ = _read_journal(journal_path)
+            for record in records:
+                apply_record(merged, record)
+        return merged
+    
+    def _compact(self, collection, data):
+        """Compact while holding the collection's journal lock and file lock"""
+        _write_json_atomic(self.snapshot_path(collection), data, fsync=True)
+        
+        # A crash before this truncate only leaves records that replay
+        # idempotently on top of the new snapshot
+        fh = self._handles.pop(collection, None)
+        if fh:
+            fh.close()
+        with open(self.journal_path(collection), 'wb') as f:
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._pending[collection] = 0
+        
+        # Our own compaction must not look like a foreign rewrite
+        journal_signature = _signature(self.journal_path(collection))
+        self._positions[collection] = (
+            _signature(self.snapshot_path(collection)), journal_signature[0], 0
+        )
+    
+    def close(self):
+        """Close journal handles and lock files"""
+        for collection in list(self._handles):
+            with self._lock(collection):
+                fh = self._handles.pop(collection, None)
+                if fh:
+                    fh.close()
+        for collection in list(self._lock_files):
+            with self._lock(collection):
+                os.close(self._lock_files.pop(collection))
+
+
+def create_storage(data_dir, backend=None):
+    """Create the storage engine selected by GAME_STORE_STORAGE (journal|json)"""
+    backend = backend or os.environ.get('GAME_STORE_STORAGE', 'journal')
+    fsync = os.environ.get('GAME_STORE_FSYNC', '0') == '1'
+    
+    if backend == 'json':
+        return JSONStorage(data_dir, fsync=fsync)
+    if backend == 'journal':
+        threshold = int(os.environ.get('GAME_STORE_COMPACT_THRESHOLD', '1000'))
+        return JournalStorage(data_dir, compact_threshold=threshold, fsync=fsync)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,257 @@
+"""
+Streaming Zip Extraction for Game Uploads
+Reads a zip sent with send_file() and extracts each entry as its bytes
+arrive, validating paths and limits and hashing files in the same pass
+"""
+
+import hashlib
+import os
+import struct
+import zlib
+
+from protocol import get_reader, recv_exact
+
+
+# Limits (override with environment variables)
+MAX_UPLOAD_BYTES = int(os.environ.get('GAME_STORE_MAX_UPLOAD_BYTES', str(512 * 1024 * 1024)))
+MAX_FILE_BYTES = int(os.environ.get('GAME_STORE_MAX_FILE_BYTES', str(256 * 1024 * 1024)))
+MAX_UPLOAD_FILES = int(os.environ.get('GAME_STORE_MAX_UPLOAD_FILES', '10000'))
+
+CHUNK_SIZE = 1024 * 1024
+
+_LOCAL_HEADER = b'PK\x03\x04'
+_CENTRAL_HEADER = b'PK\x01\x02'
+_END_OF_CENTRAL = b'PK\x05\x06'
+_ZIP64_END = b'PK\x06\x06'
+_DATA_DESCRIPTOR = b'PK\x07\x08'
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+
+
+class _SocketReader:
+    """Exact and partial reads over the next `remaining` bytes of a socket"""
+    
+    def __init__(self, sock, remaining):
+        self.sock = sock
+        # Start with whatever the connection's frame reader already received
+        self.buffer = bytearray(get_reader(sock).take(remaining))
+        self.remaining = remaining - len(self.buffer)  # bytes still on the wire
+        self.chunk = bytearray(CHUNK_SIZE)
+        self.view = memoryview(self.chunk)
+    
+    def _fill(self):
+        """Receive more bytes into the buffer"""
+        if self.remaining == 0:
+            raise ValueError("壓縮檔不完整")
+        count = self.sock.recv_into(self.view, min(CHUNK_SIZE, self.remaining))
+        if not count:
+            raise ConnectionError("socket closed")
+        self.remaining -= count
+        self.buffer += self.view[:count]
+    
+    def read(self, n):
+        """Read exactly n bytes"""
+        while len(self.buffer) < n:
+            self._fill()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+    
+    def read_some(self, limit):
+        """Read between 1 and limit bytes"""
+        if not self.buffer:
+            self._fill()
+        data = bytes(self.buffer[:limit])
+        del self.buffer[:len(data)]
+        return data
+    
+    def unread(self, data):
+        """Push back bytes read past the end of an entry"""
+        self.buffer[0:0] = data
+    
+    def drain(self):
+        """Discard the rest of the stream"""
+        self.buffer.clear()
+        while self.remaining:
+            count = self.sock.recv_into(self.view, min(CHUNK_SIZE, self.remaining))
+            if not count:
+                raise ConnectionError("socket closed")
+            self.remaining -= count
+
+
+def _safe_relpath(name):
+    """Normalise an entry name, rejecting absolute paths and '..' components"""
+    parts = name.replace('\\', '/').split('/')
+    if name.startswith(('/', '\\')) or (parts and ':' in parts[0]):
+        raise ValueError(f"檔案路徑不合法: {name}")
+    parts = [part for part in parts if part not in ('', '.')]
+    if not parts or '..' in parts:
+        raise ValueError(f"檔案路徑不合法: {name}")
+    return '/'.join(parts)
+
+
+def _zip64_sizes(extra, csize, usize):
+    """Read sizes stored in the zip64 extra field"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack('<HH', extra[offset:offset + 4])
+        field = extra[offset + 4:offset + 4 + length]
+        if header_id == 0x0001:
+            values = list(struct.unpack(f'<{len(field) // 8}Q', field[:len(field) // 8 * 8]))
+            if usize == 0xFFFFFFFF and values:
+                usize = values.pop(0)
+            if csize == 0xFFFFFFFF and values:
+                csize = values.pop(0)
+            return csize, usize, True
+        offset += 4 + length
+    return csize, usize, False
+
+
+def _extract_entry(reader, f, method, csize, has_descriptor, limits):
+    """Copy one entry's data to f. Returns (crc32, size, sha256)"""
+    max_file, total_left = limits
+    crc = 0
+    size = 0
+    digest = hashlib.sha256()
+    
+    def emit(data):
+        nonlocal crc, size
+        size += len(data)
+        if size > max_file or size > total_left:
+            raise ValueError("檔案大小超過上限")
+        crc = zlib.crc32(data, crc)
+        digest.update(data)
+        f.write(data)
+    
+    if method == 0:
+        left = csize
+        while left:
+            data = reader.read_some(min(left, CHUNK_SIZE))
+            left -= len(data)
+            emit(data)
+        return crc, size, digest.hexdigest()
+    
+    # Deflate; bound each output step so a zip bomb cannot balloon memory
+    decompressor = zlib.decompressobj(-15)
+    left = None if has_descriptor else csize
+    while not decompressor.eof:
+        if left == 0:
+            raise ValueError("壓縮資料損毀")
+        data = reader.read_some(CHUNK_SIZE if left is None else min(left, CHUNK_SIZE))
+        if left is not None:
+            left -= len(data)
+        try:
+            emit(decompressor.decompress(data, CHUNK_SIZE))
+            while decompressor.unconsumed_tail:
+                emit(decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE))
+        except zlib.error:
+            raise ValueError("壓縮資料損毀")
+    
+    if decompressor.unused_data:
+        if left is not None:
+            raise ValueError("壓縮資料損毀")
+        reader.unread(decompressor.unused_data)
+    elif left:
+        reader.read(left)
+    return crc, size, digest.hexdigest()
+
+
+def _receive_entries(reader, dest_dir):
+    """Extract entries until the central directory. Returns the manifest files dict"""
+    root = os.path.realpath(dest_dir)
+    files = {}
+    total = 0
+    
+    while True:
+        signature = reader.read(4)
+        if signature in (_CENTRAL_HEADER, _END_OF_CENTRAL, _ZIP64_END):
+            return files
+        if signature != _LOCAL_HEADER:
+            raise ValueError("不是有效的 zip 檔案")
+        
+        (_, flags, method, _, _, crc, csize, usize,
+         name_len, extra_len) = struct.unpack('<HHHHHIIIHH', reader.read(26))
+        raw_name = reader.read(name_len)
+        extra = reader.read(extra_len)
+        name = raw_name.decode('utf-8' if flags & _FLAG_UTF8 else 'cp437')
+        csize, usize, zip64 = _zip64_sizes(extra, csize, usize)
+        has_descriptor = bool(flags & _FLAG_DATA_DESCRIPTOR)
+        
+        if flags & _FLAG_ENCRYPTED:
+            raise ValueError("不支援加密的 zip 檔案")
+        if method not in (0, 8) or (method == 0 and has_descriptor):
+            raise ValueError(f"不支援的壓縮方式: {name}")
+        
+        is_dir = name.endswith(('/', '\\'))
+        relpath = _safe_relpath(name)
+        target = os.path.realpath(os.path.join(dest_dir, *relpath.split('/')))
+        if not target.startswith(root + os.sep):
+            raise ValueError(f"檔案路徑不合法: {name}")
+        
+        if is_dir:
+            os.makedirs(target, exist_ok=True)
+            if csize and not has_descriptor:
+                reader.read(csize)
+            continue
+        
+        if relpath in files:
+            raise ValueError(f"檔案重複: {name}")
+        if len(files) >= MAX_UPLOAD_FILES:
+            raise ValueError("檔案數量超過上限")
+        
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            actual_crc, size, sha256 = _extract_entry(
+                reader, f, method, csize, has_descriptor,
+                (MAX_FILE_BYTES, MAX_UPLOAD_BYTES - total)
+            )
+        
+        if has_descriptor:
+            descriptor = reader.read(4)
+            if descriptor == _DATA_DESCRIPTOR:
+                descriptor = reader.read(4)
+            crc = struct.unpack('<I', descriptor)[0]
+            size_format = '<QQ' if zip64 else '<II'
+            _, usize = struct.unpack(size_format, reader.read(struct.calcsize(size_format)))
+        
+        if actual_crc != crc or size != usize:
+            raise ValueError(f"檔案校驗失敗: {name}")
+        
+        total += size
+        files[relpath] = {"sha256": sha256, "size": size}
+
+
+def recv_zip(sock, dest_dir):
+    """Receive a zip sent with send_file() and extract it into dest_dir
+    
+    Returns the version manifest ({"files": {path: {"sha256", "size"}}}), or
+    None if the connection dropped. Raises ValueError for an invalid or
+    oversized archive, or OSError when extracting fails (disk full), after
+    consuming the rest of the stream, so the connection stays usable for
+    the error response.
+    """
+    size_bytes = recv_exact(sock, 8)
+    if not size_bytes:
+        return None
+    
+    file_size = int.from_bytes(size_bytes, byteorder='big')
+    reader = _SocketReader(sock, file_size)
+    
+    try:
+        if file_size > MAX_UPLOAD_BYTES:
+            raise ValueError("上傳檔案超過大小上限")
+        os.makedirs(dest_dir, exist_ok=True)
+        files = _receive_entries(reader, dest_dir)
+        reader.drain()
+    except ConnectionError:
+        return None
+    except (ValueError, OSError):
+        try:
+            reader.drain()
+        except OSError:
+            return None
+        raise
+    
+    return {"files": files}
@@ -0,0 +1,183 @@
+"""
+Warm Game Server Pool for Game Store System
+Keeps idle game servers already running for the games rooms start most, so
+starting a game hands out a listening server instead of launching one
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+
+# Pool sizing (override with environment variables)
+WARM_MAX = int(os.environ.get('GAME_STORE_WARM_MAX', '2'))  # idle servers per game version
+WARM_WINDOW = int(os.environ.get('GAME_STORE_WARM_WINDOW', '600'))  # seconds of starts to size by
+STARTS_PER_WARM = 4  # one warm server per this many recent starts
+SWEEP_INTERVAL = min(60, WARM_WINDOW)  # seconds between idle-server sweeps
+
+WARM_PREFIX = "warm:"
+
+
+class WarmPool:
+    """Idle game servers per (game_id, version), sized by recent start rate
+    
+    Warm servers run under the supervisor and hold a port lease keyed
+    "warm:<n>" until take() hands them to a room. A sweep retires idle
+    servers of game versions nobody started within WARM_WINDOW.
+    """
+    
+    def __init__(self, supervisor, ports, sweep_interval=SWEEP_INTERVAL):
+        self.supervisor = supervisor
+        self.ports = ports
+        self.lock = threading.Lock()
+        self.idle = {}  # (game_id, version) -> [GameProcess]
+        self.starts = {}  # (game_id, version) -> deque of start times
+        self.refilling = set()
+        self._ids = itertools.count(1)
+        
+        threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                         name="warm-pool-sweep", daemon=True).start()
+    
+    @staticmethod
+    def is_warm(key):
+        return str(key).startswith(WARM_PREFIX)
+    
+    def target(self, game_id, version):
+        """Idle servers to keep for a game version"""
+        with self.lock:
+            return self._target((game_id, version))
+    
+    def _target(self, key):
+        """target() with the lock held"""
+        starts = self.starts.get(key, ())
+        recent = sum(1 for started in starts if started >= time.time() - WARM_WINDOW)
+        return min(WARM_MAX, (recent + STARTS_PER_WARM - 1) // STARTS_PER_WARM)
+    
+    def take(self, game_id, version, room_id):
+        """Hand an idle server to a room. Returns its GameProcess, or None if none is warm"""
+        key = (game_id, version)
+        with self.lock:
+            starts = self.starts.setdefault(key, deque())
+            starts.append(time.time())
+            while starts and starts[0] < time.time() - WARM_WINDOW:
+                starts.popleft()
+            
+            idle = self.idle.get(key, [])
+            while idle:
+                game = idle.pop()
+                if game.process.poll() is None:
+                    break
+            else:
+                return None
+        
+        # The server can still exit during the hand-off; the room then
+        # starts a server of its own
+        warm_key = game.room_id
+        port = game.meta.get('port')
+        try:
+            self.ports.transfer(warm_key, room_id)
+        except KeyError:
+            return None  # its exit already released the lease
+        try:
+            self.supervisor.assign(warm_key, room_id)
+        except KeyError:
+            self.ports.release(room_id, port)
+            return None
+        if game.process.poll() is not None:
+            game.stopped = True  # its exit must not reset the room
+            self.ports.release(room_id, port)
+            return None
+        return game
+    
+    def refill_later(self, game_id, version, cmd, cwd):
+        """Top the pool up to its target in the background"""
+        key = (game_id, version)
+        with self.lock:
+            if key in self.refilling:
+                return
+            self.refilling.add(key)
+        threading.Thread(target=self._refill, args=(key, cmd, cwd), daemon=True).start()
+    
+    def _refill(self, key, cmd, cwd):
+        game_id, version = key
+        try:
+            self._retire_other_versions(game_id, version)
+            target = self.target(game_id, version)
+            
+            while True:
+                with self.lock:
+                    idle = [game for game in self.idle.get(key, []) if game.process.poll() is None]
+                    self.idle[key] = idle
+                    surplus = idle[target:]
+                    del idle[target:]
+                    if not surplus and len(idle) >= target:
+                        break
+                for game in surplus:
+                    self._retire(game)
+                if surplus:
+                    break
+                
+                warm_key = f"{WARM_PREFIX}{next(self._ids)}"
+                port = self.ports.lease(warm_key)
+                if not port:
+                    break
+                try:
+                    game = self.supervisor.launch(warm_key, cmd + ['--port', str(port)], cwd,
+                                                  game_id=game_id, port=port)
+                except Exception as e:
+                    self.ports.release(warm_key)
+                    print(f"[WarmPool] Failed to start {game_id} v{version}: {e}")
+                    break
+                with self.lock:
+                    self.idle.setdefault(key, []).append(game)
+                print(f"[WarmPool] Warm server for {game_id} v{version} on port {port}")
+        finally:
+            with self.lock:
+                self.refilling.discard(key)
+    
+    def _sweep_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[WarmPool] Sweep failed: {e}")
+    
+    def sweep(self):
+        """Retire idle servers beyond their version's current target"""
+        now = time.time()
+        surplus = []
+        with self.lock:
+            for key in list(self.starts):
+                starts = self.starts[key]
+                while starts and starts[0] < now - WARM_WINDOW:
+                    starts.popleft()
+                if not starts:
+                    del self.starts[key]
+            for key in list(self.idle):
+                if key in self.refilling:
+                    continue
+                idle = [game for game in self.idle[key] if game.process.poll() is None]
+                target = self._target(key)
+                surplus.extend(idle[target:])
+                if target:
+                    self.idle[key] = idle[:target]
+                else:
+                    del self.idle[key]
+        for game in surplus:
+            print(f"[WarmPool] Retiring idle server {game.room_id} of {game.meta.get('game_id')}")
+            self._retire(game)
+    
+    def _retire_other_versions(self, game_id, version):
+        """Stop idle servers of versions rooms no longer start"""
+        with self.lock:
+            stale = [key for key in self.idle if key[0] == game_id and key[1] != version]
+            games = [game for key in stale for game in self.idle.pop(key)]
+        for game in games:
+            self._retire(game)
+    
+    def _retire(self, game):
+        self.supervisor.stop(game.room_id)
+        self.ports.release(game.room_id, game.meta.get('port'))